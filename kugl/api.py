@@ -12,6 +12,7 @@ from kugl.util import (
     parse_age,
     parse_utc,
     run,
+    run_async,
     to_age,
     to_utc,
 )
@@ -25,6 +26,7 @@ __all__ = [
     "parse_age",
     "parse_utc",
     "run",
+    "run_async",
     "to_age",
     "to_utc",
 ]
@@ -6,7 +6,7 @@ from abc import abstractmethod
 from dataclasses import dataclass
 from typing import Optional
 
-from kugl.util import parse_size, parse_cpu
+from kugl.util import parse_size, parse_cpu, parse_sizes, parse_cpus
 
 # What container name is considered the "main" container, if present
 MAIN_CONTAINERS = ["main", "notebook", "app"]
@@ -67,6 +67,22 @@ class Limits:
             debug("got", result)
         return result
 
+    @classmethod
+    def total(cls, objs: list):
+        """Return the sum of the Limits extracted from several dictionaries, as from sum() over
+        Limits.extract(), but parsing each of the three columns in one batch."""
+        objs = [obj or {} for obj in objs]
+        cpu = _total(parse_cpus([obj.get("cpu") for obj in objs]))
+        gpu = _total(parse_cpus([obj.get("nvidia.com/gpu") for obj in objs]))
+        mem = _total(parse_sizes([obj.get("memory") for obj in objs]))
+        return Limits(cpu, gpu, mem)
+
+
+def _total(values: list):
+    """Sum values ignoring nulls, as Limits.__add__ does, or return None if all are null."""
+    present = [v for v in values if v is not None]
+    return sum(present) if present else None
+
 
 class ItemHelper:
     """Some common code for wrappers on JSON for pods, nodes et cetera."""
@@ -101,7 +117,10 @@ class Containerized:
         raise NotImplementedError()
 
     def resources(self, tag, debug=None):
-        return sum(Limits.extract(c.get("resources", {}).get(tag), debug) for c in self.containers)
+        objs = [c.get("resources", {}).get(tag) for c in self.containers]
+        if debug:
+            return sum(Limits.extract(obj, debug) for obj in objs)
+        return Limits.total(objs)
 
 
 class PodHelper(ItemHelper, Containerized):
@@ -130,6 +149,75 @@ class PodHelper(ItemHelper, Containerized):
         main = next(filter(lambda c: c["name"] in MAIN_CONTAINERS, self.containers), None)
         return main or self.containers[0]
 
+    @property
+    def status(self):
+        """Return the pod STATUS as shown by 'kubectl get pods', following printPod() in
+        kubectl's printers.go."""
+        spec, status = self["spec"], self.obj.get("status") or {}
+        phase = status.get("phase") or ""
+        reason = status.get("reason") or phase
+        conditions = status.get("conditions") or []
+        if any(
+            c.get("type") == "PodScheduled" and c.get("reason") == "SchedulingGated"
+            for c in conditions
+        ):
+            reason = "SchedulingGated"
+
+        init_containers = spec.get("initContainers") or []
+        # Sidecars are init containers that keep running alongside the others.
+        sidecars = {c["name"] for c in init_containers if c.get("restartPolicy") == "Always"}
+        initializing = False
+        for index, container in enumerate(status.get("initContainerStatuses") or []):
+            state = container.get("state") or {}
+            terminated, waiting = state.get("terminated"), state.get("waiting")
+            if terminated is not None and terminated.get("exitCode", 0) == 0:
+                continue
+            if container["name"] in sidecars and container.get("started"):
+                continue
+            if terminated is not None:
+                reason = "Init:" + _terminated_reason(terminated)
+            elif waiting and waiting.get("reason") not in (None, "", "PodInitializing"):
+                reason = "Init:" + waiting["reason"]
+            else:
+                reason = f"Init:{index}/{len(init_containers)}"
+            initializing = True
+            break
+
+        if not initializing or _condition_true(conditions, "Initialized"):
+            running = False
+            for container in reversed(status.get("containerStatuses") or []):
+                state = container.get("state") or {}
+                terminated, waiting = state.get("terminated"), state.get("waiting")
+                if waiting and waiting.get("reason"):
+                    reason = waiting["reason"]
+                elif terminated is not None:
+                    reason = _terminated_reason(terminated)
+                elif container.get("ready") and state.get("running") is not None:
+                    running = True
+            # A completed container doesn't make the pod complete if others are still running.
+            if reason == "Completed" and running:
+                reason = "Running" if _condition_true(conditions, "Ready") else "NotReady"
+
+        if self.metadata.get("deletionTimestamp"):
+            if status.get("reason") == "NodeLost":
+                reason = "Unknown"
+            elif phase not in ("Succeeded", "Failed"):
+                reason = "Terminating"
+        return reason
+
+
+def _terminated_reason(terminated: dict) -> str:
+    """Describe a terminated container with no reason given, as kubectl does."""
+    if terminated.get("reason"):
+        return terminated["reason"]
+    if terminated.get("signal"):
+        return f"Signal:{terminated['signal']}"
+    return f"ExitCode:{terminated.get('exitCode', 0)}"
+
+
+def _condition_true(conditions: list[dict], kind: str) -> bool:
+    return any(c.get("type") == kind and c.get("status") == "True" for c in conditions)
+
 
 class CronJobHelper(ItemHelper, Containerized):
     @property
@@ -0,0 +1,271 @@
+"""
+A client for the Kubernetes API server, used instead of kubectl with the setting
+kubernetes_transport: native.  Connections are kept open and reused, so after the first fetch
+from a context, fetches skip starting kubectl, reading kubeconfig, authenticating and the TLS
+handshake.
+"""
+
+import base64
+import gzip
+import http.client
+import io
+import json
+import os
+from pathlib import Path
+import ssl
+import subprocess as sp
+import tempfile
+from threading import Lock
+from typing import Iterator, Optional, Union
+from urllib.parse import urlparse
+
+import yaml
+
+from kugl.util import clock, debugging, fail, iter_items, kube_home, kugl_version, parse_utc
+
+# Media types for get_list(): whole objects, or just their metadata
+JSON = "application/json"
+METADATA_LIST = "application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1"
+
+# Clients by kubeconfig path and context; see client_for()
+_CLIENTS: dict[tuple[Path, str], "ApiClient"] = {}
+_CLIENTS_LOCK = Lock()
+
+
+def client_for(context: str) -> "ApiClient":
+    """Return the client for a kubeconfig context.  The client, and its connections, are reused
+    until the kubeconfig file changes."""
+    path = kube_home() / "config"
+    if not path.exists():
+        fail(f"Missing {path}, can't connect to context {context}")
+    mtime = path.stat().st_mtime
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get((path, context))
+        if client is None or client.config_mtime != mtime:
+            if client is not None:
+                client.close()
+            config = yaml.safe_load(path.read_text()) or {}
+            client = _CLIENTS[path, context] = ApiClient(config, path, context)
+            client.config_mtime = mtime
+    return client
+
+
+class ApiClient:
+    """Make GET requests to the API server of one kubeconfig context, over a pool of keep-alive
+    connections.  Supports the usual ways kubeconfig users authenticate: client certificates,
+    bearer tokens, token files, basic auth and exec plugins.  Auth provider plugins aren't
+    supported."""
+
+    def __init__(self, config: dict, path: Path, context: str):
+        """
+        :param config: the parsed kubeconfig
+        :param path: where the kubeconfig was read from, for relative paths in it
+        :param context: the context whose cluster and user to use
+        """
+        self.config_mtime = None
+        self._folder = path.parent
+        context_def = _named(config, "context", context, path)
+        cluster = _named(config, "cluster", context_def.get("cluster"), path)
+        user_name = context_def.get("user")
+        self._user = _named(config, "user", user_name, path) if user_name else {}
+        if "auth-provider" in self._user:
+            fail(f"Auth provider for user {user_name} needs kubernetes_transport: kubectl")
+        if not (server := cluster.get("server")):
+            fail(f"No server for cluster {context_def.get('cluster')} in {path}")
+        url = urlparse(server)
+        self._scheme, self._host, self._port = url.scheme, url.hostname, url.port
+        self._prefix = url.path.rstrip("/")
+        # The latest credential from an exec plugin, and when it expires
+        self._credential: Optional[dict] = None
+        self._credential_expiry: Optional[int] = None
+        self._idle: list[http.client.HTTPConnection] = []
+        self._lock = Lock()
+        self._cluster = cluster
+        # For new HTTPS connections, and the client certificate and key it presents; see _tls()
+        self._ssl: Optional[ssl.SSLContext] = None
+        self._ssl_cert: Optional[tuple] = None
+
+    def get_list(self, path: str, fields: dict, accept: str = JSON) -> Iterator[dict]:
+        """Request a list from the API server, yielding its items as they're decoded from the
+        response, which is gzipped if the server agrees.  The other members of the list are
+        added to `fields`, as with iter_items().
+
+        :param path: the API path and query, e.g. "/api/v1/pods?limit=500"
+        :param accept: JSON, or METADATA_LIST for a PartialObjectMetadataList
+        """
+        url = self._prefix + path
+        if debug := debugging("fetch"):
+            debug(f"requesting {self._host} GET {url}")
+        connection, response = self._request(url, accept)
+        if response.status == 401 and "exec" in self._user:
+            # The plugin's credential may have been revoked or expired early; get another and
+            # try once more.
+            connection.close()
+            with self._lock:
+                self._credential = None
+            connection, response = self._request(url, accept)
+        try:
+            if response.status != 200:
+                _fail_for_status(response, url)
+            if response.getheader("Content-Encoding") == "gzip":
+                stream = io.TextIOWrapper(gzip.GzipFile(fileobj=response), encoding="utf-8")
+            else:
+                stream = io.TextIOWrapper(response, encoding="utf-8")
+            yield from iter_items(stream, fields)
+            # Read any trailing whitespace, so the connection can be reused.
+            stream.read()
+            response.read()
+        except BaseException:
+            connection.close()
+            raise
+        with self._lock:
+            self._idle.append(connection)
+
+    def close(self):
+        with self._lock:
+            for connection in self._idle:
+                connection.close()
+            self._idle.clear()
+
+    def _request(
+        self, url: str, accept: str
+    ) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        tls = self._tls() if self._scheme == "https" else None
+        with self._lock:
+            reused = self._idle.pop() if self._idle else None
+        if reused is not None:
+            try:
+                reused.request("GET", url, headers=self._headers(accept))
+                return reused, reused.getresponse()
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the connection while it was idle; try a new one.
+                reused.close()
+        if self._scheme == "https":
+            connection = http.client.HTTPSConnection(self._host, self._port, context=tls)
+        else:
+            connection = http.client.HTTPConnection(self._host, self._port)
+        try:
+            connection.request("GET", url, headers=self._headers(accept))
+            return connection, connection.getresponse()
+        except BaseException:
+            connection.close()
+            raise
+
+    def _headers(self, accept: str) -> dict[str, str]:
+        headers = {
+            "Accept": accept,
+            "Accept-Encoding": "gzip",
+            "User-Agent": f"kugl/{kugl_version()}",
+        }
+        user = self._user
+        if token := user.get("token"):
+            headers["Authorization"] = f"Bearer {token}"
+        elif token_file := user.get("tokenFile"):
+            headers["Authorization"] = f"Bearer {self._path(token_file).read_text().strip()}"
+        elif "exec" in user:
+            if token := self._exec_credential().get("token"):
+                headers["Authorization"] = f"Bearer {token}"
+        elif "username" in user:
+            basic = f"{user['username']}:{user.get('password', '')}".encode()
+            headers["Authorization"] = f"Basic {base64.b64encode(basic).decode()}"
+        return headers
+
+    def _tls(self) -> ssl.SSLContext:
+        """Return the SSL context for new connections.  It's rebuilt when an exec plugin's
+        client certificate is renewed, since the context holds the certificate; connections
+        made with the old one are dropped."""
+        user = self._user
+        if "exec" in user:
+            credential = self._exec_credential()
+            cert, key = credential.get("clientCertificateData"), credential.get("clientKeyData")
+        elif self._ssl is not None:
+            return self._ssl
+        else:
+            cert, key = self._pem(user, "client-certificate"), self._pem(user, "client-key")
+        with self._lock:
+            if self._ssl is None or self._ssl_cert != (cert, key):
+                if self._ssl is not None:
+                    for connection in self._idle:
+                        connection.close()
+                    self._idle.clear()
+                self._ssl = self._ssl_context(self._cluster, cert, key)
+                self._ssl_cert = cert, key
+            return self._ssl
+
+    def _ssl_context(
+        self, cluster: dict, cert: Optional[str], key: Optional[str]
+    ) -> ssl.SSLContext:
+        context = ssl.create_default_context()
+        if cluster.get("insecure-skip-tls-verify"):
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        elif data := cluster.get("certificate-authority-data"):
+            context.load_verify_locations(cadata=base64.b64decode(data).decode())
+        elif path := cluster.get("certificate-authority"):
+            context.load_verify_locations(cafile=self._path(path))
+        if cert and key:
+            # The ssl module only loads these from files.
+            with tempfile.TemporaryDirectory() as folder:
+                cert_path, key_path = Path(folder, "cert.pem"), Path(folder, "key.pem")
+                cert_path.write_text(cert)
+                key_path.write_text(key)
+                context.load_cert_chain(cert_path, key_path)
+        return context
+
+    def _pem(self, user: dict, name: str) -> Optional[str]:
+        """Return a certificate or key given inline as base64, or by path."""
+        if data := user.get(f"{name}-data"):
+            return base64.b64decode(data).decode()
+        if path := user.get(name):
+            return self._path(path).read_text()
+        return None
+
+    def _exec_credential(self) -> dict:
+        """Return the status of the ExecCredential from the user's exec plugin, running the
+        plugin if there's no credential yet or it has expired."""
+        with self._lock:
+            expiry = self._credential_expiry
+            if self._credential is None or (expiry is not None and expiry <= clock.CLOCK.now()):
+                self._credential = self._run_exec()
+                self._credential_expiry = parse_utc(self._credential.get("expirationTimestamp"))
+            return self._credential
+
+    def _run_exec(self) -> dict:
+        spec = self._user["exec"]
+        command = spec["command"]
+        if "/" in command:
+            command = str(self._path(command))
+        args = [command, *(spec.get("args") or [])]
+        env = dict(os.environ, **{e["name"]: e["value"] for e in spec.get("env") or []})
+        info = dict(apiVersion=spec.get("apiVersion"), kind="ExecCredential")
+        env["KUBERNETES_EXEC_INFO"] = json.dumps({**info, "spec": {"interactive": False}})
+        if debug := debugging("fetch"):
+            debug(f"running {' '.join(args)}")
+        p = sp.run(args, stdout=sp.PIPE, stderr=sp.PIPE, encoding="utf-8", env=env)
+        if p.returncode != 0:
+            fail(f"failed to run [{' '.join(args)}] for credentials: {p.stderr.strip()}")
+        return json.loads(p.stdout).get("status") or {}
+
+    def _path(self, path: Union[str, Path]) -> Path:
+        """Resolve a path in the kubeconfig, which is relative to the kubeconfig's folder."""
+        return self._folder / Path(path).expanduser()
+
+
+def _named(config: dict, kind: str, name: Optional[str], path: Path) -> dict:
+    """Find e.g. the context, cluster or user with a given name in a kubeconfig."""
+    for entry in config.get(f"{kind}s") or []:
+        if entry.get("name") == name:
+            return entry.get(kind) or {}
+    fail(f"No {kind} named {name} in {path}")
+
+
+def _fail_for_status(response: http.client.HTTPResponse, url: str):
+    """Fail with the message from the Status object the API server returns with an error."""
+    body = response.read()
+    if response.getheader("Content-Encoding") == "gzip":
+        body = gzip.decompress(body)
+    try:
+        message = json.loads(body).get("message")
+    except ValueError:
+        message = None
+    fail(f"GET {url} failed: {response.status} {message or response.reason}")
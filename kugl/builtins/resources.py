@@ -6,7 +6,7 @@ from typing import Union, Optional
 
 from pydantic import model_validator
 
-from kugl.api import resource, fail, run, Resource
+from kugl.api import resource, fail, run, run_async, Resource
 from kugl.util import best_guess_parse, KPath, debugging
 
 
@@ -120,6 +120,10 @@ class ExecResource(Resource):
         _, out, _ = run(self.exec)
         return best_guess_parse(out)
 
+    async def get_objects_async(self):
+        _, out, _ = await run_async(self.exec)
+        return best_guess_parse(out)
+
     def cache_path(self):
         assert self.cache_key is not None  # should be covered by validator
         return f"{expandvars(self.cache_key)}/{self.name}.exec.json"
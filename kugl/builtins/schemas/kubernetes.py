@@ -6,23 +6,53 @@ FIXME: Remove references to non-API imports.
 FIXME: Don't use ArgumentParser in the API.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from fnmatch import fnmatch
+import hashlib
 import json
-import os
+import re
 from argparse import ArgumentParser
-from threading import Thread
+from typing import Iterator, Optional
+from urllib.parse import urlencode
 
 from pydantic import model_validator
 
-from ..helpers import Limits, ItemHelper, PodHelper, JobHelper, CronJobHelper
+from .. import kubeapi
+from ..helpers import Limits, ItemHelper, PodHelper, JobHelper, CronJobHelper, Containerized
 from kugl.api import table, fail, resource, run, parse_utc, Resource, column
-from kugl.util import WHITESPACE_RE, kube_context
+from kugl.util import (
+    kube_context,
+    kube_contexts,
+    ItemStream,
+    iter_items,
+    run_streaming,
+)
+
+# Values we're sure can be used in label and field selectors without quoting
+SELECTOR_VALUE_RE = re.compile(r"^[a-zA-Z0-9]([-a-zA-Z0-9_./]*[a-zA-Z0-9])?$")
 
 
 @resource("kubernetes", schema_defaults=["kubernetes"])
 class KubernetesResource(Resource):
     namespaced: bool
+    # API group and version, e.g. "v1" or "batch/v1".  If known, the resource is fetched in pages.
+    api: Optional[str] = None
+    # Number of items per page
+    chunk_size: int = 500
     _all_ns: bool
     _ns: str
+    # Selectors for 'kubectl get' derived from query conditions, see narrow()
+    _labels: dict[str, Optional[str]] = {}
+    _fields: dict[str, str] = {}
+    # Context from --context, or the one this copy fetches from for --contexts
+    _context: Optional[str] = None
+    # Contexts from --contexts
+    _contexts: Optional[list[str]] = None
+    # From the kubernetes_transport setting
+    _transport: str = "kubectl"
+    # Whether to fetch just the items' metadata, see narrow_to_metadata()
+    _metadata_only: bool = False
 
     @model_validator(mode="after")
     @classmethod
@@ -36,10 +66,20 @@ class KubernetesResource(Resource):
     def add_cli_options(cls, ap: ArgumentParser):
         ap.add_argument("-a", "--all", "--all-namespaces", dest="all", default=False, action="store_true")
         ap.add_argument("-n", "--namespace", type=str)
+        ap.add_argument("--context", type=str)
+        ap.add_argument("--contexts", type=str, metavar="PATTERNS")
+
+    def handle_settings(self, settings):
+        self._transport = settings.kubernetes_transport
 
     def handle_cli_options(self, args):
         if args.all and args.namespace:
             fail("Cannot use both -a/--all and -n/--namespace")
+        self._context = getattr(args, "context", None)
+        patterns = getattr(args, "contexts", None)
+        if self._context and patterns:
+            fail("Cannot use both --context and --contexts")
+        self._contexts = self._matching_contexts(patterns) if patterns else None
         if args.all:
             self._ns = "__all"
             self._all_ns = True
@@ -47,68 +87,175 @@ class KubernetesResource(Resource):
             self._ns = args.namespace or "default"
             self._all_ns = False
 
-    def cache_path(self) -> str:
-        return f"{kube_context()}/{self._ns}.{self.name}.json"
+    @staticmethod
+    def _matching_contexts(patterns: str) -> list[str]:
+        """Return the configured contexts matching any of a comma-separated list of patterns,
+        e.g. "prod-*,staging"."""
+        patterns = [p for p in patterns.split(",") if p]
+        contexts = [c for c in kube_contexts() if any(fnmatch(c, p) for p in patterns)]
+        if not contexts:
+            fail(f"No kubernetes contexts match {','.join(patterns)}")
+        return contexts
+
+    def contexts(self) -> Optional[list[str]]:
+        return self._contexts
+
+    def in_context(self, context: str) -> "KubernetesResource":
+        resource = self.model_copy(deep=True)
+        resource._context = context
+        resource._contexts = None
+        return resource
+
+    @property
+    def context(self) -> str:
+        """The context to fetch from"""
+        return self._context or kube_context()
+
+    def _kubectl(self, *args: str) -> list[str]:
+        """Return a kubectl command line, for the chosen context if there is one."""
+        context_flag = ["--context", self._context] if self._context else []
+        return ["kubectl", *context_flag, *args]
+
+    def narrow_to_metadata(self):
+        """Fetch PartialObjectMetadata rather than whole objects.  This needs an Accept header
+        'kubectl get --raw' can't send, so only the native transport does it."""
+        self._metadata_only = self._transport == "native" and self.api is not None
+
+    def narrow(self, conditions):
+        """Translate conditions on built-in tables to label and field selectors.  A condition
+        on the namespace, with -a, is the same as -n, so use that instead."""
+        for table_, values in conditions:
+            impl = getattr(table_, "impl", None)
+            if isinstance(impl, LabelsTable):
+                key, value = values.get("key"), values.get("value")
+                if key is not None and SELECTOR_VALUE_RE.match(key):
+                    self._labels[key] = value if value and SELECTOR_VALUE_RE.match(value) else None
+            else:
+                for column_name, field in getattr(impl, "_FIELD_SELECTORS", {}).items():
+                    value = values.get(column_name)
+                    if value is not None and SELECTOR_VALUE_RE.match(value):
+                        self._fields[field] = value
+        if self._all_ns and (namespace := self._fields.pop("metadata.namespace", None)):
+            self._ns = namespace
+            self._all_ns = False
 
-    def get_objects(self) -> dict:
+    def _selectors(self) -> dict[str, str]:
+        """Return the label and field selectors, if any, keyed by their API parameter names."""
+        selectors = {}
+        if self._labels:
+            labels = (key if v is None else f"{key}={v}" for key, v in sorted(self._labels.items()))
+            selectors["labelSelector"] = ",".join(labels)
+        if self._fields:
+            fields = (f"{field}={v}" for field, v in sorted(self._fields.items()))
+            selectors["fieldSelector"] = ",".join(fields)
+        return selectors
+
+    def _selector_flags(self) -> list[str]:
+        selectors = self._selectors()
+        flags = []
+        if "labelSelector" in selectors:
+            flags += ["-l", selectors["labelSelector"]]
+        if "fieldSelector" in selectors:
+            flags += ["--field-selector", selectors["fieldSelector"]]
+        return flags
+
+    def fetch_context(self) -> str:
+        return self.context
+
+    def cache_path(self) -> str:
+        # Selective and metadata-only fetches are cached separately from each other and from
+        # complete ones.
+        name = f"{self.name}.meta" if self._metadata_only else self.name
+        if flags := self._selector_flags():
+            digest = hashlib.sha1(" ".join(flags).encode()).hexdigest()[:12]
+            return f"{self.context}/{self._ns}.{name}.{digest}.json"
+        return f"{self.context}/{self._ns}.{name}.json"
+
+    def get_objects(self) -> ItemStream:
         """Fetch resources from Kubernetes using kubectl.
 
-        :return: JSON as output by "kubectl get {self.name} -o json"
+        :return: JSON as output by "kubectl get {self.name} -o json", whose items are decoded
+            from the output as it's read, rather than all at once
         """
-        unit_testing = "KUGL_UNIT_TESTING" in os.environ
         namespace_flag = ["--all-namespaces"] if self._all_ns else ["-n", self._ns]
-        if self.name == "pods":
-            pod_statuses = {}
-
-            # Kick off a thread to get pod statuses
-            def _fetch():
-                _, output, _ = run(["kubectl", "get", "pods", *namespace_flag])
-                pod_statuses.update(self._pod_status_from_pod_list(output))
-
-            status_thread = Thread(target=_fetch, daemon=True)
-            status_thread.start()
-            # In unit tests, wait for pod status here so the log order is deterministic.
-            if unit_testing:
-                status_thread.join()
+        fields = {}
+        if self.api:
+            return ItemStream(self._paged_items(fields), fields)
+        return ItemStream(self._streamed_items(namespace_flag, fields), fields)
+
+    def _streamed_items(self, namespace_flag: list[str], fields: dict) -> Iterator[dict]:
+        """Yield the items output by 'kubectl get -o json'."""
         if self.namespaced:
-            _, output, _ = run(["kubectl", "get", self.name, *namespace_flag, "-o", "json"])
-        else:
-            _, output, _ = run(["kubectl", "get", self.name, "-o", "json"])
-        data = json.loads(output)
-        if self.name == "pods":
-            # Add pod status to pods
-            if not unit_testing:
-                status_thread.join()
-
-            def pod_with_updated_status(pod):
-                metadata = pod["metadata"]
-                status = pod_statuses.get(f"{metadata['namespace']}/{metadata['name']}")
-                if status:
-                    pod["kubectl_status"] = status
-                    return pod
-                return None
-
-            data["items"] = list(filter(None, map(pod_with_updated_status, data["items"])))
-        return data
-
-    def _pod_status_from_pod_list(self, output) -> dict[str, str]:
-        """
-        Convert the tabular output of 'kubectl get pods' to JSON.
-        :return: a dict mapping "namespace/name" to status
-        """
-        rows = [WHITESPACE_RE.split(line.strip()) for line in output.strip().split("\n")]
-        if len(rows) < 2:
-            return {}
-        header, rows = rows[0], rows[1:]
-        name_index = header.index("NAME")
-        status_index = header.index("STATUS")
-        # It would be nice if 'kubectl get pods' printed the UID, but it doesn't, so use
-        # "namespace/name" as the key.  (Can't use a tuple since this has to be JSON-dumped.)
-        if self._all_ns:
-            namespace_index = header.index("NAMESPACE")
-            return {f"{row[namespace_index]}/{row[name_index]}": row[status_index] for row in rows}
+            args = self._kubectl("get", self.name, *namespace_flag, "-o", "json")
         else:
-            return {f"{self._ns}/{row[name_index]}": row[status_index] for row in rows}
+            args = self._kubectl("get", self.name, "-o", "json")
+        with run_streaming(args + self._selector_flags()) as output:
+            yield from iter_items(output, fields)
+
+    def _paged_items(self, fields: dict) -> Iterator[dict]:
+        """Yield the items of the resource list, fetched a page at a time from the API server
+        using 'kubectl get --raw', or directly with the native transport.  Unlike 'kubectl get
+        -o json', this doesn't hold the whole list in memory before printing any of it, and the
+        next page is fetched while the items of the previous one are consumed."""
+        path = self._api_path()
+        params = {"limit": self.chunk_size, **self._selectors()}
+        version = None
+        client = kubeapi.client_for(self.context) if self._transport == "native" else None
+        accept = kubeapi.METADATA_LIST if self._metadata_only else kubeapi.JSON
+
+        def fetch_page(token: Optional[str]) -> dict:
+            query = urlencode({**params, "continue": token} if token else params)
+            if client is not None:
+                page = {}
+                page["items"] = list(client.get_list(f"{path}?{query}", page, accept))
+                return page
+            _, output, _ = run(self._kubectl("get", "--raw", f"{path}?{query}"))
+            return json.loads(output)
+
+        def submit(token: Optional[str]):
+            # In this thread's context, so a fetch timeout can kill the command; see run().
+            return pool.submit(copy_context().run, fetch_page, token)
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = submit(None)
+            while future is not None:
+                page = future.result()
+                metadata = page.get("metadata") or {}
+                token = metadata.get("continue")
+                # All pages are from the same snapshot; keep its version for watch_command()
+                version = version or metadata.get("resourceVersion", "")
+                future = submit(token) if token else None
+                # Items in a raw list lack these, but 'kubectl get -o json' fills them in.
+                kind = page.get("kind", "").removesuffix("List")
+                api_version = page.get("apiVersion")
+                for item in page.get("items") or []:
+                    item.setdefault("apiVersion", api_version)
+                    item.setdefault("kind", kind)
+                    yield item
+        fields.update(apiVersion="v1", kind="List", metadata={"resourceVersion": version})
+
+    def _api_path(self) -> str:
+        prefix = "/api" if self.api == "v1" else "/apis"
+        namespace = f"/namespaces/{self._ns}" if self.namespaced and not self._all_ns else ""
+        return f"{prefix}/{self.api}{namespace}/{self.name}"
+
+    def watch_command(self, resource_version: str, timeout: int = 0) -> Optional[list[str]]:
+        # Watch only complete lists, since a watch per combination of selectors could add up.
+        if not self.api or self._selectors() or self._metadata_only:
+            return None
+        params = dict(watch=1, resourceVersion=resource_version, allowWatchBookmarks="true")
+        if not timeout:
+            return self._kubectl("get", "--raw", f"{self._api_path()}?{urlencode(params)}")
+        # The server ends the watch after timeoutSeconds; the request timeout, a little later,
+        # covers a connection that has silently died.
+        params["timeoutSeconds"] = timeout
+        path = f"{self._api_path()}?{urlencode(params)}"
+        return self._kubectl("get", "--raw", path, f"--request-timeout={timeout + 30}s")
+
+
+def _resources(thing: Containerized, tag: str, wanted: bool, debug) -> tuple:
+    """Sum the requests or limits across containers, unless the query doesn't use them."""
+    return thing.resources(tag, debug=debug).as_tuple() if wanted else (None, None, None)
 
 
 @table(schema="kubernetes", name="nodes", resource="nodes")
@@ -124,19 +271,33 @@ class NodesTable:
         column("mem_cap", "INTEGER", "memory capacity, in bytes"),
     ]
 
+    # Columns usable in field selectors, see KubernetesResource.narrow
+    _FIELD_SELECTORS = {"name": "metadata.name"}
+    # Columns populated from metadata alone, see KubernetesResource.narrow_to_metadata
+    _METADATA_COLUMNS = {"name", "uid"}
+
     def columns(self):
         return self._COLUMNS
 
+    def item_key(self):
+        return "uid"
+
     def make_rows(self, context) -> list[tuple[dict, tuple]]:
+        want_alloc = context.wants("cpu_alloc", "gpu_alloc", "mem_alloc")
+        want_cap = context.wants("cpu_cap", "gpu_cap", "mem_cap")
+        debug, no_limits = context.debug, Limits(None, None, None)
         for item in context.data["items"]:
             node = ItemHelper(item)
+            status = item.get("status") or {}
+            alloc = Limits.extract(status["allocatable"], debug) if want_alloc else no_limits
+            cap = Limits.extract(status["capacity"], debug) if want_cap else no_limits
             yield (
                 item,
                 (
                     node.name,
                     node.metadata.get("uid"),
-                    *Limits.extract(node["status"]["allocatable"], debug=context.debug).as_tuple(),
-                    *Limits.extract(node["status"]["capacity"], debug=context.debug).as_tuple(),
+                    *alloc.as_tuple(),
+                    *cap.as_tuple(),
                 ),
             )
 
@@ -170,10 +331,32 @@ class PodsTable:
         column("mem_lim", "INTEGER", "memory limit, or null"),
     ]
 
+    # Columns usable in field selectors, see KubernetesResource.narrow
+    _FIELD_SELECTORS = {
+        "name": "metadata.name",
+        "namespace": "metadata.namespace",
+        "node_name": "spec.nodeName",
+        "phase": "status.phase",
+    }
+    # Columns populated from metadata alone, see KubernetesResource.narrow_to_metadata
+    _METADATA_COLUMNS = {"name", "uid", "namespace", "creation_ts", "deletion_ts", "is_daemon"}
+
     def columns(self):
         return self._COLUMNS
 
+    def item_key(self):
+        return "uid"
+
     def make_rows(self, context) -> list[tuple[dict, tuple]]:
+        want_created = context.wants("creation_ts")
+        want_deleted = context.wants("deletion_ts")
+        want_daemon = context.wants("is_daemon")
+        want_command = context.wants("command")
+        want_status = context.wants("status")
+        want_node = context.wants("node_name")
+        want_phase = context.wants("phase")
+        want_requests = context.wants("cpu_req", "gpu_req", "mem_req")
+        want_limits = context.wants("cpu_lim", "gpu_lim", "mem_lim")
         for item in context.data["items"]:
             pod = PodHelper(item)
             yield (
@@ -182,15 +365,15 @@ class PodsTable:
                     pod.name,
                     pod.metadata.get("uid"),
                     pod.namespace,
-                    pod["spec"].get("nodeName"),
-                    parse_utc(pod.metadata["creationTimestamp"]),
-                    parse_utc(pod.metadata.get("deletionTimestamp")),
-                    1 if pod.is_daemon else 0,
-                    pod.command,
-                    pod["status"]["phase"],
-                    pod["kubectl_status"],
-                    *pod.resources("requests", debug=context.debug).as_tuple(),
-                    *pod.resources("limits", debug=context.debug).as_tuple(),
+                    pod["spec"].get("nodeName") if want_node else None,
+                    parse_utc(pod.metadata["creationTimestamp"]) if want_created else None,
+                    parse_utc(pod.metadata.get("deletionTimestamp")) if want_deleted else None,
+                    (1 if pod.is_daemon else 0) if want_daemon else None,
+                    pod.command if want_command else None,
+                    pod["status"]["phase"] if want_phase else None,
+                    pod.status if want_status else None,
+                    *_resources(pod, "requests", want_requests, context.debug),
+                    *_resources(pod, "limits", want_limits, context.debug),
                 ),
             )
 
@@ -214,10 +397,21 @@ class JobsTable:
         column("mem_lim", "INTEGER", "memory limit, or null"),
     ]
 
+    # Columns usable in field selectors, see KubernetesResource.narrow
+    _FIELD_SELECTORS = {"name": "metadata.name", "namespace": "metadata.namespace"}
+    # Columns populated from metadata alone, see KubernetesResource.narrow_to_metadata
+    _METADATA_COLUMNS = {"name", "uid", "namespace"}
+
     def columns(self):
         return self._COLUMNS
 
+    def item_key(self):
+        return "uid"
+
     def make_rows(self, context) -> list[tuple[dict, tuple]]:
+        want_status = context.wants("status")
+        want_requests = context.wants("cpu_req", "gpu_req", "mem_req")
+        want_limits = context.wants("cpu_lim", "gpu_lim", "mem_lim")
         for item in context.data["items"]:
             job = JobHelper(item)
             yield (
@@ -226,9 +420,9 @@ class JobsTable:
                     job.name,
                     job.metadata.get("uid"),
                     job.namespace,
-                    job.status,
-                    *job.resources("requests", debug=context.debug).as_tuple(),
-                    *job.resources("limits", debug=context.debug).as_tuple(),
+                    job.status if want_status else None,
+                    *_resources(job, "requests", want_requests, context.debug),
+                    *_resources(job, "limits", want_limits, context.debug),
                 ),
             )
 
@@ -236,6 +430,10 @@ class JobsTable:
 class LabelsTable:
     """Base class for all built-in label tables; subclasses need only define UID_FIELD."""
 
+    @property
+    def _METADATA_COLUMNS(self):
+        return {self.UID_FIELD, "key", "value"}
+
     def columns(self):
         return [
             column(self.UID_FIELD, "TEXT", "object UID, from metadata.uid"),
@@ -243,6 +441,9 @@ class LabelsTable:
             column("value", "TEXT", "label value"),
         ]
 
+    def item_key(self):
+        return self.UID_FIELD
+
     def make_rows(self, context) -> list[tuple[dict, tuple]]:
         for item in context.data["items"]:
             thing = ItemHelper(item)
@@ -284,10 +485,20 @@ class CronJobsTable:
         column("mem_lim", "INTEGER", "memory limit, or null"),
     ]
 
+    # Columns usable in field selectors, see KubernetesResource.narrow
+    _FIELD_SELECTORS = {"name": "metadata.name", "namespace": "metadata.namespace"}
+
     def columns(self):
         return self._COLUMNS
 
+    def item_key(self):
+        return "uid"
+
     def make_rows(self, context) -> list[tuple[dict, tuple]]:
+        want_scheduled = context.wants("last_schedule_ts")
+        want_succeeded = context.wants("last_success_ts")
+        want_requests = context.wants("cpu_req", "gpu_req", "mem_req")
+        want_limits = context.wants("cpu_lim", "gpu_lim", "mem_lim")
         for item in context.data["items"]:
             cj = CronJobHelper(item)
             status = item.get("status", {})
@@ -300,10 +511,10 @@ class CronJobsTable:
                     item["spec"]["schedule"],
                     1 if item["spec"].get("suspend") else 0,
                     len(status.get("active", [])),
-                    parse_utc(status.get("lastScheduleTime")),
-                    parse_utc(status.get("lastSuccessfulTime")),
-                    *cj.resources("requests", debug=context.debug).as_tuple(),
-                    *cj.resources("limits", debug=context.debug).as_tuple(),
+                    parse_utc(status.get("lastScheduleTime")) if want_scheduled else None,
+                    parse_utc(status.get("lastSuccessfulTime")) if want_succeeded else None,
+                    *_resources(cj, "requests", want_requests, context.debug),
+                    *_resources(cj, "limits", want_limits, context.debug),
                 ),
             )
 
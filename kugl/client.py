@@ -0,0 +1,69 @@
+"""
+Command-line entry point for 'kuglc', a thin client for 'kugl serve'.
+
+This imports only standard modules, unless no server is running, in which case the query is
+run as 'kugl' would run it.  So with a server running, each query costs little more than
+starting Python.
+"""
+
+import json
+import os
+from pathlib import Path
+import socket
+import sys
+from typing import Optional
+
+
+def socket_path() -> Path:
+    """Where 'kugl serve' listens by default.  This is kugl_cache() / "serve.sock", but avoids
+    importing kugl.util."""
+    # KUGL_CACHE override is for unit tests, not users
+    if "KUGL_CACHE" in os.environ:
+        return Path(os.environ["KUGL_CACHE"]) / "serve.sock"
+    return Path.home() / ".kuglcache" / "serve.sock"
+
+
+def is_serving(path: Optional[Path] = None) -> bool:
+    """Check whether a server is listening on a socket, without sending it a request."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path or socket_path()))
+            return True
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+
+
+def send(argv: list[str], path: Optional[Path] = None) -> Optional[dict]:
+    """Send a command line to the server.
+
+    :param argv: arguments as they would be given to 'kugl'
+    :param path: the server's socket, if not the default
+    :return: a dict with the command's exit "status", "stdout" and "stderr", or None if no
+        server is listening
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path or socket_path()))
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        sock.sendall(json.dumps({"argv": argv}).encode() + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        response = b"".join(iter(lambda: sock.recv(1 << 16), b""))
+    if not response:
+        return {"status": 1, "stdout": "", "stderr": "kugl: server closed the connection\n"}
+    return json.loads(response)
+
+
+def main() -> None:
+    response = send(sys.argv[1:])
+    if response is None:
+        from kugl.main import main
+
+        return main()
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    sys.exit(response["status"])
+
+
+if __name__ == "__main__":
+    main()
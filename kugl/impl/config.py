@@ -3,13 +3,19 @@ Pydantic models for configuration files.
 """
 
 from os.path import expandvars, expanduser
-from typing import Optional, Tuple, Callable, Union
+from typing import Literal, Optional, Tuple, Callable, Union
 
 import jmespath
 from pydantic import BaseModel, ConfigDict, ValidationError
 from pydantic.functional_validators import model_validator
 
-from .extract import ColumnType, KUGL_TYPE_TO_SQL_TYPE, LabelExtractor, PathExtractor
+from .extract import (
+    ColumnType,
+    Extractor,
+    KUGL_TYPE_TO_SQL_TYPE,
+    LabelExtractor,
+    PathExtractor,
+)
 from kugl.util import (
     Age,
     ConfigPath,
@@ -35,16 +41,28 @@ class Settings(BaseModel):
 
     model_config = ConfigDict(extra="forbid", arbitrary_types_allowed=True)
     cache_timeout: Union[Age, int] = Age(120)
+    # How long after cached data expires it may still be used, while it's refreshed in the
+    # background for the next query
+    cache_grace: Union[Age, int] = Age(0)
     reckless: bool = False
     no_headers: bool = False
     init_path: list[str] = []
+    cache_format: Literal["json", "binary"] = "json"
+    # Limits on concurrent fetches, overall and from one place e.g. a Kubernetes context
+    fetch_limit: int = 16
+    fetch_limit_per_context: int = 8
+    # How long to allow for fetching each resource, if limited
+    fetch_timeout: Union[Age, int, None] = None
+    # How to fetch Kubernetes resources: by running kubectl, or from the API server directly
+    kubernetes_transport: Literal["kubectl", "native"] = "kubectl"
 
     @model_validator(mode="before")
     @classmethod
     def preconvert_timeout(cls, model: dict) -> dict:
         # Pydantic doesn't handle Age objects in the config file, so we convert them to seconds here.
-        if "cache_timeout" in model and isinstance(model["cache_timeout"], str):
-            model["cache_timeout"] = parse_age(model["cache_timeout"])
+        for field in ["cache_timeout", "cache_grace", "fetch_timeout"]:
+            if field in model and isinstance(model[field], str):
+                model[field] = parse_age(model[field])
         return model
 
     @model_validator(mode="after")
@@ -62,9 +80,29 @@ class Settings(BaseModel):
         # If timeout specified in config, convert back to Age
         if isinstance(settings.cache_timeout, int):
             settings.cache_timeout = Age(settings.cache_timeout)
+        if isinstance(settings.cache_grace, int):
+            settings.cache_grace = Age(settings.cache_grace)
+        if isinstance(settings.fetch_timeout, int):
+            settings.fetch_timeout = Age(settings.fetch_timeout)
         return settings
 
 
+def qualified_name(name: str) -> str:
+    """Qualify a resource name with its schema; as with table names, an unqualified name
+    refers to the Kubernetes schema."""
+    return name if "." in name else f"{DEFAULT_SCHEMA}.{name}"
+
+
+def _convert_cache_ages(model: dict) -> dict:
+    """Convert the timeouts in a cache: section to Age objects, which Pydantic can't do."""
+    cache = model.get("cache") if isinstance(model, dict) else None
+    if isinstance(cache, dict):
+        model["cache"] = {
+            name: Age(age) if isinstance(age, (str, int)) else age for name, age in cache.items()
+        }
+    return model
+
+
 class Shortcut(BaseModel):
     """Holds one entry from the shortcuts: section of a user config file."""
 
@@ -101,6 +139,20 @@ class UserInit(SecondaryUserInit):
 
     model_config = ConfigDict(extra="forbid", arbitrary_types_allowed=True)
     settings: Optional[Settings] = Settings()
+    # Maps a resource name, qualified as by qualified_name(), to the age at which its cached
+    # data is stale.  This overrides a schema's cache: section and settings.cache_timeout.
+    cache: dict[str, Age] = {}
+
+    @model_validator(mode="before")
+    @classmethod
+    def _convert_cache(cls, model: dict) -> dict:
+        return _convert_cache_ages(model)
+
+    @model_validator(mode="after")
+    @classmethod
+    def _qualify_cache(cls, init: "UserInit") -> "UserInit":
+        init.cache = {qualified_name(name): age for name, age in init.cache.items()}
+        return init
 
 
 class Column(BaseModel):
@@ -158,6 +210,17 @@ class UserColumn(Column):
     def extract(self, obj: object, context) -> object:
         return self._extractor(obj, context)
 
+    @property
+    def extractor(self) -> Extractor:
+        return self._extractor
+
+    @property
+    def from_metadata(self) -> bool:
+        """Whether the column is extracted from the metadata of a table's row objects."""
+        if self.label:
+            return not any(label.startswith("^") for label in self.label)
+        return self.path is not None and self.path.startswith("metadata.")
+
 
 class ExtendTable(BaseModel):
     """Holds the extend: section from a user config file."""
@@ -189,13 +252,20 @@ class CreateTable(ExtendTable):
 class UserConfig(ConfigContent):
     """The root model for a user config file; holds the complete file content."""
 
-    model_config = ConfigDict(extra="forbid")
+    model_config = ConfigDict(extra="forbid", arbitrary_types_allowed=True)
     resources: list[ResourceDef] = []
     extend: list[ExtendTable] = []
     create: list[CreateTable] = []
+    # Maps resource names to the age at which their cached data is stale
+    cache: dict[str, Age] = {}
     # User can put chunks of reusable YAML under here, we will ignore
     utils: Optional[object] = None
 
+    @model_validator(mode="before")
+    @classmethod
+    def _convert_cache(cls, model: dict) -> dict:
+        return _convert_cache_ages(model)
+
 
 # FIXME use typevars
 def parse_model(
@@ -217,6 +287,11 @@ def parse_model(
         fail("\n".join(errors))
 
 
+# Maps (model class, pathname) to the text of a configuration file and the model parsed from it,
+# so that a long-running process (see 'kugl serve') only parses files again if they change.
+_PARSED_FILES: dict[tuple[type, str], tuple[str, object]] = {}
+
+
 # FIXME use typevars
 def parse_file(model_class, path: ConfigPath) -> object:
     """Parse a configuration file into a model instance.
@@ -227,7 +302,14 @@ def parse_file(model_class, path: ConfigPath) -> object:
     else:
         if path.is_world_writeable():
             fail(f"{path} is world writeable, refusing to run")
-        result = parse_model(model_class, path.parse() or {})
+        text = path.read_text()
+        key = (model_class, str(path))
+        parsed = _PARSED_FILES.get(key)
+        if parsed is None or parsed[0] != text:
+            parsed = text, parse_model(model_class, path.parse() or {})
+            _PARSED_FILES[key] = parsed
+        # Callers may modify what they get, e.g. settings from the command line
+        result = parsed[1].model_copy(deep=True)
     if isinstance(result, ConfigContent):
         result._source = path
     return result
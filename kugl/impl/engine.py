@@ -1,14 +1,25 @@
+import asyncio
 import os
-from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 import json
 from dataclasses import dataclass
+from functools import partial
+from collections import defaultdict
+from itertools import chain
 from pathlib import Path
 import sys
-from typing import Tuple, Set, Optional, Literal
+from typing import Tuple, Set, Optional, Literal, Union
 
 from tabulate import tabulate
 
-from .config import Settings, DEFAULT_SCHEMA
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .config import Settings
+from .fetch import FetchScheduler
+from .planner import QueryPlanner
 from .registry import Schema, Resource, Registry
 from ..util import (
     fail,
@@ -22,8 +33,12 @@ from ..util import (
     Age,
     KPath,
     Query,
+    ItemStream,
+    temp_path,
 )
-from .tables import Table
+from .store import StoreKey, TableStore
+from .tables import Table, build_tables, create_indexes
+from . import watch
 
 # Cache behaviors
 ALWAYS_UPDATE, CHECK, NEVER_UPDATE = 1, 2, 3
@@ -37,41 +52,70 @@ class ResourceRef:
 
     schema: Schema
     resource: Resource
+    # Set if the resource is fetched from several contexts; see Resource.contexts()
+    context: Optional[str] = None
 
     @property
-    def name(self):
+    def base_name(self):
+        """The schema-qualified resource name, as used in config files and with -u"""
         return f"{self.schema.name}.{self.resource.name}"
 
+    @property
+    def name(self):
+        return self.base_name if self.context is None else f"{self.base_name}@{self.context}"
+
+    def in_contexts(self) -> list["ResourceRef"]:
+        """Return a reference per context the resource is fetched from, or just this one."""
+        if (contexts := self.resource.contexts()) is None:
+            return [self]
+        return [ResourceRef(self.schema, self.resource.in_context(c), c) for c in contexts]
+
+    def _key(self):
+        return self.schema.name, self.resource.name, self.context or ""
+
     def __eq__(self, other):
-        return self.schema.name == other.schema.name and self.resource.name == other.resource.name
+        return self._key() == other._key()
 
     def __hash__(self):
-        return hash((self.schema.name, self.resource.name))
+        return hash(self._key())
 
     def __lt__(self, other):
-        return (self.schema.name, self.resource.name) < (
-            other.schema.name,
-            other.resource.name,
-        )
+        return self._key() < other._key()
 
 
 class Engine:
     """Entry point for executing Kugl queries."""
 
-    def __init__(self, args, cache_flag: CacheFlag, settings: Settings):
+    def __init__(
+        self,
+        args,
+        cache_flag: CacheFlag,
+        settings: Settings,
+        cache_timeouts: Optional[dict[str, Age]] = None,
+    ):
         """
         :param args: the parsed command line arguments, from argparse
         :param cache_flag: the cache behavior, from -c or -u option
         :param config: the parsed user settings file
+        :param cache_timeouts: per-resource cache timeouts from the cache: section of the user
+            init file, keyed by qualified resource name
         """
         self.args = args
         self.cache_flag = cache_flag
         self.settings = settings
-        self.cache = DataCache(kugl_cache(), self.settings.cache_timeout)
+        self.cache_timeouts = cache_timeouts or {}
+        self.cache = DataCache(
+            kugl_cache(), self.settings.cache_timeout, self.settings.cache_format == "binary"
+        )
         # Maps resource name e.g. "pods" to the response from "kubectl get pods -o json"
         self.data = {}
+        # Maps resource name to the modification time of the cache file the data came from
+        self.cache_mtimes = {}
+        # Resources used from the cache after they expired, see Settings.cache_grace
+        self.revalidate: set[ResourceRef] = set()
         self.db = SqliteDb()
         add_custom_functions(self.db.conn)
+        self.store = TableStore(self.db, self.cache.dir / "tables.db")
 
     def query_and_format(self, query: Query) -> str:
         """Execute a Kugl query and format the results for stdout."""
@@ -87,6 +131,134 @@ class Engine:
         """Execute a Kugl query but don't format the results.
         :return: a tuple of (rows, column names)
         """
+        schemas, multi_schema, columns, indexes, tables, resource_refs = self._plan(query)
+
+        # Identify what to fetch vs what's stale or expired.
+        # With 'kugl serve --watch', the cache is kept current for watched resources.
+        watched = set()
+        if watch.WATCHES is not None:
+            paths = {self.cache.cache_path(r): r for r in resource_refs}
+            resources = {path: r.resource for path, r in paths.items()}
+            current = watch.WATCHES.sync(resources, self.cache.binary)
+            watched = {paths[path] for path in current}
+        # Resources named with -u are refreshed regardless of age.
+        update = set(getattr(self.args, "update", None) or [])
+        for name in update:
+            schema_name, resource_name = name.split(".", 1)
+            schema = schemas.get(schema_name)
+            if schema is not None and resource_name not in schema.resource_names():
+                fail(f"-u names unknown resource '{name}'")
+        timeouts = {r: self._cache_timeout(r) for r in resource_refs}
+        update = {r for r in resource_refs if r.base_name in update} - watched
+        refreshable, max_staleness = self.cache.advise_refresh(
+            resource_refs - watched, self.cache_flag, timeouts=timeouts, update=update
+        )
+        # Data that expired within the grace period is used anyway, and the caller refreshes
+        # it in the background for the next query.
+        grace = self.settings.cache_grace
+        if self.cache_flag == CHECK and grace.value > 0:
+            stale = self.cache.within_grace(refreshable - update, timeouts, grace)
+            refreshable -= stale.keys()
+            self.revalidate = set(stale)
+            max_staleness = max([max_staleness or 0, *stale.values()])
+        if not self.settings.reckless and max_staleness is not None:
+            print(f"(Data may be up to {max_staleness} seconds old.)", file=sys.stderr)
+            # Make sure the warning is seen, unless the user prefers fast answers.
+            if grace.value == 0:
+                clock.CLOCK.sleep(0.5)
+
+        # Tables built from cached data that hasn't changed since the last query can be reused
+        # from the table store.  If that's true of every table using a resource, the resource
+        # data needn't be loaded at all.
+        stored = {}
+        for table, refs in tables:
+            for ref in refs:
+                if ref.resource.cacheable and ref not in refreshable:
+                    key = self._store_key(table, ref, self.cache.mtime(ref))
+                    if key.cache_mtime is not None and (
+                        name := self.store.lookup(key, columns[table])
+                    ):
+                        stored[table, ref] = name
+        needed = {ref for table, refs in tables for ref in refs if (table, ref) not in stored}
+
+        # Retrieve resource data in parallel.  If actually fetching externally, update the cache;
+        # otherwise just read from the cache.
+        # Only one Kugl process at a time fetches a cacheable resource.  If another one updated
+        # the cache while we waited to, use what it fetched.
+        seen_mtimes = {ref: self.cache.mtime(ref) for ref in refreshable if ref.resource.cacheable}
+
+        # Create tables in SQLite.  Those built from cacheable resources go in the table store.
+        # The tables using a resource are built together, in one pass over its data, as soon as
+        # it's available, while other resources are fetched.
+        by_ref: dict[ResourceRef, list[Table]] = defaultdict(list)
+        for table, refs in tables:
+            for ref in refs:
+                by_ref[ref].append(table)
+        with self._scheduler() as scheduler:
+            fetches = {
+                ref: self._submit(scheduler, ref, refreshable, seen_mtimes) for ref in needed
+            }
+            for ref, ref_tables in by_ref.items():
+                if ref in fetches:
+                    scheduler.result(fetches[ref])
+                    self._save(ref, ref_tables, stored, columns)
+
+        # Tables whose data couldn't be stored are built in the query database.  Columns used
+        # in joins are indexed, as are those compared with constants if the index is stored for
+        # later queries.
+        unstored = defaultdict(list)
+        unindexed = []
+        for table, refs in tables:
+            table_name = f"{table.schema_name}.{table.name}" if multi_schema else table.name
+            stored_names = [stored.get((table, ref)) for ref in refs]
+            joined = {c for c, is_joined in indexes.get(table, {}).items() if is_joined}
+            if None not in stored_names:
+                for stored_name in stored_names:
+                    self.store.index(stored_name, indexes.get(table, {}))
+                self.store.expose(stored_names, table_name, multi_schema)
+                if multi_schema:
+                    # The stored data was copied.
+                    unindexed.append((table_name, joined))
+                continue
+            table.create(self.db, table_name)
+            unindexed.append((table_name, joined))
+            for ref, stored_name in zip(refs, stored_names):
+                if stored_name is None:
+                    unstored[ref].append((table, table_name, columns[table]))
+                else:
+                    self.db.execute(f"INSERT INTO {table_name} SELECT * FROM {stored_name}")
+        for ref, targets in unstored.items():
+            build_tables(self.db, self.data[ref.name], targets, ref.context)
+        for table_name, joined in unindexed:
+            create_indexes(self.db, table_name, joined)
+
+        column_names = []
+        rows = self.db.query(query.sql, names=column_names)
+        # %g is susceptible to outputting scientific notation, which we don't want.
+        # but %f always outputs trailing zeros, which we also don't want.
+        # So turn every value x in each row into an int if x == float(int(x))
+        truncate = lambda x: int(x) if isinstance(x, float) and x == float(int(x)) else x
+        rows = [[truncate(x) for x in row] for row in rows]
+        return rows, column_names
+
+    def refresh(self, query: Query):
+        """Fetch the resources named with -u that a query uses, updating their cache files,
+        but don't run the query.  This is how expired data used within the grace period is
+        refreshed in the background; see _revalidate in main.py."""
+        *_, resource_refs = self._plan(query)
+        update = set(self.args.update)
+        refs = {r for r in resource_refs if r.base_name in update and r.resource.cacheable}
+        seen_mtimes = {ref: self.cache.mtime(ref) for ref in refs}
+        with self._scheduler() as scheduler:
+            fetches = [self._submit(scheduler, ref, refs, seen_mtimes) for ref in refs]
+            for fetch in fetches:
+                scheduler.result(fetch)
+
+    def _plan(self, query: Query):
+        """Configure the schemas a query uses, and identify the tables and resources it needs.
+        :return: a tuple of (schemas by name, whether the query names its schemas, columns
+            used by table, indexes by table, tables with their resource refs, all resource refs)
+        """
 
         # Identify schemas named in the query and read their configs.
         # If none named, assume the "kubernetes" schema.
@@ -104,57 +276,128 @@ class Engine:
             name: registry.get_schema(name).read_configs(self.settings.init_path)
             for name in schemas_named
         }
+        for schema in schemas.values():
+            schema.configure_resources(self.args, self.settings)
 
         # Reconcile tables created / extended in the config file with tables defined in code,
-        # generate the table builders, and identify the required resources. Note: some of the
-        # named tables may be CTEs, so it's not a problem if we can't create them.  SQLite
-        # will say "no such table" when we issue the query.
-        tables: list[tuple[Table, ResourceRef]] = []
-        resource_refs: set[ResourceRef] = set()
-        for named_table in query.named_tables:
-            schema = schemas[named_table.schema_name or DEFAULT_SCHEMA]
-            if table := schema.table_builder(named_table.name):
-                resource_ref = ResourceRef(schema, schema.resource_for(table))
-                tables.append((table, resource_ref))
-                resource_refs.add(resource_ref)
-
-        # Identify what to fetch vs what's stale or expired.
-        for r in resource_refs:
-            r.resource.handle_cli_options(self.args)
-        refreshable, max_staleness = self.cache.advise_refresh(resource_refs, self.cache_flag)
-        if not self.settings.reckless and max_staleness is not None:
-            print(f"(Data may be up to {max_staleness} seconds old.)", file=sys.stderr)
-            clock.CLOCK.sleep(0.5)
-
-        # Retrieve resource data in parallel.  If actually fetching externally, update the cache;
-        # otherwise just read from the cache.
-        def fetch(ref: ResourceRef):
-            try:
-                if ref in refreshable:
-                    self.data[ref.name] = ref.resource.get_objects()
-                    if ref.resource.cacheable:
-                        self.cache.dump(ref, self.data[ref.name])
-                else:
-                    self.data[ref.name] = self.cache.load(ref)
-            except Exception as e:
-                fail(f"failed to fetch resource {ref.name}: {e}")
-
-        with ThreadPoolExecutor(max_workers=8) as pool:
-            for _ in pool.map(fetch, resource_refs):
-                pass
-
-        # Create tables in SQLite
-        for table, resource_ref in tables:
-            table.build(self.db, self.data[resource_ref.name], multi_schema)
+        # and generate the table builders.  Compile the query against empty stand-ins for the
+        # tables to learn which of them, and which of their columns, it actually reads.  Columns
+        # not read can be left null.
+        planner_db = SqliteDb(feature="plan")
+        add_custom_functions(planner_db.conn)
+        planner = QueryPlanner(planner_db, schemas, multi_schema)
+        columns = planner.plan(query)
+        indexes = planner.indexes(query)
+
+        # Identify the required resources.  Resources may fetch only the items meeting the
+        # query's conditions, or only the items' metadata if the query uses nothing else.  With
+        # e.g. --contexts, a resource is fetched once per context, and its tables hold the union
+        # of what was fetched.
+        conditions = planner.conditions(query)
+        tables_by_ref: dict[ResourceRef, list[Table]] = defaultdict(list)
+        for table in columns:
+            schema = schemas[table.schema_name]
+            tables_by_ref[ResourceRef(schema, schema.resource_for(table))].append(table)
+        tables: list[tuple[Table, list[ResourceRef]]] = []
+        for base_ref, ref_tables in tables_by_ref.items():
+            resource = base_ref.resource
+            if r_conditions := conditions.get((base_ref.schema.name, resource.name)):
+                resource.narrow(r_conditions)
+            if all(
+                columns[t] is not None and columns[t] <= t.metadata_columns() for t in ref_tables
+            ):
+                resource.narrow_to_metadata()
+            refs = base_ref.in_contexts()
+            tables.extend((table, refs) for table in ref_tables)
+        resource_refs: set[ResourceRef] = set(chain.from_iterable(refs for _, refs in tables))
+
+        return schemas, multi_schema, columns, indexes, tables, resource_refs
+
+    def _scheduler(self) -> FetchScheduler:
+        return FetchScheduler(self.settings.fetch_limit, self.settings.fetch_limit_per_context)
+
+    def _submit(self, scheduler: FetchScheduler, ref: ResourceRef, refreshable, seen_mtimes):
+        """Schedule the fetch of a resource, see _fetch."""
+        return scheduler.submit(
+            ref.name,
+            partial(self._fetch, ref, refreshable, seen_mtimes),
+            ref.resource.fetch_context(),
+            ref.resource.fetch_timeout or self.settings.fetch_timeout,
+        )
 
-        column_names = []
-        rows = self.db.query(query.sql, names=column_names)
-        # %g is susceptible to outputting scientific notation, which we don't want.
-        # but %f always outputs trailing zeros, which we also don't want.
-        # So turn every value x in each row into an int if x == float(int(x))
-        truncate = lambda x: int(x) if isinstance(x, float) and x == float(int(x)) else x
-        rows = [[truncate(x) for x in row] for row in rows]
-        return rows, column_names
+    async def _fetch(
+        self,
+        ref: ResourceRef,
+        refreshable: set[ResourceRef],
+        seen_mtimes: dict[ResourceRef, Optional[float]],
+    ):
+        """Get a resource's data from the cache or, if it's refreshable, externally, updating
+        the cache unless another process did so after seen_mtimes."""
+        try:
+            if ref not in refreshable:
+                self._load(ref)
+            elif not ref.resource.cacheable:
+                self.data[ref.name] = data = await ref.resource.get_objects_async()
+                if isinstance(data, ItemStream):
+                    # Read it now, in parallel with other fetches, not while building tables.
+                    await asyncio.to_thread(data.spool)
+            else:
+                async with self.cache.lock_async(ref):
+                    if self.cache.mtime(ref) != seen_mtimes[ref]:
+                        if debug := debugging("cache"):
+                            debug(f"using {ref.name} as just fetched by another process")
+                        self._load(ref)
+                    else:
+                        self.data[ref.name] = data = await ref.resource.get_objects_async()
+                        await asyncio.to_thread(self.cache.dump, ref, data)
+                        self.cache_mtimes[ref.name] = self.cache.mtime(ref)
+        except Exception as e:
+            fail(f"failed to fetch resource {ref.name}: {e}")
+
+    def _load(self, ref: ResourceRef):
+        # Get the modification time first; if the file is replaced while we read it, the
+        # stored tables will be rebuilt next time.
+        self.cache_mtimes[ref.name] = self.cache.mtime(ref)
+        self.data[ref.name] = self.cache.load(ref)
+
+    def _save(self, ref: ResourceRef, ref_tables: list[Table], stored, columns):
+        """Build the tables using a cacheable resource into the table store, unless they're
+        stored already, adding their stored names to `stored`."""
+        unsaved = [table for table in ref_tables if (table, ref) not in stored]
+        if not unsaved or not ref.resource.cacheable:
+            return
+        entries = [
+            (self._store_key(table, ref, self.cache_mtimes[ref.name]), columns[table])
+            for table in unsaved
+        ]
+        data = self.data[ref.name]
+
+        def build(targets):
+            for table, (name, _) in zip(unsaved, targets):
+                table.create(self.db, name)
+            targets = [(table, name, cols) for table, (name, cols) in zip(unsaved, targets)]
+            build_tables(self.db, data, targets, ref.context)
+
+        if (names := self.store.save(entries, build)) is not None:
+            stored.update(zip([(table, ref) for table in unsaved], names))
+
+    def _cache_timeout(self, ref: ResourceRef) -> Age:
+        """The age at which a resource's cached data is stale.  A timeout in the user init file
+        overrides one in the schema config, which overrides the cache_timeout setting."""
+        if (timeout := self.cache_timeouts.get(ref.base_name)) is not None:
+            return timeout
+        if (timeout := ref.schema.cache_timeout(ref.resource.name)) is not None:
+            return timeout
+        return self.settings.cache_timeout
+
+    def _store_key(self, table: Table, ref: ResourceRef, cache_mtime: Optional[float]):
+        return StoreKey(
+            schema_name=table.schema_name,
+            table_name=table.name,
+            cache_path=str(self.cache.cache_path(ref)),
+            cache_mtime=cache_mtime,
+            fingerprint=table.fingerprint(),
+        )
 
 
 class DataCache:
@@ -162,21 +405,32 @@ class DataCache:
     This is a separate class for ease of unit testing.
     """
 
-    def __init__(self, dir: KPath, timeout: Age):
+    def __init__(self, dir: KPath, timeout: Age, binary: bool = False):
         """
         :param dir: root of the cache folder tree; paths are of the form
             <kubernetes context>/<namespace>.<resource kind>.json
         :param timeout: age at which cached data is considered stale
+        :param binary: write streamed data in ItemStream's binary format rather than JSON.
+            Files in either format are read.
         """
         self.dir = dir
         dir.mkdir(parents=True, exist_ok=True)
         self.timeout = timeout
-
-    def advise_refresh(self, resources: Set[ResourceRef], flag: CacheFlag) -> Tuple[Set[str], int]:
+        self.binary = binary
+
+    def advise_refresh(
+        self,
+        resources: Set[ResourceRef],
+        flag: CacheFlag,
+        timeouts: Optional[dict[ResourceRef, Age]] = None,
+        update: Set[ResourceRef] = frozenset(),
+    ) -> Tuple[Set[str], int]:
         """Determine which resources to use from cache or to refresh.
 
         :param resources: the resource types to consider
         :param flag: the user-specified cache behavior
+        :param timeouts: the age at which each resource's data is stale, if not self.timeout
+        :param update: resources to refresh regardless of age or flag, as from -u pods
         :return: a tuple of (refreshable, max_age) where refreshable is the set of resources types
             to update, and max_age is the maximum age of the resources that won't be updated.
         """
@@ -188,13 +442,17 @@ class DataCache:
         non_cacheable = {r for r in resources if not r.resource.cacheable}
         # Sort here for deterministic behavior in unit tests
         cache_ages = {r: self.age(self.cache_path(r)) for r in sorted(cacheable)}
+        timeouts = timeouts or {}
         expired = {
-            r for r, age in cache_ages.items() if age is not None and age >= self.timeout.value
+            r
+            for r, age in cache_ages.items()
+            if age is not None and age >= timeouts.get(r, self.timeout).value
         }
         missing = {r for r, age in cache_ages.items() if age is None}
-        # Always refresh what's missing or non-cacheable, and possibly also what's expired
-        # Stale data warning for everything else
+        # Always refresh what's missing, non-cacheable or named for update, and possibly also
+        # what's expired.  Stale data warning for everything else
         refreshable = set(missing) if flag == NEVER_UPDATE else expired | missing
+        refreshable.update(update)
         max_age = max((cache_ages[r] for r in (cacheable - refreshable)), default=None)
         refreshable.update(non_cacheable)
         if debug := debugging("cache"):
@@ -209,14 +467,94 @@ class DataCache:
             )
             debug("expired", names(expired))
             debug("missing", names(missing))
+            if update:
+                debug("update", names(update))
             debug("refreshable", names(refreshable))
         return refreshable, max_age
 
-    def dump(self, ref: ResourceRef, data: dict):
-        self.cache_path(ref).write_text(json.dumps(data))
+    def within_grace(
+        self, resources: Set[ResourceRef], timeouts: dict[ResourceRef, Age], grace: Age
+    ) -> dict[ResourceRef, int]:
+        """Find the cacheable resources whose cached data expired less than a grace period ago.
 
-    def load(self, ref: ResourceRef) -> dict:
-        return json.loads(self.cache_path(ref).read_text())
+        :param resources: resources advised for refresh by advise_refresh()
+        :param timeouts: the age at which each resource's data is stale, if not self.timeout
+        :return: the age of each resource's data, keyed by resource
+        """
+        ages = {}
+        for r in resources:
+            path = self.cache_path(r)
+            if r.resource.cacheable and path.exists() and ItemStream.file_format(path):
+                age = int(clock.CLOCK.now() - path.stat().st_mtime)
+                if age < timeouts.get(r, self.timeout).value + grace.value:
+                    ages[r] = age
+        if ages and (debug := debugging("cache")):
+            debug("within grace", "[" + " ".join(sorted(r.name for r in ages)) + "]")
+        return ages
+
+    def dump(self, ref: ResourceRef, data: Union[dict, ItemStream]):
+        """Write data to the cache.  The file is replaced all at once, so concurrent readers
+        never see it incomplete."""
+        if isinstance(data, ItemStream):
+            data.spool(self.cache_path(ref), self.binary)
+        else:
+            path = self.cache_path(ref)
+            temp = temp_path(path)
+            try:
+                temp.write_text(json.dumps(data))
+                temp.replace(path)
+            except BaseException:
+                temp.unlink(missing_ok=True)
+                raise
+
+    @asynccontextmanager
+    async def lock_async(self, ref: ResourceRef):
+        """Hold an exclusive lock on a cache file, shared with other Kugl processes, while
+        fetching the data for it.  Readers don't need the lock, since writes are atomic.
+        Waiting for another process to release the lock doesn't block the event loop.
+        On systems without fcntl, there's no locking."""
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path(ref), "w") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                await asyncio.to_thread(fcntl.flock, f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def is_locked(self, ref: ResourceRef) -> bool:
+        """Check whether another process holds the lock from lock(), i.e. is fetching the data."""
+        if fcntl is None:
+            return False
+        with open(self._lock_path(ref), "w") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return False
+
+    def _lock_path(self, ref: ResourceRef) -> Path:
+        path = self.cache_path(ref)
+        return path.with_name(path.name + ".lock")
+
+    def load(self, ref: ResourceRef) -> Union[dict, ItemStream]:
+        """Read cached data.  Files written from an ItemStream are read back as one, so items
+        are decoded only as needed."""
+        path = self.cache_path(ref)
+        file_format = ItemStream.file_format(path)
+        if file_format == "json":
+            return json.loads(path.read_text())
+        return ItemStream.from_file(path, file_format == "binary")
+
+    def mtime(self, ref: ResourceRef) -> Optional[float]:
+        """The modification time of a cache file, or None if it doesn't exist."""
+        path = self.cache_path(ref)
+        return path.stat().st_mtime if path.exists() else None
 
     def cache_path(self, ref: ResourceRef) -> Path:
         path = self.dir / ref.schema.name / ref.resource.cache_path()
@@ -230,6 +568,11 @@ class DataCache:
             if debug:
                 debug("missing cache file", path)
             return None
+        if ItemStream.file_format(path) is None:
+            # e.g. written by another version of Kugl; it will be replaced
+            if debug:
+                debug("unreadable cache file", path)
+            return None
         age_secs = int(clock.CLOCK.now() - path.stat().st_mtime)
         if debug:
             debug(f"found cache file (age = {to_age(age_secs)})", path)
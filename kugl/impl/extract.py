@@ -4,8 +4,9 @@ Formerly in ./config.py, refactored for clarity.
 """
 
 from dataclasses import dataclass
+from functools import lru_cache
 import re
-from typing import Literal
+from typing import Literal, Optional, Union
 
 import jmespath
 
@@ -37,6 +38,66 @@ KUGL_TYPE_TO_SQL_TYPE = {
 }
 
 
+def compile_path(expression: str):
+    """Compile a JMESPath expression, returning an object with a search() method like
+    jmespath.compile().  Most paths in configurations are just chains of field names and
+    constant indexes, e.g. 'metadata.name' or 'spec.containers[0].image'; those are evaluated by
+    a direct walk through the object, bypassing the JMESPath interpreter.  Anything with
+    filters, projections, functions and so on is left to JMESPath.
+
+    :raises jmespath.exceptions.ParseError: if the expression is invalid
+    """
+    parsed = jmespath.compile(expression)
+    steps = _chain_steps(parsed.parsed)
+    return parsed if steps is None else ChainFinder(expression, steps)
+
+
+def _chain_steps(node: dict) -> Optional[list[Union[str, int]]]:
+    """Return the field names and indexes in a parsed JMESPath expression, or None if it isn't
+    just a chain of those."""
+    node_type = node["type"]
+    if node_type == "field":
+        return [node["value"]]
+    if node_type == "index":
+        return [node["value"]]
+    if node_type in ("identity", "current"):
+        return []
+    if node_type in ("subexpression", "index_expression"):
+        steps = []
+        for child in node["children"]:
+            if (child_steps := _chain_steps(child)) is None:
+                return None
+            steps.extend(child_steps)
+        return steps
+    return None
+
+
+class ChainFinder:
+    """A JMESPath expression that's a chain of field names and indexes, see compile_path().
+    Like JMESPath, searching returns None where a field or index is missing, or is applied to
+    the wrong type of value."""
+
+    def __init__(self, expression: str, steps: list[Union[str, int]]):
+        self.expression = expression
+        self.steps = tuple(steps)
+
+    def search(self, value):
+        for step in self.steps:
+            if isinstance(step, str):
+                try:
+                    value = value.get(step)
+                except AttributeError:
+                    return None
+            elif isinstance(value, list):
+                try:
+                    value = value[step]
+                except IndexError:
+                    return None
+            else:
+                return None
+        return value
+
+
 @dataclass
 class FieldRef:
     """Parsed form of a parented JMESPath expression or label, e.g. '^^metadata.name'"""
@@ -61,6 +122,18 @@ class Extractor:
         self.column_type = column_type
         self._converter = KUGL_TYPE_CONVERTERS[column_type]
 
+    def definition(self) -> tuple:
+        """Return what the extractor was configured with.  Extractors with the same definition
+        are equal, so e.g. compile_extractors can reuse work across queries, though each query
+        parses the configuration anew."""
+        raise NotImplementedError()
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.definition() == self.definition()
+
+    def __hash__(self):
+        return hash((type(self), self.definition()))
+
     # FIXME: better contract for context
     def __call__(self, obj: object, context) -> object:
         """Extract the column value from an object and convert to the correct type.  The
@@ -88,9 +161,12 @@ class LabelExtractor(Extractor):
 
     def extract(self, obj: object, context) -> object:
         """Resolve the metadata location for each label and see if the label is present."""
+        # Each label's parents are relative to the previous label's object.
+        level = 0
         for ref in self._refs:
             if ref.n_parents > 0:
-                obj = context.get_parent(obj, ref.n_parents)
+                level += ref.n_parents
+                obj = context.get_parent(level)
             if obj is None:
                 fail(f"Missing parent or too many ^ while evaluating {ref.target}")
             if available := obj.get("metadata", {}).get("labels", {}):
@@ -98,6 +174,9 @@ class LabelExtractor(Extractor):
                 if ref.target in available:
                     return available[ref.target]
 
+    def definition(self) -> tuple:
+        return self.column_name, self.column_type, tuple(self._labels)
+
     def __str__(self):
         """For debug output"""
         return f"{self.column_name} label={','.join(self._labels)}"
@@ -111,7 +190,7 @@ class PathExtractor(Extractor):
         self._ref = FieldRef.parse(path)
         self._path = path
         try:
-            self._finder = jmespath.compile(self._ref.target)
+            self._finder = compile_path(self._ref.target)
         except jmespath.exceptions.ParseError as e:
             raise ValueError(
                 f"invalid JMESPath expression {self._ref.target} in column {column_name}"
@@ -120,11 +199,125 @@ class PathExtractor(Extractor):
     def extract(self, obj: object, context) -> object:
         """Extract a value from an object using a JMESPath finder."""
         if self._ref.n_parents > 0:
-            obj = context.get_parent(obj, self._ref.n_parents)
+            obj = context.get_parent(self._ref.n_parents)
         if obj is None:
             fail(f"Missing parent or too many ^ while evaluating {self._path}")
         return self._finder.search(obj)
 
+    def definition(self) -> tuple:
+        return self.column_name, self.column_type, self._path
+
     def __str__(self):
         """For debug output"""
         return f"{self.column_name} path={self._path}"
+
+
+@lru_cache(maxsize=256)
+def compile_extractors(extractors: tuple[Extractor, ...], wanted: tuple[bool, ...]):
+    """Generate a function that extracts several column values from an object at once, as
+    calling each extractor in turn would, but without per-column calls and debug checks.  Each
+    parent object the columns use is looked up once, as are the labels of each object, and
+    paths that are just field names are evaluated inline.  Not for use when debugging, since
+    the generated function has no debug output.
+
+    :param extractors: extractors for a table's columns, in order; since they're compared by
+        definition, the function is reused by later queries of the same columns
+    :param wanted: for each column, whether its value is needed; others are left null
+    :return: a function taking an object and a RowContext, and returning a tuple of column
+        values
+    """
+    names = {"fail": fail, "labels_of": _labels_of, "parent": {0: "obj"}, "labels": {}}
+    body = []
+    values = []
+    for index, (extractor, want) in enumerate(zip(extractors, wanted)):
+        if not want:
+            values.append("None")
+            continue
+        names[f"convert_{index}"] = extractor._converter
+        if isinstance(extractor, PathExtractor):
+            body.extend(_path_code(index, extractor, names))
+        else:
+            body.extend(_label_code(index, extractor, names))
+        values.append(f"None if v{index} is None else convert_{index}(v{index})")
+    # As in RowContext.get_parent, but indexing the ancestors directly
+    parents = [
+        f"    parent_{level} = ancestors[-{level}] if len(ancestors) >= {level} else None"
+        for level in sorted(names["parent"])
+        if level > 0
+    ]
+    if parents:
+        parents.insert(0, "    ancestors = context.ancestors")
+    labels = [
+        f"    labels_{level} = None if {names['parent'][level]} is None "
+        f"else labels_of({names['parent'][level]})"
+        for level in sorted(names["labels"])
+    ]
+    source = "\n".join(
+        [
+            "def extract(obj, context):",
+            "    if obj is None:",
+            f"        return {tuple(None for _ in extractors)!r}",
+            *parents,
+            *labels,
+            *body,
+            f"    return ({''.join(f'{v}, ' for v in values)})",
+        ]
+    )
+    del names["parent"], names["labels"]
+    exec(compile(source, "<kugl columns>", "exec"), names)
+    return names["extract"]
+
+
+def _parent(level: int, names: dict) -> str:
+    """Return the name of the variable holding the parent at some level of the object."""
+    return names["parent"].setdefault(level, f"parent_{level}")
+
+
+def _path_code(index: int, extractor: PathExtractor, names: dict) -> list[str]:
+    target = _parent(extractor._ref.n_parents, names)
+    code = []
+    if target != "obj":
+        message = f"Missing parent or too many ^ while evaluating {extractor._path}"
+        code += [f"    if {target} is None:", f"        fail({message!r})"]
+    names[f"search_{index}"] = extractor._finder.search
+    finder = extractor._finder
+    if (
+        isinstance(finder, ChainFinder)
+        and finder.steps
+        and all(isinstance(step, str) for step in finder.steps)
+    ):
+        # Where indexing fails, e.g. because a field is missing, JMESPath's rules apply.
+        lookup = "".join(f"[{step!r}]" for step in finder.steps)
+        return code + [
+            "    try:",
+            f"        v{index} = {target}{lookup}",
+            "    except (KeyError, TypeError, AttributeError):",
+            f"        v{index} = search_{index}({target})",
+        ]
+    return code + [f"    v{index} = search_{index}({target})"]
+
+
+def _label_code(index: int, extractor: "LabelExtractor", names: dict) -> list[str]:
+    # As in LabelExtractor.extract, each label's parents are relative to the previous label's
+    # object, so its level is cumulative.
+    level = 0
+    code = [f"    v{index} = None"]
+    indent = "    "
+    for ref in extractor._refs:
+        level += ref.n_parents
+        target = _parent(level, names)
+        labels = names["labels"].setdefault(level, f"labels_{level}")
+        if target != "obj":
+            message = f"Missing parent or too many ^ while evaluating {ref.target}"
+            code += [f"{indent}if {target} is None:", f"{indent}    fail({message!r})"]
+        code += [
+            f"{indent}if {labels} and {ref.target!r} in {labels}:",
+            f"{indent}    v{index} = {labels}[{ref.target!r}]",
+            f"{indent}else:",
+        ]
+        indent += "    "
+    return code + [f"{indent}pass"]
+
+
+def _labels_of(obj: dict) -> dict:
+    return obj.get("metadata", {}).get("labels", {})
@@ -0,0 +1,121 @@
+"""
+This is separate from engine.py for maintainability.
+Resources for a query are fetched concurrently on an asyncio event loop, so that fetches which
+await a subprocess (see run_async) don't each need a thread.
+"""
+
+import asyncio
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from threading import Thread
+from typing import Awaitable, Callable, Optional
+
+from ..util import Age, KuglError
+from ..util.misc import Commands, FETCH_COMMANDS
+
+
+class FetchScheduler:
+    """Run fetches on an event loop in a background thread, so that the caller can build tables
+    from fetched data while other fetches continue.
+
+    At most `limit` fetches run at once, and at most `context_limit` of them fetch from the same
+    place, e.g. one Kubernetes context; see Resource.fetch_context().  If a fetch fails or times
+    out, the others are cancelled, and the failure is raised by result() for every fetch."""
+
+    def __init__(self, limit: int, context_limit: int):
+        self.limit = limit
+        self.context_limit = context_limit
+        self._loop = asyncio.new_event_loop()
+        # For resources that fetch with blocking calls; see Resource.get_objects_async()
+        self._loop.set_default_executor(ThreadPoolExecutor(max_workers=limit))
+        self._thread = Thread(target=self._loop.run_forever, daemon=True)
+        # Semaphores by context name, or None for the overall limit; created on the event loop
+        self._semaphores: dict[Optional[str], asyncio.Semaphore] = {}
+        self._futures: list[Future] = []
+        self._failure: Optional[BaseException] = None
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.cancel()
+        asyncio.run_coroutine_threadsafe(self._settle(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        # This doesn't wait for blocking fetches that were cancelled or timed out.
+        self._loop.close()
+
+    def submit(
+        self,
+        name: str,
+        fetch: Callable[[], Awaitable],
+        context: Optional[str] = None,
+        timeout: Optional[Age] = None,
+    ) -> Future:
+        """Schedule a fetch.
+
+        :param name: resource name, for error messages
+        :param fetch: returns the coroutine that fetches the resource
+        :param context: where the resource is fetched from, if it should count against
+            context_limit
+        :param timeout: how long to allow for the fetch, if limited
+        :return: a Future to pass to result()
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(name, fetch, context, timeout), self._loop
+        )
+        self._futures.append(future)
+        return future
+
+    def result(self, future: Future):
+        """Wait for a fetch, returning what its coroutine returned.  If any fetch failed, raise
+        that failure instead."""
+        try:
+            result = future.result()
+        except CancelledError:
+            result = None
+        if self._failure is not None:
+            raise self._failure
+        return result
+
+    def cancel(self):
+        for future in self._futures:
+            future.cancel()
+
+    async def _run(
+        self, name: str, fetch: Callable[[], Awaitable], context: Optional[str], timeout: Age
+    ):
+        # Each fetch runs in its own copy of the context, so this is seen only by its commands,
+        # including those run from worker threads.
+        commands = Commands()
+        FETCH_COMMANDS.set(commands)
+        try:
+            # Wait for the context's limit before the overall limit, so a busy context doesn't
+            # hold up fetches from others.
+            async with self._semaphore(context), self._semaphore(None):
+                return await asyncio.wait_for(fetch(), timeout.value if timeout else None)
+        except asyncio.CancelledError:
+            commands.kill()
+            raise
+        except asyncio.TimeoutError:
+            commands.kill()
+            self._failed(KuglError(f"timed out fetching resource {name} after {timeout.render()}"))
+        except BaseException as e:
+            # Including SystemExit from a failed command, which mustn't stop the event loop
+            self._failed(e)
+
+    async def _settle(self):
+        """Let cancelled fetches finish, e.g. by killing their commands."""
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _semaphore(self, context: Optional[str]) -> asyncio.Semaphore:
+        if (semaphore := self._semaphores.get(context)) is None:
+            limit = self.limit if context is None else self.context_limit
+            self._semaphores[context] = semaphore = asyncio.Semaphore(limit)
+        return semaphore
+
+    def _failed(self, e: BaseException):
+        if self._failure is None:
+            self._failure = e
+            self.cancel()
@@ -0,0 +1,178 @@
+"""
+This is separate from engine.py for maintainability.
+Queries are analyzed here to learn exactly which tables and columns they read.
+"""
+
+from collections import defaultdict
+from functools import partial
+import re
+import sqlite3
+from typing import Optional
+
+from .config import DEFAULT_SCHEMA
+from .registry import Schema
+from .tables import Table
+from ..util import Query, SqliteDb, debugging
+from ..util.sqlparse import ColumnRef
+
+# Conditions on one use of a table in a query: the table, and the column values it must have
+TableConditions = tuple[Table, dict[str, str]]
+
+MISSING_TABLE_RE = re.compile(r"no such table: (?:(\w+)\.)?(\w+)$")
+
+
+class QueryPlanner:
+    """Find the tables and columns a query reads, by compiling it against empty stand-ins for
+    the tables it might use.
+
+    The table names found by Query are only a starting point.  They may include CTEs that
+    shadow real tables, and sqlparse may miss some tables; SQLite knows better.  When it says
+    a table is missing, and a schema can build it, a stand-in is added and the query retried."""
+
+    def __init__(self, db: SqliteDb, schemas: dict[str, Schema], multi_schema: bool):
+        """
+        :param db: a scratch SqliteDb, with Kugl's custom functions, so the query will compile
+        :param schemas: the schemas used by the query, by name
+        :param multi_schema: whether table names are qualified with schema names
+        """
+        self.db = db
+        self.schemas = schemas
+        self.multi_schema = multi_schema
+        # Maps (database name, table name) to each stand-in table's builder
+        self.stubs: dict[tuple[str, str], Table] = {}
+        if multi_schema:
+            for name in schemas:
+                self.db.execute(f"ATTACH DATABASE ':memory:' AS '{name}'")
+
+    def plan(self, query: Query) -> dict[Table, set[str]]:
+        """Return the tables read by a query, each with the names of the columns it reads.
+        SQL errors, such as references to tables no schema defines, are raised as-is."""
+        for nt in query.named_tables:
+            self._add_stub(nt.schema_name, nt.name)
+        while True:
+            try:
+                reads = self.db.reads(query.sql)
+                break
+            except sqlite3.OperationalError as e:
+                m = MISSING_TABLE_RE.match(str(e))
+                if m is None or not self._add_stub(m.group(1), m.group(2)):
+                    raise
+        plan = {self.stubs[key]: columns for key, columns in reads.items() if key in self.stubs}
+        if debug := debugging("plan"):
+            for table, columns in plan.items():
+                debug(f"{table.schema_name}.{table.name} reads", " ".join(sorted(columns)))
+        return plan
+
+    def conditions(self, query: Query) -> dict[tuple[str, str], list[TableConditions]]:
+        """Find conditions that every item of a resource must meet to contribute to the query
+        results, so that the resource may be fetched selectively.  Call this after plan().
+
+        Simple equalities on a table's columns apply to the resource's items if that's the only
+        use of a table built from the resource, or if all such uses are joined on their item
+        keys, so each result row uses just one of the resource's items.
+
+        :return: a dict mapping (schema name, resource name) to the conditions on each use of
+            the resource's tables.  Resources without conditions are omitted.
+        """
+        if (tables := self._aliased_tables(query)) is None:
+            return {}
+        resource_of = lambda t: (t.schema_name, self.schemas[t.schema_name].resource_for(t).name)
+        resources = {alias: resource_of(table) for alias, table in tables.items()}
+
+        resolve = partial(self._resolve, tables)
+        # Group the uses of tables joined on item keys, and gather the values required of each.
+        groups = {alias: alias for alias in tables}
+
+        def group_of(alias):
+            while groups[alias] != alias:
+                alias = groups[alias]
+            return alias
+
+        values = defaultdict(dict)
+        for eq in query.equalities:
+            if (left := resolve(eq.left)) is None:
+                continue
+            if isinstance(eq.right, str):
+                if not eq.outer:
+                    values[left][eq.left.name] = eq.right
+            elif (right := resolve(eq.right)) is not None and resources[left] == resources[right]:
+                if (eq.left.name, eq.right.name) == (tables[left].item_key, tables[right].item_key):
+                    groups[group_of(left)] = group_of(right)
+
+        result = {}
+        for key in set(resources.values()):
+            aliases = [a for a, r in resources.items() if r == key]
+            if len({group_of(a) for a in aliases}) > 1:
+                continue
+            if any(resource_of(t) == key and t not in tables.values() for t in self.stubs.values()):
+                # Used somewhere we didn't analyze
+                continue
+            if conditions := [(tables[a], values[a]) for a in aliases if values[a]]:
+                result[key] = conditions
+        if debug := debugging("plan"):
+            for (schema_name, resource_name), conditions in sorted(result.items()):
+                text = [f"{t.name}.{c}='{v}'" for t, cv in conditions for c, v in cv.items()]
+                debug(f"{schema_name}.{resource_name} requires", " ".join(text))
+        return result
+
+    def indexes(self, query: Query) -> dict[Table, dict[str, bool]]:
+        """Find the columns of each table worth indexing: those equated with columns of other
+        tables, as in joins, and those equated with constants.  Call this after plan().
+
+        :return: a dict mapping tables to the names of such columns, each with True if the
+            column is joined, or False if it's only compared with constants
+        """
+        if (tables := self._aliased_tables(query)) is None:
+            return {}
+        result = defaultdict(dict)
+        for eq in query.equalities:
+            if (left := self._resolve(tables, eq.left)) is None:
+                continue
+            if isinstance(eq.right, str):
+                result[tables[left]].setdefault(eq.left.name, False)
+            elif (right := self._resolve(tables, eq.right)) is not None and right != left:
+                result[tables[left]][eq.left.name] = True
+                result[tables[right]][eq.right.name] = True
+        if debug := debugging("plan"):
+            for table, columns in result.items():
+                text = [f"{c}{'' if joined else ' (filter)'}" for c, joined in columns.items()]
+                debug(f"{table.schema_name}.{table.name} indexes", " ".join(sorted(text)))
+        return dict(result)
+
+    def _aliased_tables(self, query: Query) -> Optional[dict[str, Table]]:
+        """Return the table used under each alias in a query, or None if they aren't all known."""
+        if query.aliases is None:
+            return None
+        tables = {}
+        for alias, nt in query.aliases.items():
+            if (table := self.stubs.get(self._stub_key(nt.schema_name, nt.name))) is None:
+                return None
+            tables[alias] = table
+        return tables
+
+    @staticmethod
+    def _resolve(tables: dict[str, Table], ref: ColumnRef) -> Optional[str]:
+        """Return the alias of the table a column belongs to, if unambiguous."""
+        candidates = [ref.table] if ref.table in tables else [] if ref.table else tables
+        found = [a for a in candidates if ref.name in {c.name for c in tables[a].columns}]
+        return found[0] if len(found) == 1 else None
+
+    def _stub_key(self, schema_name: Optional[str], table_name: str) -> tuple[str, str]:
+        """Return the key in self.stubs for a possibly schema-qualified table name."""
+        return (schema_name or DEFAULT_SCHEMA) if self.multi_schema else "main", table_name
+
+    def _add_stub(self, schema_name: Optional[str], table_name: str) -> bool:
+        """Create an empty stand-in for a table, if a schema defines it.
+        :return: True if a new stand-in was created"""
+        schema_name = schema_name or DEFAULT_SCHEMA
+        schema = self.schemas.get(schema_name)
+        db_name, _ = self._stub_key(schema_name, table_name)
+        if schema is None or (db_name, table_name) in self.stubs:
+            return False
+        if (table := schema.table_builder(table_name)) is None:
+            return False
+        qualified_name = f"{db_name}.{table_name}"
+        column_defs = ", ".join(f"{c.name} {c._sqltype}" for c in table.columns)
+        self.db.execute(f"CREATE TABLE {qualified_name} ({column_defs})")
+        self.stubs[(db_name, table_name)] = table
+        return True
@@ -3,12 +3,13 @@ Registry of resources and tables, independent of configuration file format.
 """
 
 from argparse import ArgumentParser
+import asyncio
 from collections import defaultdict
 from importlib.resources import files
 from itertools import chain
 from typing import Type, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, field_validator
 
 from kugl.impl.config import (
     UserConfig,
@@ -18,9 +19,10 @@ from kugl.impl.config import (
     ResourceDef,
     DEFAULT_SCHEMA,
     parse_model,
+    Settings,
 )
 from kugl.impl.tables import TableFromCode, TableFromConfig, TableDef, Table
-from kugl.util import fail, ConfigPath, kugl_home, cleave, failure_preamble
+from kugl.util import Age, fail, ConfigPath, kugl_home, cleave, failure_preamble
 
 _REGISTRY = None
 
@@ -110,10 +112,18 @@ class Registry:
 class Resource(BaseModel):
     """Common attributes of all resource types."""
 
+    model_config = ConfigDict(arbitrary_types_allowed=True)
     name: str
     # This is optional because the default cache behavior for every resource type is different.
     # We set it to None to detect when the user hasn't configured it.
     cacheable: Optional[bool] = None
+    # How long to allow for fetching the resource, if not Settings.fetch_timeout
+    fetch_timeout: Optional[Age] = None
+
+    @field_validator("fetch_timeout", mode="before")
+    @classmethod
+    def convert_fetch_timeout(cls, value):
+        return Age(value) if isinstance(value, (str, int)) else value
 
     @classmethod
     def add_cli_options(cls, ap: ArgumentParser):
@@ -122,9 +132,56 @@ class Resource(BaseModel):
     def handle_cli_options(self, args):
         pass
 
+    def handle_settings(self, settings: Settings):
+        """Apply settings from init.yaml, before handle_cli_options()."""
+        pass
+
+    def contexts(self) -> Optional[list[str]]:
+        """Return the contexts, e.g. Kubernetes contexts, to fetch the resource from, if the
+        command line asks for several, as with --contexts.  Tables built from the resource then
+        have a context column.  This is called after handle_cli_options()."""
+        return None
+
+    def in_context(self, context: str) -> "Resource":
+        """Return a copy of the resource that fetches from one of its contexts()."""
+        raise NotImplementedError(f"{self.__class__} must implement in_context()")
+
+    def narrow_to_metadata(self):
+        """Optionally arrange for get_objects() to return just the metadata of each item, if
+        that's cheaper.  This is called when every table built from the resource uses only
+        columns in its Table.metadata_columns(), after handle_cli_options()."""
+        pass
+
+    def narrow(self, conditions: list[tuple[Table, dict[str, str]]]):
+        """Optionally arrange for get_objects() to return only the items that meet all the
+        conditions; others can't contribute to the query results.  Each condition is a table
+        built from this resource, and the values required of its columns.  Since the result of
+        get_objects() may differ, so must cache_path().  This is called after
+        handle_cli_options()."""
+        pass
+
     def get_objects(self):
         raise NotImplementedError(f"{self.__class__} must implement get_objects()")
 
+    async def get_objects_async(self):
+        """Like get_objects(), but for resources that can fetch without blocking, e.g. with
+        run_async().  By default get_objects() is run in a worker thread."""
+        return await asyncio.to_thread(self.get_objects)
+
+    def fetch_context(self) -> Optional[str]:
+        """Name the place the resource is fetched from, e.g. a Kubernetes context, if concurrent
+        fetches from there should be limited by Settings.fetch_limit_per_context."""
+        return None
+
+    def watch_command(self, resource_version: str, timeout: int = 0) -> Optional[list[str]]:
+        """Optionally return a command whose output is a stream of watch events, one JSON
+        object per line, as from the Kubernetes API, for changes to the items since
+        get_objects() returned the given metadata.resourceVersion.  See watch.py.
+
+        :param timeout: if nonzero, the command should end after this many seconds, whether or
+            not events arrive, and exit nonzero if the server stops responding."""
+        return None
+
     def cache_path(self):
         raise NotImplementedError(f"{self.__class__} must implement cache_path()")
 
@@ -137,9 +194,11 @@ class Schema(BaseModel):
     _create: dict[str, CreateTable] = {}
     _extend: dict[str, ExtendTable] = {}
     _resources: dict[str, Resource] = {}
+    _cache: dict[str, Age] = {}
 
     def read_configs(self, init_path: list[str]):
-        """Apply the built-in and user configuration files for the schema, if present."""
+        """Apply the built-in and user configuration files for the schema, if present.
+        :return: a copy of the schema with the configured tables and resources"""
 
         init_path = [
             ConfigPath(files("kugl.builtins.schemas")),
@@ -147,10 +206,9 @@ class Schema(BaseModel):
             ConfigPath(kugl_home()),
         ]
 
-        # Reset the non-builtin tables, since these can change during unit tests.
-        self._create.clear()
-        self._extend.clear()
-        self._resources.clear()
+        # Configuration can change from one query to the next, and 'kugl serve' may run several
+        # queries at once, so each gets its own Schema, sharing only the built-in tables.
+        schema = Schema(name=self.name, builtin=self.builtin)
 
         # Establish the columns known per table, in order to detect duplicates
         tables_known = defaultdict(set)
@@ -175,21 +233,21 @@ class Schema(BaseModel):
                 config = parse_file(UserConfig, path)
                 for r in config.resources:
                     # Detect duplicate resource
-                    if r.name in self._resources:
+                    if r.name in schema._resources:
                         fail(f"Resource '{r.name}' is already defined in schema '{self.name}'")
                     # Infer resource type
-                    self._resources[r.name] = self._find_resource(r)
+                    schema._resources[r.name] = self._find_resource(r)
                 for c in config.create:
                     # Detect duplicate table
                     if c.table in tables_known:
                         fail(f"Table '{c.table}' is already defined in schema '{self.name}'")
                     # Detect unknown resource
-                    if c.resource not in self._resources:
+                    if c.resource not in schema._resources:
                         fail(f"Table '{c.table}' needs undefined resource '{c.resource}'")
                     # Detect duplicate column
                     for column in c.columns:
                         _check_column(c.table, column.name)
-                    self._create[c.table] = c
+                    schema._create[c.table] = c
                 for e in config.extend:
                     # Detect unknown table
                     if e.table not in tables_known:
@@ -197,7 +255,9 @@ class Schema(BaseModel):
                     # Detect duplicate column
                     for column in e.columns:
                         _check_column(e.table, column.name)
-                    self._extend[e.table] = e
+                    schema._extend[e.table] = e
+                # Later files override cache timeouts from earlier ones
+                schema._cache.update(config.cache)
             return True
 
         # Apply builtin config and user config.
@@ -205,8 +265,11 @@ class Schema(BaseModel):
         if not found and self.name != DEFAULT_SCHEMA:
             # There's a built-in schema for Kubernetes, so no issue if no config files
             fail(f"no configurations found for schema '{self.name}'")
+        for name in schema._cache:
+            if name not in schema._resources:
+                fail(f"Cache timeout given for undefined resource '{name}' in schema '{self.name}'")
 
-        return self
+        return schema
 
     def _find_resource(self, r: ResourceDef) -> Resource:
         """Return a Resource subclass instance for a table's resource name."""
@@ -224,6 +287,21 @@ class Schema(BaseModel):
             f"can't infer type of resource '{r.name}' -- need one of 'file', 'data', 'namespaced' etc"
         )
 
+    def configure_resources(self, args, settings: Settings):
+        """Apply settings and command-line options to all the schema's resources.  This is done
+        before tables are built, since options like --contexts change the tables' columns."""
+        for resource in self._resources.values():
+            resource.handle_settings(settings)
+            resource.handle_cli_options(args)
+
+    def resource_names(self) -> set[str]:
+        return set(self._resources.keys())
+
+    def cache_timeout(self, resource_name: str) -> Optional[Age]:
+        """Return the age at which a resource's cached data is stale, if given by the cache:
+        section of a config file."""
+        return self._cache.get(resource_name)
+
     def table_builder(self, name, missing_ok=True):
         """Return the Table builder subclass (see tables.py) for a table name.
         :param missing_ok: Defaults to True because we normally let SQLite flag missing tables.
@@ -234,11 +312,16 @@ class Schema(BaseModel):
         if builtin and creator:
             fail(f"Pre-defined table {name} can't be created from config")
         if builtin:
-            return TableFromCode(builtin, extender)
-        if creator:
-            return TableFromConfig(name, self.name, creator, extender)
-        if not missing_ok:
+            table = TableFromCode(builtin, extender)
+        elif creator:
+            table = TableFromConfig(name, self.name, creator, extender)
+        elif not missing_ok:
             fail(f"Table '{name}' is not defined in schema {self.name}")
+        else:
+            return None
+        resource = self._resources.get(table.resource)
+        table.context_column = resource is not None and resource.contexts() is not None
+        return table
 
     def all_table_names(self):
         return set(chain(self.builtin.keys(), self._create.keys(), self._extend.keys()))
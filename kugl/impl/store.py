@@ -0,0 +1,193 @@
+"""
+This is separate from engine.py for maintainability.
+Built tables are persisted here so they can be reused by later queries.
+"""
+
+from dataclasses import dataclass
+import hashlib
+import json
+from pathlib import Path
+import sqlite3
+from typing import Callable, Iterable, Optional
+
+from .tables import create_indexes
+from ..util import SqliteDb, debugging
+
+
+@dataclass(frozen=True)
+class StoreKey:
+    """Identify one stored copy of a built table.  The first three fields say where the table
+    lives in the store; the last two say whether the stored copy is still valid."""
+
+    schema_name: str
+    table_name: str
+    # Pathname of the resource cache file the table was built from
+    cache_path: str
+    # Modification time of that cache file when the table was built
+    cache_mtime: float
+    # Digest of the table definition, see Table.fingerprint
+    fingerprint: str
+
+    @property
+    def store_name(self) -> str:
+        """Name of the table in the store."""
+        where = f"{self.schema_name}/{self.table_name}/{self.cache_path}"
+        return "t_" + hashlib.sha1(where.encode()).hexdigest()[:20]
+
+
+class TableStore:
+    """Keep built tables in an on-disk SQLite database next to the resource cache.
+
+    If the cache file for a resource hasn't changed since a table was built from it, and the
+    table definition hasn't changed either, the stored table is used as-is and the resource
+    data needn't even be loaded.  The store is attached to the engine's in-memory database,
+    so stored tables are copied or viewed by SQLite itself, never by Python code.
+
+    Since tables may be built with only the columns a query uses, the store also records which
+    columns were populated, and a stored table is only reused if it has the ones needed."""
+
+    ALIAS = "kugl_store"
+    # Change this if the layout of the store changes; stores in other formats are emptied.
+    FORMAT_VERSION = 1
+
+    def __init__(self, db: SqliteDb, path: Path):
+        """
+        :param db: the engine's SqliteDb instance
+        :param path: pathname of the store database; it's created if missing
+        """
+        self.db = db
+        self.path = path
+        self._attached = False
+
+    def _attach(self):
+        """Attach the store on first use, so queries that don't need it don't create it."""
+        if not self._attached:
+            self.db.commit()
+            self.db.execute(f"ATTACH DATABASE ? AS {self.ALIAS}", [str(self.path)])
+            version = self.db.query(f"PRAGMA {self.ALIAS}.user_version", one_row=True)[0]
+            if version != self.FORMAT_VERSION:
+                tables = self.db.query(
+                    f"SELECT name FROM {self.ALIAS}.sqlite_master WHERE type = 'table'"
+                )
+                for (name,) in tables:
+                    self.db.execute(f"DROP TABLE {self.ALIAS}.{name}")
+                self.db.execute(f"PRAGMA {self.ALIAS}.user_version = {self.FORMAT_VERSION}")
+            self.db.execute(f"""CREATE TABLE IF NOT EXISTS {self.ALIAS}.tables (
+                store_name TEXT PRIMARY KEY, schema_name TEXT, table_name TEXT, cache_path TEXT,
+                cache_mtime REAL, fingerprint TEXT, columns TEXT)""")
+            self._attached = True
+
+    def _stored_columns(self, key: StoreKey) -> tuple[bool, Optional[set[str]]]:
+        """Look for a stored table that is still valid for the key.
+
+        :return: a tuple (found, columns) where columns is the set of populated columns,
+            or None if all are populated."""
+        self._attach()
+        row = self.db.query(
+            f"SELECT cache_mtime, fingerprint, columns FROM {self.ALIAS}.tables "
+            "WHERE store_name = ?",
+            data=[key.store_name],
+            one_row=True,
+        )
+        if row is None or (row[0], row[1]) != (key.cache_mtime, key.fingerprint):
+            return False, None
+        return True, None if row[2] is None else set(json.loads(row[2]))
+
+    def lookup(self, key: StoreKey, columns: Optional[set[str]] = None) -> Optional[str]:
+        """Return the qualified name of a valid stored table matching the key, or None.
+
+        :param columns: the columns that must be populated, or None for all of them"""
+        found, stored_columns = self._stored_columns(key)
+        valid = found and (
+            stored_columns is None or (columns is not None and columns <= stored_columns)
+        )
+        if debug := debugging("cache"):
+            status = "reusing" if valid else "no valid"
+            debug(f"{status} stored table for {key.schema_name}.{key.table_name}")
+        return f"{self.ALIAS}.{key.store_name}" if valid else None
+
+    def save(
+        self,
+        entries: list[tuple[StoreKey, Optional[set[str]]]],
+        build: Callable[[list[tuple[str, Optional[set[str]]]]], None],
+    ) -> Optional[list[str]]:
+        """Build tables into the store, replacing any obsolete or insufficient copies.  The
+        tables are built together, so that e.g. tables from the same resource can share a pass
+        over its data.
+
+        :param entries: for each table, its key and the columns that must be populated, or None
+            for all of them.  If there is a stored copy built from the same data, its columns
+            are also populated, so that queries using different columns don't keep replacing
+            each other's tables.
+        :param build: function that creates and populates the tables, given the qualified name
+            of each and the columns to populate
+        :return: the qualified names of the stored tables, or None if the store is unavailable
+            (e.g. locked for too long by another Kugl process), in which case the caller should
+            build the tables elsewhere.
+        """
+        targets = []
+        for key, columns in entries:
+            found, stored_columns = self._stored_columns(key)
+            if columns is not None and found:
+                columns = None if stored_columns is None else columns | stored_columns
+            targets.append((f"{self.ALIAS}.{key.store_name}", columns))
+        try:
+            with self.db.transaction():
+                for name, _ in targets:
+                    self.db.execute(f"DROP TABLE IF EXISTS {name}")
+                build(targets)
+                for (key, _), (_, columns) in zip(entries, targets):
+                    self.db.execute(
+                        f"INSERT OR REPLACE INTO {self.ALIAS}.tables VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [
+                            key.store_name,
+                            key.schema_name,
+                            key.table_name,
+                            key.cache_path,
+                            key.cache_mtime,
+                            key.fingerprint,
+                            None if columns is None else json.dumps(sorted(columns)),
+                        ],
+                    )
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            if debug := debugging("cache"):
+                names = ", ".join(f"{key.schema_name}.{key.table_name}" for key, _ in entries)
+                debug(f"can't store {names}: {e}")
+            return None
+        return [name for name, _ in targets]
+
+    def index(self, stored_name: str, columns: Iterable[str]):
+        """Index columns of a stored table, unless they're indexed already.  The indexes are
+        kept with the table, so later queries using it needn't build them again.
+
+        :param stored_name: a qualified name returned by lookup() or save()
+        """
+        if not columns:
+            return
+        try:
+            with self.db.transaction():
+                create_indexes(self.db, stored_name, columns)
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            if debug := debugging("cache"):
+                debug(f"can't index {stored_name}: {e}")
+
+    def expose(self, stored_names: list[str], table_name: str, multi_schema: bool):
+        """Make stored tables visible to the query under their usual name.
+
+        :param stored_names: the qualified names returned by lookup() or save(); if there's
+            more than one, e.g. one per Kubernetes context, the query sees their union
+        :param table_name: the (possibly schema-qualified) name used in the query
+        :param multi_schema: if True, the table belongs in the per-schema in-memory database
+            and must be copied there, since views can't be created across databases.  Otherwise
+            a temporary view suffices, because SQLite resolves unqualified names in the temp
+            schema first.
+        """
+        select = " UNION ALL ".join(f"SELECT * FROM {name}" for name in stored_names)
+        if multi_schema:
+            self.db.execute(f"CREATE TABLE {table_name} AS {select}")
+        else:
+            self.db.execute(f"CREATE TEMP VIEW {table_name} AS {select}")
@@ -3,8 +3,12 @@ This is separate from engine.py for maintainability.
 SQLite tables are defined and populated here.
 """
 
+from collections.abc import Mapping
 from dataclasses import dataclass
-from typing import Optional, Type
+import hashlib
+import itertools
+import json
+from typing import Iterable, Iterator, Optional, Type, Union
 
 import jmespath
 from jmespath.parser import ParsedResult
@@ -12,7 +16,15 @@ from pydantic import Field, BaseModel
 from tabulate import tabulate
 
 from .config import UserColumn, ExtendTable, CreateTable, Column
-from ..util import fail, debugging, abbreviate
+from .extract import ChainFinder, compile_extractors, compile_path
+from ..util import fail, debugging, abbreviate, kugl_version, ItemStream
+
+
+# Rows per INSERT when several tables are built in one pass; see build_tables()
+BATCH_SIZE = 1000
+
+# The first column of tables whose rows may come from several contexts
+CONTEXT_COLUMN = Column(name="context", comment="Context the row was fetched from, with --contexts")
 
 
 class TableDef(BaseModel):
@@ -50,37 +62,112 @@ class Table:
         self.resource = resource
         self.builtin_columns = builtin_columns
         self.non_builtin_columns = non_builtin_columns
-
-    def build(self, db, raw_data: dict, multi_schema: bool):
-        """Create the table in SQLite and insert the data.
+        # Whether the table starts with a column naming the context each row was fetched from;
+        # see Resource.contexts()
+        self.context_column = False
+
+    @property
+    def columns(self) -> list[Column]:
+        context = [CONTEXT_COLUMN] if self.context_column else []
+        return context + self.builtin_columns + self.non_builtin_columns
+
+    @property
+    def item_key(self) -> Optional[str]:
+        """The name of a column identifying the resource item each row comes from, if any.
+        Rows from different tables with the same value are from the same item."""
+        return None
+
+    def metadata_columns(self) -> set[str]:
+        """Return the names of the columns that can be populated from items holding only their
+        metadata; see Resource.narrow_to_metadata()."""
+        columns = {c.name for c in self.non_builtin_columns if c.from_metadata}
+        if self.context_column:
+            columns.add(CONTEXT_COLUMN.name)
+        return columns
+
+    def create(self, db, table_name: str):
+        """Create the table in SQLite, with no data, to be filled by insert() or build_tables()."""
+        column_defs = ", ".join(f"{c.name} {c._sqltype}" for c in self.columns)
+        db.execute(f"CREATE TABLE {table_name} ({column_defs})")
+
+    def insert(
+        self,
+        db,
+        raw_data: dict,
+        table_name: str,
+        columns: Optional[set[str]] = None,
+        context: Optional[str] = None,
+    ):
+        """Insert the data into a table made by create().
 
         :param db: the SqliteDb instance
-        :param kube_data: the JSON data from 'kubectl get' or another resource
-        :param multi_schema: whether to use the schema name in the table name
+        :param raw_data: the JSON data from 'kubectl get' or another resource
+        :param table_name: the (possibly schema-qualified) name of the SQLite table
+        :param columns: names of the columns to populate, or None for all of them; the others
+            are left null, so their values needn't be extracted
+        :param context: value for the context column, if the table has one
         """
-        context = RowContext(raw_data)
-        table_name = f"{self.schema_name}.{self.name}" if multi_schema else self.name
-        all_columns = self.builtin_columns + self.non_builtin_columns
-        db.execute(
-            f"""CREATE TABLE {table_name} ({", ".join(f"{c.name} {c._sqltype}" for c in all_columns)})"""
-        )
-        item_rows = list(self.make_rows(context))
-        if item_rows:
-            if self.non_builtin_columns:
-                extend_row = lambda item, row: row + tuple(
-                    column.extract(item, context) for column in self.non_builtin_columns
+        # Rows are generated as SQLite consumes them, so if the data is an ItemStream, only one
+        # item need be in memory at a time.
+        db.execute_many(self._insert_sql(table_name), self.rows(raw_data, columns, context))
+
+    def rows(
+        self, raw_data: dict, columns: Optional[set[str]] = None, context: Optional[str] = None
+    ) -> Iterator[tuple]:
+        """Generate the rows to insert into the table; see insert() for the parameters."""
+        row_context = RowContext(raw_data, columns)
+        if self.non_builtin_columns and row_context.debug:
+            wanted = [(c, row_context.wants(c.name)) for c in self.non_builtin_columns]
+            extend_row = lambda item, row: (
+                row
+                + tuple(
+                    column.extract(item, row_context) if want else None for column, want in wanted
                 )
-            else:
-                extend_row = lambda item, row: row
-            rows = [extend_row(item, row) for item, row in item_rows]
-            placeholders = ", ".join("?" * len(rows[0]))
-            db.execute(f"INSERT INTO {table_name} VALUES({placeholders})", rows)
+            )
+        elif self.non_builtin_columns:
+            # Without debug output, extract all the columns with one generated function.
+            extract = compile_extractors(
+                tuple(c.extractor for c in self.non_builtin_columns),
+                tuple(row_context.wants(c.name) for c in self.non_builtin_columns),
+            )
+            extend_row = lambda item, row: row + extract(item, row_context)
+        else:
+            extend_row = lambda item, row: row
+        if self.context_column:
+            prefix = (context,)
+            add_context = lambda row: prefix + row
+        else:
+            add_context = lambda row: row
+        return (add_context(extend_row(item, row)) for item, row in self.make_rows(row_context))
+
+    @property
+    def iterates_items(self) -> bool:
+        """True if the table's rows come from one pass over the data's items, so that it can
+        share that pass with other tables; see build_tables()."""
+        return False
+
+    def _insert_sql(self, table_name: str) -> str:
+        placeholders = ", ".join("?" * len(self.columns))
+        return f"INSERT INTO {table_name} VALUES({placeholders})"
+
+    def fingerprint(self) -> str:
+        """Return a digest of the table definition, so that stored copies of the table can be
+        recognized as obsolete when the definition or the Kugl version changes."""
+        definition = json.dumps(self._definition(), sort_keys=True, default=str)
+        return hashlib.sha1(definition.encode()).hexdigest()
+
+    def _definition(self) -> dict:
+        """Return the parts of the table definition that affect its content."""
+        return dict(
+            version=kugl_version(),
+            schema=self.schema_name,
+            name=self.name,
+            resource=self.resource,
+            columns=[c.model_dump() for c in self.columns],
+        )
 
     def printable_schema(self):
-        rows = [
-            (c.name, c._sqltype, c.comment or "")
-            for c in self.builtin_columns + self.non_builtin_columns
-        ]
+        rows = [(c.name, c._sqltype, c.comment or "") for c in self.columns]
         return f"## {self.name}\n" + tabulate(rows, tablefmt="plain")
 
 
@@ -101,10 +188,26 @@ class TableFromCode(Table):
             extender.columns if extender else [],
         )
 
+    @property
+    def item_key(self) -> Optional[str]:
+        return self.impl.item_key() if hasattr(self.impl, "item_key") else None
+
+    def metadata_columns(self) -> set[str]:
+        return super().metadata_columns() | set(getattr(self.impl, "_METADATA_COLUMNS", ()))
+
+    @property
+    def iterates_items(self) -> bool:
+        # Built-in tables iterate over context.data["items"] once.
+        return True
+
     def make_rows(self, context: "RowContext") -> list[tuple[dict, tuple]]:
         """Delegate to the user-defined table implementation."""
         return self.impl.make_rows(context)
 
+    def _definition(self) -> dict:
+        cls = type(self.impl)
+        return dict(super()._definition(), impl=f"{cls.__module__}.{cls.__qualname__}")
+
 
 class TableFromConfig(Table):
     """A table created from a create: section in a user config file, rather than in Python"""
@@ -133,77 +236,243 @@ class TableFromConfig(Table):
     def make_rows(self, context: "RowContext") -> list[tuple[dict, tuple]]:
         """
         Itemize the data according to the configuration, but return empty rows; all the
-        columns will be added by Table.build.
+        columns will be added by Table.rows.
         """
-        items = self._itemize(context)
-        return [(item, tuple()) for item in items]
+        for item, ancestors in self._itemize(context):
+            # For ^ references in the item's columns; see RowContext.get_parent.
+            context.ancestors = ancestors
+            yield item, tuple()
+
+    def metadata_columns(self) -> set[str]:
+        # Columns of nested row objects come from the objects, not their metadata.
+        if [source.expr for source in self.row_source] != ["items"]:
+            return {CONTEXT_COLUMN.name} if self.context_column else set()
+        return super().metadata_columns()
+
+    @property
+    def iterates_items(self) -> bool:
+        return self.row_source[0].expr == "items" and not debugging("itemize")
+
+    def _definition(self) -> dict:
+        return dict(super()._definition(), row_source=[source.expr for source in self.row_source])
 
-    def _itemize(self, context: "RowContext") -> list[dict]:
+    def _itemize(self, context: "RowContext") -> Iterable[tuple[dict, tuple]]:
         """
         Given a row_source like
           row_source:
             - items
             - spec.taints
-        Iterate through each level of the source spec, marking object parents, and generating
-        successive row values
+        Iterate through each level of the source spec, generating successive row values, each
+        with its ancestors (outermost first) in the data.
         """
-        items = [context.data]
+        data = context.data
         debug = debugging("itemize")
+        if isinstance(data, (ItemStream, _SharedItems)):
+            if self.row_source[0].expr == "items" and not debug:
+                return self._itemize_stream(data)
+            data = data.to_dict()
         if debug:
-            debug("begin itemization with " + abbreviate(items))
-        for index, source in enumerate(self.row_source):
+            debug("begin itemization with " + abbreviate([data]))
+        return self._descend([(data, ())], 0, debug)
+
+    def _itemize_stream(
+        self, data: Union[ItemStream, "_SharedItems"]
+    ) -> Iterable[tuple[dict, tuple]]:
+        """Like _itemize, when the first row_source step is just 'items', but taking one item
+        at a time from the stream and finishing with it before decoding the next."""
+        for item in data.iter_items():
+            yield from self._descend([(item, ())], 1, None)
+
+    def _descend(
+        self, items: list[tuple[dict, tuple]], start: int, debug
+    ) -> list[tuple[dict, tuple]]:
+        """Apply the row_source steps from index `start` onward to a list of items and their
+        ancestors."""
+        for index, source in enumerate(self.row_source[start:], start):
             if debug:
                 debug(f"pass {index + 1}, row_source selector = {source.expr}")
             new_items = []
-            for item in items:
+            for item, ancestors in items:
                 found = source.finder.search(item)
                 if isinstance(found, dict) and source.unpack:
                     found = [{"key": k, "value": v} for k, v in found.items()]
+                # Fix #132 -- don't do this at pass 0, or it makes the entire response object
+                # a parent, breaking RowContext.get_root()
+                path = ancestors + (item,) if index > 0 else ancestors
                 if isinstance(found, list):
                     for child in found:
-                        if index > 0:
-                            # Fix #132 -- don't do this at pass 0, or it sets the parent to the entire
-                            # response object, breaking self.get_root()
-                            context.set_parent(child, item)
-                        new_items.append(child)
+                        new_items.append((child, path))
                         if debug:
                             debug("add " + abbreviate(child))
                 elif found is not None:
-                    if index > 0:
-                        # See comment above.
-                        context.set_parent(found, item)
-                    new_items.append(found)
+                    new_items.append((found, path))
                     if debug:
                         debug("add " + abbreviate(found))
             items = new_items
         return items
 
 
+def build_tables(
+    db,
+    raw_data: dict,
+    targets: list[tuple[Table, str, Optional[set[str]]]],
+    context: Optional[str] = None,
+):
+    """Insert the data into several tables made by Table.create(), e.g. pods and pod_labels.
+    Tables whose rows come from the data's items share one pass over them, so each item is
+    decoded and visited once, rather than once per table, and its rows are inserted in batches.
+
+    :param targets: for each table, its (possibly schema-qualified) name and the columns to
+        populate, as for Table.insert()
+    :param context: value for the context column, if the tables have one
+    """
+    shared = [target for target in targets if target[0].iterates_items]
+    items = raw_data.get("items") if isinstance(raw_data, dict) else None
+    if len(shared) < 2 or not (isinstance(raw_data, ItemStream) or isinstance(items, list)):
+        shared = []
+    for table, table_name, columns in targets:
+        if (table, table_name, columns) not in shared:
+            table.insert(db, raw_data, table_name, columns, context)
+    if not shared:
+        return
+    source = raw_data.iter_items() if isinstance(raw_data, ItemStream) else iter(items)
+    writers = []
+    for (table, table_name, columns), feed in zip(shared, itertools.tee(source, len(shared))):
+        feed = _Feed(feed)
+        rows = table.rows(_SharedItems(raw_data, feed), columns, context)
+        writers.append(_BatchWriter(db, table._insert_sql(table_name), rows, feed))
+    # Advance the tables in step, so that the items they share are decoded once and only a
+    # couple of them are held in memory.
+    step = 0
+    while writers:
+        step += 1
+        writers = [writer for writer in writers if writer.advance(step)]
+
+
+def create_indexes(db, table_name: str, columns: Iterable[str]) -> bool:
+    """Index columns of a table, for joins and filters on them, unless they're indexed already,
+    then update the statistics SQLite's query planner uses to choose among indexes.
+
+    :param table_name: the (possibly schema-qualified) name of the table
+    :return: True if any indexes were created
+    """
+    if not columns:
+        return False
+    schema, _, name = table_name.rpartition(".")
+    prefix = f"{schema}." if schema else ""
+    existing = db.query(
+        f"SELECT name FROM {prefix}sqlite_master WHERE type = 'index' AND tbl_name = ?",
+        data=[name],
+    )
+    existing = {index_name for (index_name,) in existing}
+    created = False
+    for column in sorted(columns):
+        if (index_name := f"{name}__{column}") not in existing:
+            db.execute(f"CREATE INDEX {prefix}{index_name} ON {name}({column})")
+            created = True
+    if created:
+        # Sample the indexes rather than reading them entirely.
+        db.execute("PRAGMA analysis_limit = 1000")
+        db.execute(f"ANALYZE {table_name}")
+    return created
+
+
+class _Feed:
+    """One table's view of the shared items, counting how many it has taken."""
+
+    def __init__(self, items: Iterator[dict]):
+        self._items = items
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> dict:
+        item = next(self._items)
+        self.count += 1
+        return item
+
+
+class _SharedItems(Mapping):
+    """Stand-in for the data passed to one table's rows(), see build_tables().  Its items come
+    from a shared feed, and can be iterated only once."""
+
+    def __init__(self, data: dict, feed: _Feed):
+        self._data = data
+        self._feed = feed
+
+    def iter_items(self) -> Iterator[dict]:
+        return self._feed
+
+    def __getitem__(self, key):
+        return self._feed if key == "items" else self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _BatchWriter:
+    """Insert one table's rows in batches, as build_tables() advances through the items."""
+
+    def __init__(self, db, sql: str, rows: Iterator[tuple], feed: _Feed):
+        self._db = db
+        self._sql = sql
+        self._rows = rows
+        self._feed = feed
+        self._batch = []
+
+    def advance(self, count: int) -> bool:
+        """Take rows until the table has taken more than `count` items.  Return False, having
+        inserted all the rows, if there are no more."""
+        while self._feed.count <= count:
+            row = next(self._rows, None)
+            if row is None:
+                self._flush()
+                return False
+            self._batch.append(row)
+            if len(self._batch) >= BATCH_SIZE:
+                self._flush()
+        return True
+
+    def _flush(self):
+        if self._batch:
+            self._db.execute_many(self._sql, self._batch)
+            self._batch = []
+
+
 class RowContext:
     """Provide helpers to row-generating functions.
 
     Primarily, the `.data` attribute holds the JSON data from 'kubectl get' or similar.
-    The `.set_parent` and `.get_parent` methods allow row-generating functions to track
-    parent objects as they iterate through nested data structures."""
+    The `.ancestors` attribute holds the objects enclosing the current row's object in the
+    data, outermost first, so that the `.get_parent` and `.get_root` methods can resolve
+    parent references.  The `.wants` method lets row-generating functions skip computing
+    columns the query doesn't use."""
 
-    def __init__(self, data):
+    def __init__(self, data, columns: Optional[set[str]] = None):
         self.data = data
         self.debug = debugging("extract")
-        self._parents = {}
+        self.columns = columns
+        self.ancestors: tuple = ()
 
-    def set_parent(self, child, parent):
-        self._parents[id(child)] = parent
+    def wants(self, *column_names: str) -> bool:
+        """Return True if any of the named columns should be populated.  Row-generating functions
+        may leave the others null."""
+        return self.columns is None or any(name in self.columns for name in column_names)
 
-    def get_parent(self, child, depth: int = 1):
-        while depth > 0 and child is not None:
-            child = self._parents.get(id(child))
-            depth -= 1
-        return child
+    def get_parent(self, depth: int = 1):
+        """Return the ancestor `depth` levels above the current row's object, or None if there
+        isn't one."""
+        ancestors = self.ancestors
+        return ancestors[-depth] if depth <= len(ancestors) else None
 
-    def get_root(self, child):
-        while (parent := self._parents.get(id(child))) is not None:
-            child = parent
-        return child
+    def get_root(self, obj):
+        """Return the outermost ancestor of the current row's object `obj`, or the object itself
+        if it has no ancestors."""
+        return self.ancestors[0] if self.ancestors else obj
 
 
 @dataclass
@@ -213,7 +482,7 @@ class Itemizer:
     # Original row_source expression
     expr: str
     # JMESPath expression to find the items
-    finder: ParsedResult
+    finder: Union[ParsedResult, ChainFinder]
     # Should dictionaries be unpacked to a key/value array
     unpack: bool
 
@@ -228,6 +497,6 @@ class Itemizer:
         else:
             fail(f"Invalid row_source options: {s}")
         try:
-            return Itemizer(s, jmespath.compile(parts[0]), unpack)
+            return Itemizer(s, compile_path(parts[0]), unpack)
         except jmespath.exceptions.ParseError as e:
             fail(f"invalid row_source {parts[0]} for table {table_name}", e)
@@ -0,0 +1,171 @@
+"""
+This is separate from engine.py for maintainability.
+With 'kugl serve --watch', resources are kept current by watching them for changes, so that
+refreshing the cache costs work in proportion to what changed, not to how much there is.
+"""
+
+import json
+from pathlib import Path
+import subprocess as sp
+from threading import Event, Lock, Thread
+from typing import Optional
+
+from .registry import Resource
+from ..util import ItemStream, clock, debugging
+
+# The server's watches, set by 'kugl serve --watch'
+WATCHES: Optional["Watches"] = None
+
+
+class Watches:
+    """The watches kept by a server, one per resource cache file."""
+
+    def __init__(self):
+        self._watchers: dict[Path, Watcher] = {}
+        # Queries may run concurrently, see QueryServer
+        self._lock = Lock()
+
+    def sync(self, resources: dict[Path, Resource], binary: bool = False) -> set[Path]:
+        """Start watching resources that can be watched and aren't yet; for those already
+        watched, bring their cache files up to date.
+
+        :param resources: resources used by a query, keyed by cache file path
+        :param binary: write cache files in the binary format, see DataCache
+        :return: the cache file paths that are now up to date
+        """
+        current = set()
+        with self._lock:
+            for path, resource in resources.items():
+                if (watcher := self._watchers.get(path)) is not None:
+                    if watcher.sync(path, binary):
+                        current.add(path)
+                elif resource.cacheable and resource.watch_command("") is not None:
+                    self._watchers[path] = watcher = Watcher(resource)
+                    watcher.start()
+        return current
+
+    def stop(self):
+        with self._lock:
+            for watcher in self._watchers.values():
+                watcher.stop()
+
+
+class Watcher:
+    """Keep a copy of a resource's items, updated by watch events.
+
+    The items are listed with get_objects(), then the resource's watch_command() is run from the
+    version of the list, and the events applied as they arrive.  When a watch ends, another
+    is started from the last version seen.  If the version is too old, or anything fails, the
+    items are listed again.
+
+    Each watch is limited to TIMEOUT seconds, and the API server sends bookmarks meanwhile, so
+    a watch that's silent for longer than SILENCE seconds has hung.  Then the items aren't
+    considered current, and the watch is ended so they can be listed again."""
+
+    # Seconds to wait between watches, and before retrying after a failure
+    PAUSE = 1.0
+    # Seconds a watch may last, and may go without an event before it's considered hung
+    TIMEOUT = 300
+    SILENCE = 360
+
+    def __init__(self, resource: Resource):
+        self.resource = resource
+        # Items by UID, and the other fields of the list
+        self._items: dict[str, dict] = {}
+        self._fields: dict = {}
+        # Whether the items are from a complete list, and have changed since the last sync()
+        self._ready = False
+        self._changed = False
+        # When we last heard from the API server
+        self._heard = 0
+        self._lock = Lock()
+        self._stopped = Event()
+        self._process: Optional[sp.Popen] = None
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._process is not None:
+            self._process.terminate()
+
+    def sync(self, path: Path, binary: bool = False) -> bool:
+        """Write the items to a cache file, if they've changed since the last time.
+        :return: False if the watch isn't working, so the file can't be brought up to date"""
+        with self._lock:
+            if not self._ready:
+                return False
+            if clock.CLOCK.now() - self._heard > self.SILENCE:
+                if debug := debugging("watch"):
+                    debug(f"no events for {self.resource.name} since {self._heard}")
+                if self._process is not None:
+                    self._process.terminate()
+                return False
+            if self._changed:
+                items = iter(list(self._items.values()))
+                ItemStream(items, dict(self._fields)).spool(path, binary)
+                self._changed = False
+            return True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._list_and_watch()
+            except BaseException as e:
+                # Including SystemExit from a failed kubectl
+                if debug := debugging("watch"):
+                    debug(f"failed for {self.resource.name}: {e!r}")
+            with self._lock:
+                self._ready = False
+            self._stopped.wait(self.PAUSE)
+
+    def _list_and_watch(self):
+        data = self.resource.get_objects()
+        items = {item["metadata"]["uid"]: item for item in data["items"]}
+        version = data["metadata"]["resourceVersion"]
+        with self._lock:
+            self._items = items
+            self._fields = {name: value for name, value in data.items() if name != "items"}
+            self._ready = self._changed = True
+            self._heard = clock.CLOCK.now()
+        while not self._stopped.is_set() and version is not None:
+            version = self._watch(version)
+            self._stopped.wait(self.PAUSE)
+
+    def _watch(self, version: str) -> Optional[str]:
+        """Run one watch and apply its events.
+        :return: the last version seen, or None if the items must be listed again"""
+        args = self.resource.watch_command(version, self.TIMEOUT)
+        if debug := debugging("fetch"):
+            debug(f"running {' '.join(args)}")
+        with sp.Popen(args, stdout=sp.PIPE, stderr=sp.DEVNULL, encoding="utf-8") as process:
+            self._process = process
+            for line in process.stdout:
+                event = json.loads(line)
+                kind, item = event["type"], event["object"]
+                if kind == "ERROR":
+                    # Most likely 410 Gone, if the version is too old to watch from.
+                    if debug := debugging("watch"):
+                        debug(f"error for {self.resource.name}: {item.get('message')}")
+                    process.terminate()
+                    return None
+                version = item["metadata"]["resourceVersion"]
+                with self._lock:
+                    self._heard = clock.CLOCK.now()
+                    if kind == "BOOKMARK":
+                        continue
+                    if kind == "DELETED":
+                        self._items.pop(item["metadata"]["uid"], None)
+                    else:
+                        self._items[item["metadata"]["uid"]] = item
+                    self._changed = True
+                if debug := debugging("watch"):
+                    debug(f"{kind.lower()} {self.resource.name} {item['metadata'].get('name')}")
+        if process.returncode != 0:
+            return None
+        # The server ended the watch on time.
+        with self._lock:
+            self._heard = clock.CLOCK.now()
+        return version
@@ -5,13 +5,25 @@ Command-line entry point.
 import argparse
 import os
 from argparse import ArgumentParser
+from pathlib import Path
+import subprocess as sp
 import sys
 from sqlite3 import DatabaseError
 from typing import List, Optional, Type
 
 from kugl.impl.registry import Registry
 from kugl.impl.engine import Engine, CHECK, NEVER_UPDATE, ALWAYS_UPDATE, CacheFlag
-from kugl.impl.config import UserInit, parse_file, Settings, Shortcut, SecondaryUserInit
+from kugl.impl import watch
+from kugl.impl.watch import Watches
+from kugl.impl.config import (
+    UserInit,
+    parse_file,
+    Settings,
+    Shortcut,
+    SecondaryUserInit,
+    qualified_name,
+)
+from kugl.client import socket_path
 from kugl.util import (
     Age,
     fail,
@@ -22,6 +34,8 @@ from kugl.util import (
     KuglError,
     Query,
     failure_preamble,
+    kube_context,
+    kube_contexts,
 )
 
 # Register built-ins immediately because they're needed for command-line parsing
@@ -58,7 +72,11 @@ def main1(argv: List[str]):
     sys.exit(1)
 
 
-def main2(argv: List[str], init: Optional[UserInit] = None):
+def main2(
+    argv: List[str],
+    init: Optional[UserInit] = None,
+    shortcuts: Optional[dict[str, Shortcut]] = None,
+):
     kugl_home().mkdir(exist_ok=True)
     if not argv:
         fail("Missing sql query")
@@ -67,6 +85,10 @@ def main2(argv: List[str], init: Optional[UserInit] = None):
         _handle_init_command()
         return
 
+    if argv[0] == "serve":
+        _handle_serve_command(argv[1:])
+        return
+
     if argv[0] == "schema" or argv[0] == "--schema":
         if len(argv) < 2:
             fail("Missing schema or table name")
@@ -86,15 +108,35 @@ def main2(argv: List[str], init: Optional[UserInit] = None):
     if " " not in args.sql:
         if not (shortcut := shortcuts.get(args.sql)):
             fail(f"No shortcut named '{args.sql}' is defined")
-        return main2(argv[:-1] + shortcut.args, init)
+        return main2(argv[:-1] + shortcut.args, init, shortcuts)
 
     if args.debug:
         debug_features(args.debug.split(","))
     if debug := debugging("init"):
         debug(f"settings: {init.settings}")
 
-    engine = Engine(args, cache_flag, init.settings)
+    engine = Engine(args, cache_flag, init.settings, init.cache)
+    if args.revalidate:
+        engine.refresh(Query(args.sql))
+        return
     print(engine.query_and_format(Query(args.sql)))
+    if engine.revalidate:
+        _revalidate(argv, engine)
+
+
+def _revalidate(argv: List[str], engine: Engine):
+    """Start a detached Kugl process to refresh the cached data a query used after it expired.
+    It plans the query again, to fetch the resources as this one would have, but fetches only
+    those resources, and doesn't run the query.  Resources another process is already fetching
+    are skipped."""
+    names = sorted({r.base_name for r in engine.revalidate if not engine.cache.is_locked(r)})
+    if not names:
+        return
+    if debug := debugging("cache"):
+        debug("refreshing in the background", " ".join(names))
+    # The last -u wins, so this overrides any in argv.
+    args = [sys.executable, "-m", "kugl.main", *argv, "--revalidate", "-u", ",".join(names)]
+    sp.Popen(args, stdin=sp.DEVNULL, stdout=sp.DEVNULL, stderr=sp.DEVNULL, start_new_session=True)
 
 
 def parse_args(
@@ -106,10 +148,20 @@ def parse_args(
     ap.add_argument("-H", "--no-headers", default=False, action="store_true")
     ap.add_argument("-r", "--reckless", default=False, action="store_true")
     ap.add_argument("-t", "--timeout", type=str)
-    ap.add_argument("-u", "--update", default=False, action="store_true")
-    ap.add_argument("sql")
+    ap.add_argument("-u", "--update", nargs="?", const="", metavar="RESOURCES")
+    # Used by _revalidate
+    ap.add_argument("--revalidate", default=False, action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("sql", nargs="?")
     args = ap.parse_args(argv)
-    if args.cache and args.update:
+    if args.sql is None:
+        # -u takes an optional list of resources, so it may have taken the query instead
+        if not args.update:
+            ap.error("the following arguments are required: sql")
+        args.sql, args.update = args.update, ""
+    # -u alone refreshes everything; -u with a list of resources refreshes just those
+    update_all = args.update == ""
+    args.update = [qualified_name(name) for name in (args.update or "").split(",") if name]
+    if args.cache and update_all:
         fail("Cannot use both -c/--cache and -u/--update")
     if args.timeout:
         settings.cache_timeout = Age(args.timeout)
@@ -117,7 +169,7 @@ def parse_args(
         settings.reckless = True
     if args.no_headers:
         settings.no_headers = True
-    return args, (ALWAYS_UPDATE if args.update else NEVER_UPDATE if args.cache else CHECK)
+    return args, (ALWAYS_UPDATE if update_all else NEVER_UPDATE if args.cache else CHECK)
 
 
 def _merge_init_files() -> tuple[UserInit, dict[str, Shortcut]]:
@@ -167,5 +219,39 @@ def _handle_init_command():
     print(f"Created {kubernetes_yaml}")
 
 
+def _handle_serve_command(argv: List[str]):
+    """Answer queries from kuglc until interrupted."""
+    from kugl.serve import QueryServer
+
+    ap = ArgumentParser(prog="kugl serve")
+    ap.add_argument("--socket", type=str)
+    ap.add_argument("--watch", default=False, action="store_true")
+    ap.add_argument("--debug", type=str)
+    args = ap.parse_args(argv)
+    if args.debug:
+        # For output not belonging to any one query, like that of the watches
+        debug_features(args.debug.split(","))
+    path = Path(args.socket) if args.socket else socket_path()
+    if args.watch:
+        watch.WATCHES = Watches()
+    with QueryServer(path, serve_query) as server:
+        print(f"kugl: serving queries on {path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if watch.WATCHES is not None:
+                watch.WATCHES.stop()
+
+
+def serve_query(argv: List[str]):
+    """Run one command line for kuglc.  Unlike a new kugl process, the server has to forget
+    what the previous query set up.  (Debug flags are private to each query, see QueryServer.)"""
+    kube_context.cache_clear()
+    kube_contexts.cache_clear()
+    main2(argv)
+
+
 if __name__ == "__main__":
     main()
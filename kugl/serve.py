@@ -0,0 +1,129 @@
+"""
+The server for 'kugl serve', which answers queries from 'kuglc' over a Unix domain socket.
+
+Queries run in a process where Python, Kugl's modules and parsed configuration are already
+loaded, so repeated queries skip that startup work.  Tables built from cached data are reused
+from the table store as they would be by 'kugl'.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import io
+import json
+from pathlib import Path
+import socketserver
+from sqlite3 import DatabaseError
+import sys
+import traceback
+from typing import Callable, Optional
+
+from .client import is_serving
+from .util import KuglError, fail, request_debug_flags
+
+# The output of the request being answered, as (stdout, stderr); see _RequestStream.
+_OUTPUT: ContextVar[Optional[tuple[io.StringIO, io.StringIO]]] = ContextVar("_OUTPUT", default=None)
+
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Answer requests from kuglc, each in its own thread, so that a query waiting on a slow
+    fetch doesn't hold up the others.  Each request has its own debug flags and output, see
+    answer(); anything else printed, e.g. by the watch threads, goes to the server's stdout
+    and stderr."""
+
+    daemon_threads = True
+
+    def __init__(self, path: Path, run: Callable[[list[str]], None]):
+        """
+        :param path: where to create the socket
+        :param run: function to run a command line, writing to stdout and stderr; it may raise
+            KuglError or SystemExit as main2() does
+        """
+        if path.exists():
+            # Replace a socket left by a server that didn't exit cleanly, but not a live one.
+            if is_serving(path):
+                fail(f"kugl is already serving on {path}")
+            path.unlink()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.run = run
+        super().__init__(str(path), _Handler)
+
+    def serve_forever(self, poll_interval: float = 0.5):
+        """Answer requests until shutdown(), with sys.stdout and sys.stderr replaced so that
+        each request's output can be captured; see _RequestStream."""
+        streams = sys.stdout, sys.stderr
+        sys.stdout = _RequestStream(0, sys.stdout)
+        sys.stderr = _RequestStream(1, sys.stderr)
+        try:
+            super().serve_forever(poll_interval)
+        finally:
+            sys.stdout, sys.stderr = streams
+
+    def server_close(self):
+        super().server_close()
+        self.path.unlink(missing_ok=True)
+
+    def answer(self, argv: list[str]) -> dict:
+        """Run a command line, capturing its output and exit status the way the shell would
+        see them if kugl were run directly.  No exception ends the server."""
+        stdout, stderr = io.StringIO(), io.StringIO()
+        status = 0
+        with _captured(stdout, stderr), request_debug_flags():
+            try:
+                self.run(argv)
+            except SystemExit as e:
+                if isinstance(e.code, str):
+                    print(e.code, file=sys.stderr)
+                status = e.code if isinstance(e.code, int) else 0 if e.code is None else 1
+            except (KuglError, DatabaseError) as e:
+                print(e, file=sys.stderr)
+                status = 1
+            except Exception:
+                traceback.print_exc()
+                status = 1
+        return {"status": status, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+
+@contextmanager
+def _captured(stdout: io.StringIO, stderr: io.StringIO):
+    """Within this context, and threads or tasks started from it, send output to the given
+    streams rather than the server's."""
+    token = _OUTPUT.set((stdout, stderr))
+    try:
+        yield
+    finally:
+        _OUTPUT.reset(token)
+
+
+class _RequestStream:
+    """Stands in for sys.stdout or sys.stderr while serving.  Unlike redirect_stdout(), which
+    would mix the output of concurrent requests, this writes to the output of the request
+    whose context it's called from, or to the original stream outside a request."""
+
+    def __init__(self, index: int, stream):
+        self._index = index
+        self._stream = stream
+
+    def _target(self):
+        output = _OUTPUT.get()
+        return self._stream if output is None else output[self._index]
+
+    def write(self, s: str) -> int:
+        return self._target().write(s)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # Just checking if we're alive, see is_serving()
+            return
+        request = json.loads(line)
+        response = self.server.answer(request["argv"])
+        self.wfile.write(json.dumps(response).encode())
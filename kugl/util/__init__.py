@@ -1,23 +1,36 @@
 from .age import Age, parse_age, to_age
 from .clock import UNIT_TEST_TIMEBASE
-from .debug import debug_features, debugging, features_debugged
+from .debug import debug_features, debugging, features_debugged, request_debug_flags
+from .jsonstream import ItemStream, iter_items
 from .misc import (
     fail,
     failure_preamble,
     friendlier_errors,
     best_guess_parse,
     KuglError,
+    kugl_version,
     parse_utc,
     run,
+    run_async,
+    run_streaming,
     TABLE_NAME_RE,
+    temp_path,
     to_utc,
     warn,
     WHITESPACE_RE,
     cleave,
     abbreviate,
 )
-from .paths import KPath, ConfigPath, kugl_home, kube_home, kugl_cache, kube_context
-from .size import parse_size, to_size, parse_cpu
+from .paths import (
+    KPath,
+    ConfigPath,
+    kugl_home,
+    kube_home,
+    kugl_cache,
+    kube_context,
+    kube_contexts,
+)
+from .size import parse_size, parse_sizes, to_size, parse_cpu, parse_cpus
 from .sqlite import SqliteDb
 from .sqlparse import Query
 
@@ -35,14 +48,22 @@ __all__ = [
     "debug_features",
     "debugging",
     "features_debugged",
+    "request_debug_flags",
+    # jsonstream
+    "ItemStream",
+    "iter_items",
     # misc
     "fail",
     "failure_preamble",
     "friendlier_errors",
     "best_guess_parse",
     "KuglError",
+    "kugl_version",
     "parse_utc",
     "run",
+    "run_async",
+    "run_streaming",
+    "temp_path",
     "TABLE_NAME_RE",
     "to_utc",
     "warn",
@@ -56,10 +77,13 @@ __all__ = [
     "kube_home",
     "kugl_cache",
     "kube_context",
+    "kube_contexts",
     # size
     "parse_size",
+    "parse_sizes",
     "to_size",
     "parse_cpu",
+    "parse_cpus",
     # sqlite
     "SqliteDb",
     # sqlparse
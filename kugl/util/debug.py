@@ -1,8 +1,17 @@
 import sys
 from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import Union, Optional, Callable
 
 DEBUG_FLAGS = {}
+# Flags for a single query answered by 'kugl serve', which mustn't affect other queries
+# running at the same time; see request_debug_flags.
+_REQUEST_FLAGS: ContextVar[Optional[dict]] = ContextVar("_REQUEST_FLAGS", default=None)
+
+
+def _flags() -> dict:
+    flags = _REQUEST_FLAGS.get()
+    return DEBUG_FLAGS if flags is None else flags
 
 
 def debug_features(features: Union[str, list[str]], on: bool = True):
@@ -13,23 +22,36 @@ def debug_features(features: Union[str, list[str]], on: bool = True):
     """
     if isinstance(features, str):
         features = features.split(",")
+    flags = _flags()
     for feature in features:
         if feature == "all" and not on:
-            DEBUG_FLAGS.clear()
+            flags.clear()
         else:
-            DEBUG_FLAGS[feature] = on
+            flags[feature] = on
 
 
 @contextmanager
 def features_debugged(features: Union[str, list[str]], on: bool = True):
     """Like debug_features, but works as a context manager to set them temporarily."""
-    old_flags = dict(DEBUG_FLAGS)
+    flags = _flags()
+    old_flags = dict(flags)
     debug_features(features, on)
     try:
         yield
     finally:
-        DEBUG_FLAGS.clear()
-        DEBUG_FLAGS.update(old_flags)
+        flags.clear()
+        flags.update(old_flags)
+
+
+@contextmanager
+def request_debug_flags():
+    """Within this context, and threads or tasks started from it, debug flags start out clear
+    and are private to the context.  Elsewhere the process-wide flags apply."""
+    token = _REQUEST_FLAGS.set({})
+    try:
+        yield
+    finally:
+        _REQUEST_FLAGS.reset(token)
 
 
 def debugging(feature: str = None) -> Optional[Callable]:
@@ -37,11 +59,12 @@ def debugging(feature: str = None) -> Optional[Callable]:
 
     :return: A callable to print a message to stderr prefixed by the feature name, or
         None if the feature isn't being debugged."""
+    flags = _flags()
     if feature is None:
-        if len(DEBUG_FLAGS) > 0:
+        if len(flags) > 0:
             return lambda *args: _dprint("all", args)
         return None
-    if DEBUG_FLAGS.get(feature) or DEBUG_FLAGS.get("all"):
+    if flags.get(feature) or flags.get("all"):
         return lambda *args: _dprint(feature, args)
     return None
 
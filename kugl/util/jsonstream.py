@@ -0,0 +1,304 @@
+"""
+Incremental decoding of large JSON documents, such as the output of 'kubectl get -o json'.
+"""
+
+from collections.abc import Mapping
+import json
+import marshal
+import os
+from pathlib import Path
+import struct
+import tempfile
+from typing import BinaryIO, Iterator, Optional, TextIO
+import weakref
+
+from .misc import kugl_version, temp_path
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+# Files in the binary format start with this and a JSON header line, see BINARY_HEADER.  Then
+# each item is a record holding its marshalled value, with a tag and length; the last record
+# holds the other fields.  Marshalled data decodes faster than JSON.  Files are only read as
+# this format when their header matches BINARY_HEADER; the Kugl version is recorded too, for
+# troubleshooting.
+BINARY_MAGIC = b"KUGL\x00"
+BINARY_HEADER = {"format": 1, "marshal": marshal.version}
+_RECORD = struct.Struct("<cI")
+_ITEM, _FIELDS = b"I", b"F"
+
+
+class _Reader:
+    """Decode successive JSON values and punctuation from a text stream, reading only as much
+    of the stream as needed."""
+
+    def __init__(self, f: TextIO, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size: int) -> bool:
+        """Append more of the stream to the buffer, discarding what's been consumed.
+        :return: False if at the end of the stream"""
+        data = self.f.read(size)
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos :] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character, or "" at the end of the stream."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill(self.chunk_size):
+                return ""
+
+    def expect(self, choices: str) -> str:
+        """Consume and return the next character, which must be one of the choices."""
+        c = self.peek()
+        if c == "" or c not in choices:
+            found = repr(c) if c else "end of input"
+            raise ValueError(f"expected one of {' '.join(choices)} in JSON, found {found}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+                # A number at the end of the buffer may continue in the next chunk.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Read geometrically more each time, so a large value is decoded in linear time.
+            self._fill(size)
+            size = max(size, len(self.buf))
+
+
+def iter_items(f: TextIO, fields: dict, key: str = "items", chunk_size: int = 1 << 16):
+    """Decode a JSON object of the form {..., "items": [...], ...} from a text stream,
+    yielding the elements of the list one at a time.  The other members of the object are
+    added to `fields`; those following the list are only present once it's exhausted.
+
+    :param f: the text stream
+    :param fields: dict to receive members of the object other than the list
+    :param key: the name of the list member
+    :param chunk_size: how much to read from the stream at a time
+    """
+    reader = _Reader(f, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        name = reader.value()
+        if not isinstance(name, str):
+            raise ValueError(f"expected a member name in JSON, found {name!r}")
+        reader.expect(":")
+        if name == key and reader.peek() == "[":
+            reader.expect("[")
+            if reader.peek() == "]":
+                reader.expect("]")
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(",]") == "]":
+                        break
+        else:
+            fields[name] = reader.value()
+        if reader.expect(",}") == "}":
+            return
+
+
+class ItemStream(Mapping):
+    """A JSON object with a possibly very large list of items, such as the output of
+    'kubectl get -o json', that is never held in memory all at once.
+
+    Items arrive from a one-time source (e.g. a pipe from kubectl) and are written to a file as
+    they are read; thereafter each iteration over the items decodes them afresh from the file.
+    So memory use is bounded by the size of one item, not of the whole list, regardless of how
+    many tables are built from the data.  The other members of the object are kept in memory."""
+
+    # Files written by spool() start with this, see DataCache.load
+    PREFIX = '{"items": ['
+
+    def __init__(self, items: Iterator[dict], fields: dict):
+        """
+        :param items: the one-time source of items
+        :param fields: the other members of the object, which may be filled in by the source
+            as it's read
+        """
+        self._source = items
+        self._fields = fields
+        self._path = None
+        self._binary = False
+
+    @classmethod
+    def from_file(cls, path: Path, binary: bool = False) -> "ItemStream":
+        """Read a file written by spool() or matching its format.
+
+        :param binary: True if the file is in the binary format, see file_format()"""
+        stream = cls(iter(()), {})
+        stream._path = path
+        stream._binary = binary
+        stream._fields = None
+        return stream
+
+    @staticmethod
+    def file_format(path: Path) -> Optional[str]:
+        """Identify the format of a file.
+
+        :return: "binary" or "stream" if the file was written by spool(), "json" if it's some
+            other JSON file, or None if it's in a binary format this Kugl can't read"""
+        with open(path, "rb") as f:
+            start = f.read(max(len(BINARY_MAGIC), len(ItemStream.PREFIX)))
+            if start.startswith(BINARY_MAGIC):
+                f.seek(len(BINARY_MAGIC))
+                return "binary" if _read_header(f) == BINARY_HEADER else None
+        return "stream" if start == ItemStream.PREFIX.encode() else "json"
+
+    def spool(self, path: Optional[Path] = None, binary: bool = False):
+        """Consume the source of items, writing it to a file, and read the items from there
+        thereafter.  If no path is given, a temporary file is used, and only if the stream
+        isn't already in a file.  The file is written under another name then renamed, so it's
+        never seen incomplete.
+
+        :param binary: write the binary format rather than JSON; it's faster to read, but
+            only by Kugl"""
+        if path is None:
+            if self._path is not None:
+                return
+            fd, name = tempfile.mkstemp(prefix="kugl", suffix=".json")
+            os.close(fd)
+            path = Path(name)
+            weakref.finalize(self, path.unlink, missing_ok=True)
+        temp = temp_path(path)
+        try:
+            if binary:
+                with open(temp, "wb") as f:
+                    self._write_binary(f)
+            else:
+                with open(temp, "w", encoding="utf-8") as f:
+                    self._write_json(f)
+            temp.replace(path)
+        except BaseException:
+            # Including SystemExit from a failed kubectl
+            temp.unlink(missing_ok=True)
+            raise
+        self._path = path
+        self._binary = binary
+
+    def _write_json(self, f: TextIO):
+        f.write(self.PREFIX)
+        for index, item in enumerate(self._items()):
+            f.write(", " + json.dumps(item) if index > 0 else json.dumps(item))
+        f.write("]")
+        for name, value in self._fields.items():
+            f.write(f", {json.dumps(name)}: {json.dumps(value)}")
+        f.write("}")
+
+    def _write_binary(self, f: BinaryIO):
+        header = dict(BINARY_HEADER, kugl=kugl_version())
+        f.write(BINARY_MAGIC + json.dumps(header).encode() + b"\n")
+        for item in self._items():
+            data = marshal.dumps(item)
+            f.write(_RECORD.pack(_ITEM, len(data)) + data)
+        data = marshal.dumps(self._fields)
+        f.write(_RECORD.pack(_FIELDS, len(data)) + data)
+
+    def _items(self) -> Iterator[dict]:
+        if self._path is None:
+            # Consume the one-time source.
+            yield from self._source
+            return
+        fields = {}
+        if self._binary:
+            with open(self._path, "rb", buffering=1 << 16) as f:
+                f.seek(len(BINARY_MAGIC))
+                _read_header(f)
+                yield from _read_records(f, fields)
+        else:
+            with open(self._path, encoding="utf-8") as f:
+                yield from iter_items(f, fields)
+        self._fields = fields
+
+    def iter_items(self) -> Iterator[dict]:
+        """Decode the items one at a time.  This can be done any number of times."""
+        self.spool()
+        return self._items()
+
+    def to_dict(self) -> dict:
+        """Decode the whole object into memory, e.g. for use with JMESPath."""
+        self.spool()
+        if self._binary:
+            items = list(self._items())
+            return {"items": items, **self._fields}
+        return json.loads(self._path.read_text(encoding="utf-8"))
+
+    def _known_fields(self) -> dict:
+        self.spool()
+        if self._fields is None:
+            for _ in self.iter_items():
+                pass
+        return self._fields
+
+    def __getitem__(self, key):
+        if key == "items":
+            return _ItemList(self)
+        return self._known_fields()[key]
+
+    def __iter__(self):
+        return iter(["items", *self._known_fields()])
+
+    def __len__(self):
+        return 1 + len(self._known_fields())
+
+
+class _ItemList:
+    """The re-iterable value of ItemStream["items"]"""
+
+    def __init__(self, stream: ItemStream):
+        self.stream = stream
+
+    def __iter__(self):
+        return self.stream.iter_items()
+
+
+def _read_header(f: BinaryIO) -> dict:
+    """Read the header line following BINARY_MAGIC, without the Kugl version."""
+    try:
+        header = json.loads(f.readline())
+    except ValueError:
+        return {}
+    header.pop("kugl", None)
+    return header
+
+
+def _read_records(f: BinaryIO, fields: dict) -> Iterator:
+    """Yield the items from the records of a binary file, and put the other fields in `fields`."""
+    while True:
+        tag, length = _RECORD.unpack(_read_exactly(f, _RECORD.size))
+        value = marshal.loads(_read_exactly(f, length))
+        if tag == _FIELDS:
+            fields.update(value)
+            return
+        yield value
+
+
+def _read_exactly(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) < size:
+        raise ValueError("binary cache file is truncated")
+    return data
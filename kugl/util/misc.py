@@ -2,21 +2,74 @@
 Assorted utility functions / classes with no obvious home.
 """
 
+import asyncio
+import importlib.metadata
 import json
+import os
+from pathlib import Path
 import re
 import subprocess as sp
 import sys
+import tempfile
 from contextlib import contextmanager
-from typing import Optional, Union, Tuple
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import cache, lru_cache
+from typing import Iterator, Optional, TextIO, Union, Tuple
 
-import arrow
 import yaml
 
 from .debug import debugging
 
 WHITESPACE_RE = re.compile(r"\s+")
 TABLE_NAME_RE = re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]*$")
-FAILURE_PREAMBLE = None
+FAILURE_PREAMBLE: ContextVar[Optional[str]] = ContextVar("FAILURE_PREAMBLE", default=None)
+
+# Timestamps as Kubernetes writes them, e.g. 2024-03-01T23:04:15Z, with optional fractional
+# seconds and numeric offset
+RFC3339_RE = re.compile(
+    r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.\d+)?(?:Z|([+-])(\d\d):(\d\d))$"
+)
+
+
+class Commands:
+    """The commands started by run() and run_streaming() on behalf of one fetch, so that they
+    can be killed if the fetch is cancelled or times out; see FetchScheduler.  Otherwise a fetch
+    running in a worker thread would wait for its command regardless."""
+
+    def __init__(self):
+        self.killed = False
+        self._running: set[sp.Popen] = set()
+
+    def kill(self):
+        self.killed = True
+        for p in list(self._running):
+            p.kill()
+
+    @contextmanager
+    def track(self, p: sp.Popen):
+        self._running.add(p)
+        # In case the fetch was cancelled just before the command started
+        if self.killed:
+            p.kill()
+        try:
+            yield
+        finally:
+            self._running.discard(p)
+
+
+# The commands of the current fetch, if they're tracked; copied to worker threads by
+# asyncio.to_thread()
+FETCH_COMMANDS: ContextVar[Optional[Commands]] = ContextVar("FETCH_COMMANDS", default=None)
+
+
+@contextmanager
+def _tracked(p: sp.Popen):
+    if (commands := FETCH_COMMANDS.get()) is None:
+        yield
+    else:
+        with commands.track(p):
+            yield
 
 
 def run(args: Union[str, list[str]], error_ok: bool = False) -> Tuple[int, str, str]:
@@ -28,20 +81,108 @@ def run(args: Union[str, list[str]], error_ok: bool = False) -> Tuple[int, str,
         args = ["bash", "-c", args]
     if debug := debugging("fetch"):
         debug(f"running {' '.join(args)}")
-    p = sp.run(args, stdout=sp.PIPE, stderr=sp.PIPE, encoding="utf-8")
+    p = sp.Popen(args, stdout=sp.PIPE, stderr=sp.PIPE, encoding="utf-8")
+    with _tracked(p):
+        out, err = p.communicate()
     if p.returncode != 0 and not error_ok:
-        print(f"failed to run [{' '.join(args)}]:", file=sys.stderr)
-        print(p.stderr, file=sys.stderr, end="")
-        sys.exit(p.returncode)
-    return p.returncode, p.stdout, p.stderr
+        _exit_for_failure(args, p.returncode, err)
+    return p.returncode, out, err
+
+
+async def run_async(args: Union[str, list[str]], error_ok: bool = False) -> Tuple[int, str, str]:
+    """
+    Like run(), but without tying up a thread while the command runs.  If cancelled, e.g. by a
+    fetch timeout, the command is killed.
+    """
+    if isinstance(args, str):
+        args = ["bash", "-c", args]
+    if debug := debugging("fetch"):
+        debug(f"running {' '.join(args)}")
+    p = await asyncio.create_subprocess_exec(*args, stdout=sp.PIPE, stderr=sp.PIPE)
+    try:
+        out, err = await p.communicate()
+    except asyncio.CancelledError:
+        p.kill()
+        await p.wait()
+        raise
+    out, err = out.decode("utf-8"), err.decode("utf-8")
+    if p.returncode != 0 and not error_ok:
+        _exit_for_failure(args, p.returncode, err)
+    return p.returncode, out, err
+
+
+@contextmanager
+def run_streaming(args: list[str]) -> Iterator[TextIO]:
+    """
+    Like run(), but instead of capturing stdout, provide it as a text stream to be read
+    incrementally within the context.  Failure of the command is detected once the context exits,
+    and handled as in run(), even if reading the stream also failed.
+    """
+    if debug := debugging("fetch"):
+        debug(f"running {' '.join(args)}")
+    # Send stderr to a file rather than a pipe, so the command can't block writing it.
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as stderr:
+        p = sp.Popen(args, stdout=sp.PIPE, stderr=stderr, encoding="utf-8")
+        with _tracked(p):
+            try:
+                yield p.stdout
+            finally:
+                # Drain any unread output, so the command isn't killed by SIGPIPE.
+                while p.stdout.read(1 << 16):
+                    pass
+                p.stdout.close()
+                if p.wait() != 0:
+                    stderr.seek(0)
+                    _exit_for_failure(args, p.returncode, stderr.read())
+
+
+def _exit_for_failure(args: list[str], returncode: int, stderr: str):
+    if (commands := FETCH_COMMANDS.get()) is not None and commands.killed:
+        # The fetch has already failed, and nothing waits for this.
+        sys.exit(returncode)
+    print(f"failed to run [{' '.join(args)}]:", file=sys.stderr)
+    print(stderr, file=sys.stderr, end="")
+    sys.exit(returncode)
+
+
+def temp_path(path: Path) -> Path:
+    """Create an empty file with a unique name in the same folder as `path`, to be written then
+    renamed to `path`, so that the file at `path` is replaced all at once."""
+    fd, name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    return Path(name)
 
 
 def parse_utc(utc_str: Optional[str]) -> int:
-    return arrow.get(utc_str).int_timestamp if utc_str else None
+    return _parse_utc(utc_str) if utc_str else None
+
+
+@lru_cache(maxsize=4096)
+def _parse_utc(utc_str: str) -> int:
+    """Parse a timestamp to epoch seconds.  Objects often share timestamps, e.g. the pods of a
+    deployment, so results are cached."""
+    if m := RFC3339_RE.match(utc_str):
+        try:
+            when = datetime(*map(int, m.groups()[:6]), tzinfo=timezone.utc)
+        except ValueError:
+            when = None
+        if when is not None and when.year >= 1970:
+            epoch = int(when.timestamp())
+            sign, off_hour, off_minute = m.groups()[6:]
+            if sign:
+                offset = int(off_hour) * 3600 + int(off_minute) * 60
+                epoch += -offset if sign == "+" else offset
+            return epoch
+    # Other formats, also invalid dates and those where truncating fractional seconds isn't
+    # simple, are left to Arrow, as before.
+    import arrow
+
+    return arrow.get(utc_str).int_timestamp
 
 
 def to_utc(epoch: int) -> str:
-    return arrow.get(epoch).to("utc").format("YYYY-MM-DDTHH:mm:ss") + "Z"
+    when = datetime.fromtimestamp(epoch, timezone.utc)
+    return f"{when.year:04d}-{when:%m-%dT%H:%M:%S}Z"
 
 
 def warn(message: str):
@@ -49,8 +190,8 @@ def warn(message: str):
 
 
 def fail(message: str, e: Optional[Exception] = None):
-    if FAILURE_PREAMBLE is not None:
-        message = FAILURE_PREAMBLE + "\n" + message
+    if (preamble := FAILURE_PREAMBLE.get()) is not None:
+        message = preamble + "\n" + message
     if e is not None:
         raise KuglError(message) from e
     raise KuglError(message)
@@ -59,13 +200,11 @@ def fail(message: str, e: Optional[Exception] = None):
 @contextmanager
 def failure_preamble(preamble: str):
     """Within this context, all calls to fail() will prepend the preamble to the message."""
-    global FAILURE_PREAMBLE
-    old_preamble = FAILURE_PREAMBLE
-    FAILURE_PREAMBLE = preamble
+    token = FAILURE_PREAMBLE.set(preamble)
     try:
         yield
     finally:
-        FAILURE_PREAMBLE = old_preamble
+        FAILURE_PREAMBLE.reset(token)
 
 
 class KuglError(Exception):
@@ -100,6 +239,15 @@ def friendlier_errors(errors: list) -> list[str]:
     return [_improve(e) for e in errors]
 
 
+@cache
+def kugl_version() -> str:
+    """Return the installed Kugl version, or "unknown" if running from a source tree."""
+    try:
+        return importlib.metadata.version("kugl")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
 def best_guess_parse(text):
     if not text:
         return {}
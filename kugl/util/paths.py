@@ -69,10 +69,21 @@ def kube_home() -> KPath:
 @cache
 def kube_context() -> str:
     """Return the current kubernetes context."""
-    kube_config = kube_home() / "config"
-    if not kube_config.exists():
-        fail(f"Missing {kube_config}, can't determine current context")
-    current_context = (yaml.safe_load(kube_config.read_text()) or {}).get("current-context")
+    current_context = _kube_config("determine current context").get("current-context")
     if not current_context:
         fail("No current context, please run kubectl config use-context ...")
     return current_context
+
+
+@cache
+def kube_contexts() -> list[str]:
+    """Return the names of all kubernetes contexts, in the order they're configured."""
+    contexts = _kube_config("list contexts").get("contexts") or []
+    return [context["name"] for context in contexts if context.get("name")]
+
+
+def _kube_config(purpose: str) -> dict:
+    kube_config = kube_home() / "config"
+    if not kube_config.exists():
+        fail(f"Missing {kube_config}, can't {purpose}")
+    return yaml.safe_load(kube_config.read_text()) or {}
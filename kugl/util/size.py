@@ -1,30 +1,51 @@
+from decimal import Decimal
+from functools import lru_cache
 import re
-from typing import Union
+from typing import Iterable, Union
 
-SIZE_RE = re.compile(r"([0-9\.]+)(([KMGTP]i?)?)")
-SIZE_MULTIPLIERS = dict(K=10**3, M=10**6, G=10**9, T=10**12, Ki=2**10, Mi=2**20, Gi=2**30, Ti=2**40)
+# Kubernetes quantities, e.g. 300m, 1.5Gi, 2e3; K is accepted as well as k
+QUANTITY_RE = re.compile(
+    r"([+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))(?:([numkKMGTPE]i?)|[eE]([+-]?[0-9]+))?"
+)
+SIZE_MULTIPLIERS = {
+    **dict(n=Decimal("1e-9"), u=Decimal("1e-6"), m=Decimal("1e-3")),
+    **dict(k=10**3, K=10**3, M=10**6, G=10**9, T=10**12, P=10**15, E=10**18),
+    **dict(Ki=2**10, Mi=2**20, Gi=2**30, Ti=2**40, Pi=2**50, Ei=2**60),
+}
 
 
 def parse_size(x: Union[str, int, None]):
     """
-    Translate a string a la 10K, 5Mb, 3Gi to # of bytes.  Returns an int if the result
+    Translate a string a la 10K, 5Mi, 3Gi, 1e9 to # of bytes.  Returns an int if the result
     can be represented as an int, else a float.
     """
     if x is None:
         return None
     if isinstance(x, int):
         return x
-    m = SIZE_RE.fullmatch(x)
+    return _parse_size(x)
+
+
+@lru_cache(maxsize=1024)
+def _parse_size(x: str):
+    """Parse a size.  Containers mostly share a handful of sizes, so results are cached."""
+    m = QUANTITY_RE.fullmatch(x)
     if m is None:
         raise ValueError(f"Can't translate '{x}' to bytes")
-    amount, suffix = m.group(1), m.group(2)
-    amount = float(amount) if "." in amount else int(amount)
-    if suffix == "":
-        return amount
-    multiplier = SIZE_MULTIPLIERS.get(suffix)
+    amount, suffix, exponent = m.groups()
+    if suffix is None and exponent is None:
+        return float(amount) if "." in amount else int(amount)
+    multiplier = SIZE_MULTIPLIERS.get(suffix) if exponent is None else Decimal(10) ** int(exponent)
     if multiplier is None:
         raise ValueError(f"Unknown size suffix in '{x}'")
-    return int(amount * multiplier)
+    # Decimal, so that e.g. 1.1Gi is exact
+    return int(Decimal(amount) * multiplier)
+
+
+def parse_sizes(values: Iterable[Union[str, int, None]]) -> list:
+    """Like parse_size, for many values at once, e.g. those of a column.  Each distinct value is
+    parsed once."""
+    return _parse_many(values, parse_size)
 
 
 def to_size(nbytes: int, iec=False):
@@ -57,6 +78,31 @@ def parse_cpu(x: Union[str, float, int, None]) -> float:
     """
     if x is None or isinstance(x, float) or isinstance(x, int):
         return x
+    return _parse_cpu(x)
+
+
+@lru_cache(maxsize=1024)
+def _parse_cpu(x: str) -> float:
+    """Parse a number of CPUs, caching results as for _parse_size."""
     if x.endswith("m"):
         return float(x[:-1]) / 1000
-    return float(x)
+    try:
+        return float(x)
+    except ValueError:
+        pass
+    # Other Kubernetes quantities, e.g. 1k or 500u, are rare.
+    m = QUANTITY_RE.fullmatch(x)
+    if m is None or (m.group(2) and m.group(2) not in SIZE_MULTIPLIERS):
+        raise ValueError(f"could not convert string to float: '{x}'")
+    amount, suffix, _ = m.groups()
+    return float(Decimal(amount) * SIZE_MULTIPLIERS[suffix])
+
+
+def parse_cpus(values: Iterable[Union[str, float, int, None]]) -> list:
+    """Like parse_cpu, for many values at once, as for parse_sizes."""
+    return _parse_many(values, parse_cpu)
+
+
+def _parse_many(values: Iterable, parse) -> list:
+    parsed = {}
+    return [parsed[v] if v in parsed else parsed.setdefault(v, parse(v)) for v in values]
@@ -4,13 +4,20 @@ Our entire interface to SQLite features is here.
 
 import collections as co
 import sqlite3
+from contextlib import contextmanager
+from typing import Iterable
 
 from kugl.util import debugging
 
 
 class SqliteDb:
-    def __init__(self, target=None):
+    def __init__(self, target=None, feature: str = "sqlite"):
+        """
+        :param target: pathname of a database file, or None for an in-memory database
+        :param feature: name of the debug feature under which statements are logged
+        """
         self.target = target
+        self.feature = feature
         self.conn = sqlite3.connect(":memory:", check_same_thread=False) if target is None else None
 
     def query(self, sql, **kwargs):
@@ -22,7 +29,7 @@ class SqliteDb:
         :param named bool: If True, rows are namedtuples
         :param names list: If an array, append column names to it
         """
-        if debug := debugging("sqlite"):
+        if debug := debugging(self.feature):
             debug(f"query: {sql}")
         if self.conn:
             return self._query(self.conn, sql, **kwargs)
@@ -55,7 +62,7 @@ class SqliteDb:
         :param sql str: SQL query
         :param data list: Optional update args
         """
-        if debug := debugging("sqlite"):
+        if debug := debugging(self.feature):
             debug(f"execute: {sql}")
         if self.conn:
             self._execute(self.conn, sql, data or [])
@@ -63,8 +70,88 @@ class SqliteDb:
             with sqlite3.connect(self.target) as conn:
                 self._execute(conn, sql, data or [])
 
+    def execute_many(self, sql, rows: Iterable):
+        """
+        Like execute(), for a statement applied to each of a series of rows.
+        :param sql str: SQL statement
+        :param rows: update args for each execution, e.g. a generator of tuples
+        """
+        if debug := debugging(self.feature):
+            debug(f"execute: {sql}")
+        if self.conn:
+            self.conn.cursor().executemany(sql, rows)
+        else:
+            with sqlite3.connect(self.target) as conn:
+                conn.cursor().executemany(sql, rows)
+
     def _execute(self, conn, sql, data):
         if len(data) > 0 and any(isinstance(data[0], x) for x in [list, tuple]):
             conn.cursor().executemany(sql, data)
         else:
             conn.cursor().execute(sql, data)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the statements in a block atomically.  Only supported for the in-memory database,
+        since a target database opens a new connection per statement.
+        """
+        self.commit()
+        self.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
+    def commit(self):
+        """Commit any implicit transaction left open by the sqlite3 module; this is needed before
+        ATTACH or BEGIN.  Only supported for the in-memory database."""
+        assert self.conn is not None
+        if self.conn.in_transaction:
+            self.conn.commit()
+
+    def reads(self, sql: str) -> dict[tuple[str, str], set[str]]:
+        """
+        Compile a query without running it, and report the tables and columns it reads.
+        Only supported for the in-memory database.
+
+        The authorizer callback sees every column read by name, except that SQLite doesn't
+        authorize the columns of USING and NATURAL joins, nor tables read for no columns, as in
+        "SELECT count(*) FROM t".  So the compiled program is also checked for tables opened
+        (OpenRead) and columns read from them (Column).
+
+        :return: a dict mapping (database name, table name) to the names of the columns read;
+            the set may be empty if the table is read but none of its columns are.
+        """
+        assert self.conn is not None
+        result = {}
+
+        def authorize(action, table, column, db, _):
+            if action == sqlite3.SQLITE_READ and db is not None and column:
+                result.setdefault((db, table), set()).add(column)
+            return sqlite3.SQLITE_OK
+
+        # Map database index and root page to tables, and tables to their column names
+        tables, columns = {}, {}
+        for index, db, _ in self.conn.execute("PRAGMA database_list").fetchall():
+            sql_master = f"SELECT name, rootpage FROM {db}.sqlite_master WHERE type = 'table'"
+            for table, rootpage in self.conn.execute(sql_master).fetchall():
+                tables[(index, rootpage)] = (db, table)
+                info = self.conn.execute(f"PRAGMA {db}.table_info({table})").fetchall()
+                columns[(db, table)] = [row[1] for row in info]
+
+        self.conn.set_authorizer(authorize)
+        try:
+            program = self.conn.execute(f"EXPLAIN {sql}").fetchall()
+        finally:
+            self.conn.set_authorizer(None)
+        cursors = {}
+        for _, opcode, p1, p2, p3, *_ in program:
+            if opcode == "OpenRead" and (p3, p2) in tables:
+                cursors[p1] = tables[(p3, p2)]
+                result.setdefault(cursors[p1], set())
+            elif opcode == "Column" and p1 in cursors:
+                result[cursors[p1]].add(columns[cursors[p1]][p2])
+        return result
@@ -1,12 +1,17 @@
 from collections import deque
 from dataclasses import dataclass
-from typing import Optional
+from typing import Optional, Union
 
 import sqlparse
-from sqlparse.tokens import Name, Comment, Punctuation
+from sqlparse.tokens import Name, Comment, Punctuation, String, Comparison
 
 from kugl.util import fail, TABLE_NAME_RE, cleave
 
+# Keywords that end the FROM clause or the WHERE clause
+CLAUSE_KEYWORDS = {"FROM", "WHERE", "GROUP", "ORDER", "LIMIT", "HAVING", "WINDOW"}
+# Keywords that make a query too complex for Query._analyze
+UNSUPPORTED_KEYWORDS = {"WITH", "UNION", "INTERSECT", "EXCEPT", "CASE", "BETWEEN", "VALUES"}
+
 
 @dataclass(frozen=True)
 class NamedTable:
@@ -31,6 +36,30 @@ class NamedTable:
         return f"{self.schema_name}.{self.name}" if self.schema_name else self.name
 
 
+@dataclass(frozen=True)
+class ColumnRef:
+    """A column named in a query, e.g. 'p.name', with the table name or alias if given."""
+
+    table: Optional[str]
+    name: str
+
+    def __str__(self):
+        return f"{self.table}.{self.name}" if self.table else self.name
+
+
+@dataclass(frozen=True)
+class Equality:
+    """A condition in a query of the form 'column = column' or 'column = string'.
+
+    The condition holds for every row produced by the query's FROM clause, unless it's from the
+    ON clause of an outer join; then `outer` is True, and it holds only where both sides of the
+    join are present."""
+
+    left: ColumnRef
+    right: Union[ColumnRef, str]
+    outer: bool = False
+
+
 class Tokens:
     """Hold a list of sqlparse tokens and provide a means to scan with or without skipping whitespace."""
 
@@ -55,8 +84,14 @@ class Query:
 
     def __init__(self, sql: str):
         self.sql = sql
-        # Anything we found following FROM or JOIN.  May include CTEs, but that's OK.
+        # Anything we found following FROM or JOIN.  May include CTEs or miss some tables, but
+        # that's OK, it's only a starting point for QueryPlanner.
         self.named_tables = set()
+        # Tables in the FROM clause by alias (or by name if not aliased), and equality conditions
+        # from the WHERE clause and ON clauses.  These are None if the query is too complex for
+        # us to be sure of them, see _analyze.
+        self.aliases: Optional[dict[str, NamedTable]] = None
+        self.equalities: Optional[list[Equality]] = None
         self._scan()
 
     def schemas_named(self):
@@ -69,7 +104,9 @@ class Query:
         statements = sqlparse.parse(self.sql)
         if len(statements) != 1:
             fail("query must contain exactly one statement")
-        tl = Tokens(statements[0].flatten())
+        tokens = list(statements[0].flatten())
+        self._analyze([t for t in tokens if not t.is_whitespace and t.ttype is not Comment])
+        tl = Tokens(tokens)
 
         while (token := tl.get()) is not None:
             if not token.is_keyword:
@@ -81,7 +118,8 @@ class Query:
     def _scan_table_name(self, tl: Tokens):
         """Scan for a table name following FROM or JOIN and add it to self.named_tables.
         Don't skip whitespace, since the name parts should be adjacent."""
-        if (token := tl.get()) is None:
+        if (token := tl.get()) is None or token.match(Punctuation, "("):
+            # A subquery; its tables will be found by later FROM and JOIN.
             return
         name = token.value
         while (token := tl.get(skip=False)) and (
@@ -89,3 +127,127 @@ class Query:
         ):
             name += token.value
         self.named_tables.add(NamedTable(*cleave(name, ".", flip=True)))
+
+    def _analyze(self, tokens: list):
+        """Find the tables and equality conditions of a query, if it has the form
+            SELECT ... FROM t1 [a1] ([LEFT] JOIN | ,) t2 [a2] [ON ...] ... [WHERE ...] ...
+        with no subqueries, table-valued functions, compound selects and so forth.  Conditions
+        are only found if they're joined by AND at the top level of a WHERE or ON clause."""
+        words = [_first_word(t) for t in tokens]
+        if words[:1] != ["SELECT"] or words.count("SELECT") > 1:
+            return
+        if UNSUPPORTED_KEYWORDS & set(words):
+            return
+
+        # Split the query into clauses, at keywords outside parentheses.
+        clauses, clause, depth = {}, None, 0
+        for token, word in zip(tokens, words):
+            depth += token.match(Punctuation, "(") - token.match(Punctuation, ")")
+            if depth == 0 and word in CLAUSE_KEYWORDS:
+                clause = clauses[word] = []
+            elif clause is not None:
+                clause.append(token)
+        if "FROM" not in clauses or any(t.match(Punctuation, "(") for t in clauses["FROM"]):
+            return
+
+        # Split the FROM clause into tables, each with any join condition
+        entries, entry, outer = [], [], False
+        for token in clauses["FROM"]:
+            is_join = token.is_keyword and token.normalized.endswith("JOIN")
+            if is_join or token.match(Punctuation, ","):
+                entries.append((entry, outer))
+                entry, outer = [], _first_word(token) in ("LEFT", "RIGHT", "FULL")
+            else:
+                entry.append(token)
+        entries.append((entry, outer))
+
+        aliases, equalities = {}, []
+        for entry, outer in entries:
+            words = [_first_word(t) for t in entry]
+            end = next((i for i, w in enumerate(words) if w in ("ON", "USING")), len(entry))
+            parts = _parse_table_ref(entry[:end])
+            if parts is None:
+                return
+            name, alias = parts
+            if (alias or name.name) in aliases:
+                return
+            aliases[alias or name.name] = name
+            if end < len(entry) and words[end] == "ON":
+                equalities.extend(_parse_conjuncts(entry[end + 1 :], outer))
+        equalities.extend(_parse_conjuncts(clauses.get("WHERE", []), False))
+        self.aliases, self.equalities = aliases, equalities
+
+
+def _first_word(token) -> str:
+    """Return the first word of a keyword token, e.g. "LEFT" for "left outer join", else ""."""
+    return token.normalized.split()[0] if token.is_keyword else ""
+
+
+def _identifier(token) -> Optional[str]:
+    """Return the name in a token that may be an unquoted or double-quoted identifier.
+    Accept keywords too, since sqlparse treats column names like "key" as keywords."""
+    if token.ttype is String.Symbol and token.value.startswith('"'):
+        return token.value[1:-1]
+    if (token.ttype is Name or token.is_keyword) and TABLE_NAME_RE.match(token.value):
+        return token.value
+    return None
+
+
+def _parse_table_ref(tokens: list) -> Optional[tuple[NamedTable, Optional[str]]]:
+    """Parse "[schema.]table [[AS] alias]", returning the table and alias, or None if the
+    tokens don't have that form."""
+    names = [_identifier(t) for t in tokens]
+    if len(tokens) >= 3 and tokens[1].match(Punctuation, "."):
+        schema_name, names, tokens = names[0], names[2:], tokens[2:]
+    else:
+        schema_name = None
+    if len(tokens) == 3 and _first_word(tokens[1]) == "AS":
+        names, tokens = [names[0], names[2]], [tokens[0], tokens[2]]
+    if not 1 <= len(tokens) <= 2 or None in names:
+        return None
+    return NamedTable(schema_name, names[0]), (names[1] if len(names) == 2 else None)
+
+
+def _parse_conjuncts(tokens: list, outer: bool) -> list[Equality]:
+    """Find the conditions of the form 'column = column' or 'column = string' among those
+    joined by AND in a WHERE or ON clause.  If there's an OR outside parentheses, none of the
+    conditions necessarily hold, so return nothing."""
+    conjuncts, conjunct, depth = [], [], 0
+    for token in tokens:
+        depth += token.match(Punctuation, "(") - token.match(Punctuation, ")")
+        word = _first_word(token) if depth == 0 else ""
+        if word == "OR":
+            return []
+        if word == "AND":
+            conjuncts.append(conjunct)
+            conjunct = []
+        else:
+            conjunct.append(token)
+    conjuncts.append(conjunct)
+    return list(filter(None, (_parse_equality(c, outer) for c in conjuncts)))
+
+
+def _parse_equality(tokens: list, outer: bool) -> Optional[Equality]:
+    """Parse a condition of the form 'column = column' or 'column = string', in either order,
+    or return None if the tokens don't have that form."""
+    ops = [i for i, t in enumerate(tokens) if t.ttype is Comparison and t.value in ("=", "==")]
+    if len(ops) != 1:
+        return None
+    left, right = _parse_operand(tokens[: ops[0]]), _parse_operand(tokens[ops[0] + 1 :])
+    if isinstance(left, str):
+        left, right = right, left
+    if not isinstance(left, ColumnRef) or right is None:
+        return None
+    return Equality(left, right, outer)
+
+
+def _parse_operand(tokens: list) -> Union[ColumnRef, str, None]:
+    """Parse a column reference '[table.]column' or a single-quoted string."""
+    if len(tokens) == 1 and tokens[0].ttype is String.Single:
+        return tokens[0].value[1:-1].replace("''", "'")
+    names = [_identifier(t) for t in tokens]
+    if len(tokens) == 1 and names[0]:
+        return ColumnRef(None, names[0])
+    if len(tokens) == 3 and tokens[1].match(Punctuation, ".") and names[0] and names[2]:
+        return ColumnRef(names[0], names[2])
+    return None
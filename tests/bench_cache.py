@@ -0,0 +1,47 @@
+"""
+Benchmark reading a pods cache file in each format.  Not run by pytest; use 'make bench'.
+"""
+
+from argparse import ArgumentParser
+import json
+from pathlib import Path
+import tempfile
+import time
+
+from kugl.util import ItemStream
+from .k8s.k8s_mocks import make_pod
+
+
+def main():
+    ap = ArgumentParser()
+    ap.add_argument("--pods", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    template = json.dumps(make_pod("pod"))
+    pods = [json.loads(template.replace('"pod"', f'"pod-{i}"')) for i in range(args.pods)]
+    with tempfile.TemporaryDirectory() as folder:
+        print(f"{'format':12} {'MB':>8} {'seconds':>8}")
+        for name, binary in [("json", False), ("binary", True)]:
+            path = Path(folder) / name
+            ItemStream(iter(pods), {"kind": "List"}).spool(path, binary)
+            best = min(_time_read(path, binary) for _ in range(args.repeat))
+            print(f"{name:12} {path.stat().st_size / 1e6:8.1f} {best:8.3f}")
+        # For comparison with releases before the cache was streamed
+        path = Path(folder) / "json"
+        best = min(_time(lambda: json.loads(path.read_text())) for _ in range(args.repeat))
+        print(f"{'json.loads':12} {path.stat().st_size / 1e6:8.1f} {best:8.3f}")
+
+
+def _time_read(path: Path, binary: bool) -> float:
+    return _time(lambda: sum(1 for _ in ItemStream.from_file(path, binary)["items"]))
+
+
+def _time(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
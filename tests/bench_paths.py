@@ -0,0 +1,60 @@
+"""
+Benchmark the per-call cost of column paths on a pod, evaluated by JMESPath and by
+compile_path(), and of extracting a row of columns one at a time and with a generated
+function.  Not run by pytest; use 'make bench'.
+"""
+
+from argparse import ArgumentParser
+import timeit
+
+import jmespath
+
+from kugl.impl.config import UserColumn
+from kugl.impl.extract import compile_extractors, compile_path
+from kugl.impl.tables import RowContext
+from .k8s.k8s_mocks import make_pod
+
+PATHS = [
+    "metadata.name",
+    "spec.nodeName",
+    "status.containerStatuses[0].restartCount",
+    "spec.containers[0].resources.requests.cpu",
+    "spec.containers[?name == 'main'].image",
+]
+
+
+def main():
+    ap = ArgumentParser()
+    ap.add_argument("--calls", type=int, default=200000)
+    args = ap.parse_args()
+
+    pod = make_pod("pod-1")
+    print(f"{'path':44} {'jmespath ns':>12} {'kugl ns':>8}")
+    for path in PATHS:
+        times = [
+            min(timeit.repeat(lambda: finder.search(pod), number=args.calls, repeat=3))
+            for finder in [jmespath.compile(path), compile_path(path)]
+        ]
+        ns = [t / args.calls * 1e9 for t in times]
+        print(f"{path:44} {ns[0]:12.0f} {ns[1]:8.0f}")
+
+    columns = [UserColumn(name=f"p{i}", path=path) for i, path in enumerate(PATHS[:4] * 5)]
+    columns += [UserColumn(name=f"l{i}", label=f"label-{i}") for i in range(4)]
+    context = RowContext({})
+    extract = compile_extractors(tuple(c.extractor for c in columns), (True,) * len(columns))
+    calls = args.calls // 10
+    times = [
+        min(timeit.repeat(func, number=calls, repeat=3))
+        for func in [
+            lambda: tuple(c.extract(pod, context) for c in columns),
+            lambda: extract(pod, context),
+        ]
+    ]
+    us = [t / calls * 1e6 for t in times]
+    label = f"row of {len(columns)} columns"
+    print(f"\n{label:30} {'by column us':>14} {'generated us':>14}")
+    print(f"{'':30} {us[0]:14.1f} {us[1]:14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -30,6 +30,7 @@ def test_settings_custom(monkeypatch):
         Settings,
         yaml.safe_load("""
         cache_timeout: 5s
+        cache_grace: 10m
         reckless: true
         no_headers: true
         init_path:
@@ -39,6 +40,7 @@ def test_settings_custom(monkeypatch):
     """),
     )
     assert s.cache_timeout == Age(5)
+    assert s.cache_grace == Age(600)
     assert s.reckless
     assert s.no_headers
     assert s.init_path == ["/tmp/abc", "/tmp/xyz", "$BAR/xyz"]
@@ -57,6 +59,23 @@ def test_empty_init():
     assert c.shortcuts == []
 
 
+def test_init_cache_section():
+    c = parse_model(
+        UserInit,
+        yaml.safe_load("""
+        cache:
+          pods: 10s
+          nodes: 1h
+          myschema.things: 300
+    """),
+    )
+    assert c.cache == {
+        "kubernetes.pods": Age(10),
+        "kubernetes.nodes": Age(3600),
+        "myschema.things": Age(300),
+    }
+
+
 def test_config_with_table_extension():
     c = parse_model(
         UserConfig,
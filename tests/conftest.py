@@ -12,6 +12,7 @@ from kugl.util import (
     clock,
     KPath,
     kube_context,
+    kube_contexts,
     kugl_home,
 )
 
@@ -34,6 +35,7 @@ def pytest_sessionstart(session):
 def test_home(tmp_path, monkeypatch):
     # Suppress memoization
     kube_context.cache_clear()
+    kube_contexts.cache_clear()
     # Put all the folders where we find config data under the temp folder.
     monkeypatch.setenv("KUGL_HOME", str(tmp_path / "home"))
     monkeypatch.setenv("KUGL_CACHE", str(tmp_path / "cache"))
@@ -14,19 +14,22 @@ from pydantic import Field, BaseModel, ConfigDict
 from kugl.util import to_utc, UNIT_TEST_TIMEBASE
 
 
-def kubectl_response(kind: str, output: Union[str, dict]):
+def kubectl_response(kind: str, output: Union[str, dict], context: Optional[str] = None):
     """
     Put a mock response for 'kubectl get {kind} ...' into the mock responses folder,
     to be found by an invocation of ./kubectl in a test.
     :param kind: e.g. "pods", "nodes, "jobs" etc
     :param output: A dict (will be JSON-serialized) or a string (will be trimmed)
+    :param context: the context named with 'kubectl --context', if any
     """
     if isinstance(output, dict):
         output = json.dumps(output)
     else:
         output = str(output).strip()
     folder = Path(os.getenv("KUGL_MOCKDIR"))
-    folder.mkdir(exist_ok=True)
+    if context is not None:
+        folder = folder / context
+    folder.mkdir(parents=True, exist_ok=True)
     folder.joinpath(kind).write_text(output)
 
 
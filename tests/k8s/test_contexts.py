@@ -0,0 +1,67 @@
+"""
+Tests for querying other and multiple Kubernetes contexts.
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from kugl.impl.config import Settings
+from kugl.impl.engine import Engine, CHECK
+from kugl.util import KuglError, Query, kube_home, kugl_cache
+from .k8s_mocks import kubectl_response, make_node
+
+
+@pytest.fixture
+def contexts(test_home):
+    kube_home().joinpath("config").write_text("""
+        current-context: east
+        contexts:
+          - name: east
+          - name: west
+          - name: test
+    """)
+    nodes = lambda *names: {"items": [make_node(name, labels={"a": "b"}) for name in names]}
+    kubectl_response("nodes", nodes("node-1", "node-2"), "east")
+    kubectl_response("nodes", nodes("node-3"), "west")
+
+
+def run_query(sql: str, **kwargs):
+    args = SimpleNamespace(all=False, namespace=None, **kwargs)
+    rows, _ = Engine(args, CHECK, Settings()).query(Query(sql))
+    return rows
+
+
+def test_one_context(contexts):
+    """Verify --context fetches from the named context, and caches separately from others."""
+    assert run_query("SELECT name FROM nodes", context="west") == [["node-3"]]
+    assert kugl_cache().joinpath("kubernetes/west/default.nodes.json").exists()
+    assert not kugl_cache().joinpath("kubernetes/east").exists()
+
+
+def test_several_contexts(contexts):
+    """Verify --contexts gives the union of the matching contexts, with a context column,
+    both when fetching and when using stored tables."""
+    sql = """
+        SELECT n.context, n.name, count(*) FROM nodes n
+        JOIN node_labels l ON l.node_uid = n.uid AND l.context = n.context
+        GROUP BY 1, 2 ORDER BY 1, 2
+    """
+    expected = [["east", "node-1", 1], ["east", "node-2", 1], ["west", "node-3", 1]]
+    for _ in range(2):
+        assert run_query(sql, contexts="e*,w*") == expected
+    # Without --contexts, there's no context column.
+    with pytest.raises(Exception, match="no such column: context"):
+        run_query("SELECT context FROM nodes")
+
+
+@pytest.mark.parametrize(
+    "kwargs,error",
+    [
+        (dict(contexts="north,south"), "No kubernetes contexts match north,south"),
+        (dict(context="east", contexts="west"), "Cannot use both --context and --contexts"),
+    ],
+)
+def test_context_errors(contexts, kwargs, error):
+    with pytest.raises(KuglError, match=error):
+        run_query("SELECT name FROM nodes", **kwargs)
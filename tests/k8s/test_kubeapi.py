@@ -0,0 +1,236 @@
+"""
+Tests for fetching from the API server with the native transport, using a stand-in server.
+"""
+
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Thread
+from types import SimpleNamespace
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import yaml
+
+from kugl.builtins import kubeapi
+from kugl.impl.config import Settings
+from kugl.impl.engine import Engine, ALWAYS_UPDATE
+from kugl.util import (
+    KuglError,
+    Query,
+    clock,
+    features_debugged,
+    kube_home,
+    kugl_cache,
+    to_utc,
+)
+from ..testing import assert_by_line
+from .k8s_mocks import make_pod
+
+
+class ApiServer(ThreadingHTTPServer):
+    """Serve canned list responses in pages, as the API server would, recording the requests."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        # Lists by API path
+        self.lists: dict[str, dict] = {}
+        # Request headers, and the client port each request arrived from
+        self.requests: list[tuple[dict, int]] = []
+        # If set, the Authorization headers accepted
+        self.authorized: Optional[set[str]] = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # For keep-alive
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server: ApiServer = self.server
+        server.requests.append((dict(self.headers), self.client_address[1]))
+        url = urlparse(self.path)
+        response = server.lists.get(url.path)
+        if server.authorized is not None and self.headers["Authorization"] not in server.authorized:
+            status, body = 401, {"kind": "Status", "message": "Unauthorized"}
+        elif response is None:
+            status, body = 404, {"kind": "Status", "message": f"{url.path} not found"}
+        else:
+            params = parse_qs(url.query)
+            start = int(params.get("continue", ["0"])[0])
+            end = start + int(params["limit"][0])
+            metadata = {"resourceVersion": "1"}
+            if end < len(response["items"]):
+                metadata["continue"] = str(end)
+            body = {**response, "metadata": metadata, "items": response["items"][start:end]}
+            if "as=PartialObjectMetadataList" in self.headers.get("Accept", ""):
+                body["kind"] = "PartialObjectMetadataList"
+                body["items"] = [
+                    {"kind": "PartialObjectMetadata", "metadata": item["metadata"]}
+                    for item in body["items"]
+                ]
+            status = 200
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api_server(test_home):
+    server = ApiServer()
+    Thread(target=server.serve_forever, daemon=True).start()
+    kube_home().joinpath("config").write_text(f"""
+        current-context: stand-in
+        contexts:
+          - name: stand-in
+            context: {{cluster: stand-in, user: me}}
+        clusters:
+          - name: stand-in
+            cluster: {{server: "{server.url}"}}
+        users:
+          - name: me
+            user: {{token: secret}}
+    """)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run_query(sql: str):
+    args = SimpleNamespace(all=True, namespace=None)
+    settings = Settings(kubernetes_transport="native")
+    rows, _ = Engine(args, ALWAYS_UPDATE, settings).query(Query(sql))
+    return rows
+
+
+def test_native_transport(api_server, capsys):
+    """Verify pages are fetched over one gzipped keep-alive connection, with the user's
+    credentials."""
+    template = json.dumps(make_pod("pod"))
+    pods = [json.loads(template.replace('"pod"', f'"pod-{i}"')) for i in range(1100)]
+    api_server.lists["/api/v1/pods"] = {"kind": "PodList", "apiVersion": "v1", "items": pods}
+    with features_debugged("fetch"):
+        assert run_query("SELECT count(*), min(status) FROM pods") == [[1100, "Running"]]
+    assert_by_line(
+        capsys.readouterr().err,
+        [
+            "fetch: requesting 127.0.0.1 GET /api/v1/pods?limit=500",
+            "fetch: requesting 127.0.0.1 GET /api/v1/pods?limit=500&continue=500",
+            "fetch: requesting 127.0.0.1 GET /api/v1/pods?limit=500&continue=1000",
+        ],
+    )
+    headers, port = api_server.requests[0]
+    assert headers["Authorization"] == "Bearer secret"
+    assert headers["Accept-Encoding"] == "gzip"
+    # The connection is kept, even for the next query.
+    assert run_query("SELECT count(*) FROM pods") == [[1100]]
+    assert {port for _, port in api_server.requests} == {port}
+
+
+def test_metadata_only(api_server):
+    """Verify only metadata is fetched for queries that need nothing else, and cached
+    separately from whole objects."""
+    pods = [make_pod("pod-1", labels=dict(app="web")), make_pod("pod-2", labels=dict(app="db"))]
+    api_server.lists["/api/v1/pods"] = {"kind": "PodList", "apiVersion": "v1", "items": pods}
+    sql = "SELECT p.name, l.value FROM pods p JOIN pod_labels l ON l.pod_uid = p.uid ORDER BY 1"
+    assert run_query(sql) == [["pod-1", "web"], ["pod-2", "db"]]
+    headers, _ = api_server.requests[-1]
+    assert "as=PartialObjectMetadataList" in headers["Accept"]
+    assert kugl_cache().joinpath("kubernetes/stand-in/__all.pods.meta.json").exists()
+    # Whole objects are needed for the phase.
+    assert run_query("SELECT name, phase FROM pods ORDER BY 1") == [
+        ["pod-1", "Running"],
+        ["pod-2", "Running"],
+    ]
+    headers, _ = api_server.requests[-1]
+    assert headers["Accept"] == "application/json"
+
+
+def test_native_transport_error(api_server):
+    with pytest.raises(KuglError, match="GET /api/v1/nodes.* failed: 404 /api/v1/nodes not found"):
+        run_query("SELECT name FROM nodes")
+
+
+def exec_plugin(folder, expires: int) -> str:
+    """Write an exec credential plugin that returns a new token and client certificate each
+    time it's run, and return the kubeconfig user that runs it."""
+    script = folder / "plugin.sh"
+    script.write_text(f"""#!/bin/sh
+        count=$(( $(cat {folder}/runs 2>/dev/null || echo 0) + 1 ))
+        echo $count > {folder}/runs
+        echo '{{"status": {{"token": "token-'$count'", "clientCertificateData": "cert-'$count'",' \\
+            '"clientKeyData": "key", "expirationTimestamp": "{to_utc(expires)}"}}}}'
+    """)
+    script.chmod(0o755)
+    return f"{{exec: {{command: {script}, apiVersion: client.authentication.k8s.io/v1}}}}"
+
+
+def test_exec_credential_retry(api_server, tmp_path):
+    """Verify a rejected exec credential is replaced, and the request retried once."""
+    user = exec_plugin(tmp_path, clock.CLOCK.now() + 3600)
+    kube_home().joinpath("config").write_text(f"""
+        current-context: stand-in
+        contexts:
+          - name: stand-in
+            context: {{cluster: stand-in, user: me}}
+        clusters:
+          - name: stand-in
+            cluster: {{server: "{api_server.url}"}}
+        users:
+          - name: me
+            user: {user}
+    """)
+    pods = [make_pod("pod-1")]
+    api_server.lists["/api/v1/pods"] = {"kind": "PodList", "apiVersion": "v1", "items": pods}
+    api_server.authorized = {"Bearer token-2"}
+    assert run_query("SELECT name FROM pods") == [["pod-1"]]
+    assert tmp_path.joinpath("runs").read_text().strip() == "2"
+    # Another rejection fails, rather than retrying indefinitely.
+    api_server.authorized = set()
+    with pytest.raises(KuglError, match="failed: 401 Unauthorized"):
+        run_query("SELECT name FROM pods")
+
+
+def test_exec_certificate_renewed(test_home, tmp_path, monkeypatch):
+    """Verify the SSL context, which holds an exec plugin's client certificate, is rebuilt
+    with a new certificate once the old one expires, and connections made with it dropped."""
+    now = clock.CLOCK.now()
+    user = exec_plugin(tmp_path, now + 60)
+    config = yaml.safe_load(f"""
+        contexts:
+          - name: secure
+            context: {{cluster: secure, user: me}}
+        clusters:
+          - name: secure
+            cluster: {{server: "https://127.0.0.1:1"}}
+        users:
+          - name: me
+            user: {user}
+    """)
+    monkeypatch.setattr(kubeapi.ApiClient, "_ssl_context", lambda self, cluster, cert, key: cert)
+    client = kubeapi.ApiClient(config, kube_home() / "config", "secure")
+    try:
+        assert client._tls() == "cert-1"
+        closed = []
+        client._idle.append(SimpleNamespace(close=lambda: closed.append(True)))
+        assert client._tls() == "cert-1"
+        assert closed == []
+        clock.CLOCK.set(now + 120)
+        assert client._tls() == "cert-2"
+        assert closed == [True] and client._idle == []
+    finally:
+        clock.CLOCK.set(now)
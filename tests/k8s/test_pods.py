@@ -3,12 +3,14 @@ Tests for the pods table.
 """
 
 import pytest
+import yaml
 
 from kugl.builtins.helpers import PodHelper
-from kugl.util import UNIT_TEST_TIMEBASE, features_debugged
+from kugl.impl import tables
+from kugl.util import UNIT_TEST_TIMEBASE, ItemStream, features_debugged, kugl_cache
 
 from ..testing import assert_query, assert_by_line
-from .k8s_mocks import kubectl_response, make_pod, Container, CGM, make_job
+from .k8s_mocks import kubectl_response, make_pod, Container, CGM, make_job, _static_content
 
 
 def test_missing_metadata():
@@ -33,12 +35,22 @@ def test_no_main_container():
     assert PodHelper(pod).main is None
 
 
+@pytest.mark.parametrize(
+    "case",
+    yaml.safe_load(_static_content("pod_statuses.yaml")),
+    ids=lambda case: case["status"],
+)
+def test_status(case):
+    """Verify the pod status matches what 'kubectl get pods' shows."""
+    assert PodHelper(case["pod"]).status == case["status"]
+
+
 def test_by_cpu(test_home, capsys):
     """
     Verify filtering by CPU.
     Verify debug output for fetching resources.
-    Verify debug output for extracting limits.
-    Verify fetching status.
+    Verify debug output for extracting requests; limits aren't extracted since the query
+    doesn't use them.
     """
     kubectl_response(
         "pods",
@@ -51,52 +63,31 @@ def test_by_cpu(test_home, capsys):
                     "pod-4",
                     containers=[Container(requests=CGM(cpu="2000m", mem="10M"))],
                 ),
-                # should get dropped because no status available
-                make_pod("pod-5", containers=[Container(requests=CGM(cpu=2, mem="10M"))]),
             ]
         },
     )
-    kubectl_response(
-        "pod_statuses",
-        """
-        NAME   STATUS
-        pod-1  Init:1
-        pod-2  Init:2
-        pod-3  Init:3
-        pod-4  Init:4
-    """,
-    )
     with features_debugged("extract,fetch"):
         assert_query(
             "SELECT name, status FROM pods WHERE cpu_req > 1 ORDER BY name",
             """
             name    status
-            pod-3   Init:3
-            pod-4   Init:4
+            pod-3   Running
+            pod-4   Running
         """,
         )
         out, err = capsys.readouterr()
         assert_by_line(
             err,
             """
-            fetch: running kubectl get pods -n default
-            fetch: running kubectl get pods -n default -o json
-            extract: get requests / limits from {'cpu': 1, 'memory': '10M'}
-            extract: got cpu=1 gpu=None mem=10000000
-            extract: get requests / limits from {'cpu': 1, 'memory': '10M'}
-            extract: got cpu=1 gpu=None mem=10000000
+            fetch: running kubectl get --raw /api/v1/namespaces/default/pods?limit=500
             extract: get requests / limits from {'cpu': 1, 'memory': '10M'}
             extract: got cpu=1 gpu=None mem=10000000
             extract: get requests / limits from {'cpu': 1, 'memory': '10M'}
             extract: got cpu=1 gpu=None mem=10000000
             extract: get requests / limits from {'cpu': 2, 'memory': '10M'}
             extract: got cpu=2 gpu=None mem=10000000
-            extract: get requests / limits from {'cpu': 1, 'memory': '10M'}
-            extract: got cpu=1 gpu=None mem=10000000
             extract: get requests / limits from {'cpu': '2000m', 'memory': '10M'}
             extract: got cpu=2.0 gpu=None mem=10000000
-            extract: get requests / limits from {'cpu': 1, 'memory': '10M'}
-            extract: got cpu=1 gpu=None mem=10000000
         """,
         )
 
@@ -107,7 +98,6 @@ def test_other_pod_fields(test_home, capsys):
     Verify extraction of node name and main container command.
     Verify extraction of creation and deletion timestamps.
     Verify debug output for fetching resources.
-    Verify fetching status.
     """
     kubectl_response(
         "pods",
@@ -124,16 +114,6 @@ def test_other_pod_fields(test_home, capsys):
             ]
         },
     )
-    kubectl_response(
-        "pod_statuses",
-        """
-        NAMESPACE  NAME   STATUS
-        xyz        pod-1  Pending
-        default    pod-2  Running
-        default    pod-3  Terminating
-        default    pod-4  Terminating
-    """,
-    )
     with features_debugged("fetch"):
         assert_query(
             """
@@ -153,8 +133,60 @@ def test_other_pod_fields(test_home, capsys):
     assert_by_line(
         err,
         """
-        fetch: running kubectl get pods --all-namespaces
-        fetch: running kubectl get pods --all-namespaces -o json
+        fetch: running kubectl get --raw /api/v1/pods?limit=500
+    """,
+    )
+
+
+def test_selectors(test_home, capsys):
+    """Verify query conditions are passed to kubectl as selectors, that a condition on the
+    namespace becomes -n, and that selective fetches are cached separately.  The mock kubectl
+    ignores selectors, so the results are the same as they would be without them."""
+    kubectl_response(
+        "pods",
+        {
+            "items": [
+                make_pod("pod-1", namespace="xyz", labels=dict(app="web")),
+                make_pod("pod-2", namespace="xyz", labels=dict(app="db")),
+                make_pod("pod-3", namespace="xyz", labels=dict(app="web"), phase="Pending"),
+            ]
+        },
+    )
+    with features_debugged("fetch"):
+        assert_query(
+            """
+            SELECT p.name, p.status FROM pods p JOIN pod_labels l ON l.pod_uid = p.uid
+            WHERE p.namespace = 'xyz' AND p.phase = 'Running' AND l.key = 'app' AND l.value = 'web'
+        """,
+            [["pod-1", "Running"]],
+            all_ns=True,
+        )
+    out, err = capsys.readouterr()
+    params = "limit=500&labelSelector=app%3Dweb&fieldSelector=status.phase%3DRunning"
+    assert_by_line(
+        err,
+        f"""
+        fetch: running kubectl get --raw /api/v1/namespaces/xyz/pods?{params}
+    """,
+    )
+    cached = list((kugl_cache() / "kubernetes/nocontext").glob("*.pods.*.json"))
+    assert [path.name.startswith("xyz.pods.") for path in cached] == [True]
+
+    # No selectors if the conditions don't apply to every pod used.
+    with features_debugged("fetch"):
+        assert_query(
+            """
+            SELECT count(*) FROM pods p, pod_labels l
+            WHERE p.phase = 'Running' AND l.key = 'app' AND l.value = 'web'
+        """,
+            [[4]],
+            all_ns=True,
+        )
+    out, err = capsys.readouterr()
+    assert_by_line(
+        err,
+        """
+        fetch: running kubectl get --raw /api/v1/pods?limit=500
     """,
     )
 
@@ -205,7 +237,6 @@ def test_resource_summing(test_home, containers, expected):
     """Verify extraction of requests / limits per comments above in test parameters."""
     pod = make_pod("pod-1", containers=containers)
     kubectl_response("pods", {"items": [pod]})
-    kubectl_response("pod_statuses", "NAME    STATUS\npod-1  Running")
     assert_query(
         "SELECT cpu_req, cpu_lim, mem_req, mem_lim, gpu_req, gpu_lim FROM pods",
         expected,
@@ -231,16 +262,6 @@ def test_pod_labels(test_home):
             ]
         },
     )
-    kubectl_response(
-        "pod_statuses",
-        """
-        NAME   STATUS
-        pod-1  Init:1
-        pod-2  Init:2
-        pod-3  Init:3
-        pod-4  Init:4
-    """,
-    )
     assert_query(
         "SELECT pod_uid, key, value FROM pod_labels ORDER BY 2, 1",
         """
@@ -253,3 +274,21 @@ def test_pod_labels(test_home):
         uid-pod-4  three  four
     """,
     )
+
+
+def test_pods_and_labels_in_one_pass(test_home, monkeypatch):
+    """Verify tables sharing a resource are built in one pass over its items, with rows
+    inserted in batches."""
+    kubectl_response(
+        "pods",
+        {"items": [make_pod(f"pod-{i}", labels=dict(a=str(i), b="x")) for i in range(5)]},
+    )
+    monkeypatch.setattr(tables, "BATCH_SIZE", 2)
+    passes = []
+    iter_items = ItemStream.iter_items
+    monkeypatch.setattr(ItemStream, "iter_items", lambda self: passes.append(1) or iter_items(self))
+    assert_query(
+        "SELECT p.name, count(*) FROM pods p JOIN pod_labels l ON l.pod_uid = p.uid GROUP BY 1",
+        [[f"pod-{i}", 2] for i in range(5)],
+    )
+    assert len(passes) == 1
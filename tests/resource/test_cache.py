@@ -2,12 +2,19 @@
 Tests for data cache timeout behavior.
 """
 
+import asyncio
+import json
 import re
+from threading import Thread
+import time
 from types import SimpleNamespace
 
 from kugl.builtins.schemas.kubernetes import KubernetesResource
-from kugl.impl.engine import DataCache, CHECK, NEVER_UPDATE, ALWAYS_UPDATE, ResourceRef
-from kugl.util import Age, features_debugged
+from kugl.impl.config import Settings
+from kugl.impl.engine import DataCache, CHECK, NEVER_UPDATE, ALWAYS_UPDATE, ResourceRef, Engine
+from kugl.main import main1
+from kugl.util import Age, features_debugged, ItemStream, KPath, kugl_cache, kugl_home, Query
+from ..k8s.k8s_mocks import kubectl_response, make_node, make_pod
 from ..testing import assert_by_line
 
 
@@ -86,3 +93,163 @@ def test_cache(test_home, capsys):
         assert max_age is None
         out, err = capsys.readouterr()
         assert err == ""
+
+
+def test_streamed_cache_file(test_home):
+    """Verify kubectl output is cached in the form written by ItemStream, and that cache files
+    written by older versions as plain JSON are still readable."""
+
+    def names(flag):
+        args = SimpleNamespace(all=False, namespace=None)
+        rows, _ = Engine(args, flag, Settings()).query(Query("SELECT name FROM nodes ORDER BY 1"))
+        return [row[0] for row in rows]
+
+    kubectl_response("nodes", {"apiVersion": "v1", "items": [make_node("node-1")], "kind": "List"})
+    assert names(ALWAYS_UPDATE) == ["node-1"]
+    path = kugl_cache() / "kubernetes/nocontext/default.nodes.json"
+    assert path.read_text().startswith(ItemStream.PREFIX)
+    assert json.loads(path.read_text())["kind"] == "List"
+
+    path.write_text(json.dumps({"apiVersion": "v1", "items": [make_node("node-2")]}))
+    assert names(CHECK) == ["node-2"]
+
+
+def test_binary_cache_file(test_home, capsys):
+    """Verify the binary cache format is written if configured, that JSON cache files are still
+    read, and that binary files in an unknown format are replaced."""
+
+    def names(flag):
+        args = SimpleNamespace(all=False, namespace=None)
+        engine = Engine(args, flag, Settings(cache_format="binary"))
+        rows, _ = engine.query(Query("SELECT name FROM nodes ORDER BY 1"))
+        return [row[0] for row in rows]
+
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    assert names(ALWAYS_UPDATE) == ["node-1"]
+    path = kugl_cache() / "kubernetes/nocontext/default.nodes.json"
+    assert ItemStream.file_format(path) == "binary"
+    assert ItemStream.from_file(path, binary=True).to_dict()["kind"] == "List"
+
+    path.write_text(json.dumps({"apiVersion": "v1", "items": [make_node("node-2")]}))
+    assert names(CHECK) == ["node-2"]
+
+    # Unreadable files are treated as missing.
+    path.write_bytes(b'KUGL\x00{"format": 0}\n')
+    with features_debugged("cache"):
+        assert names(CHECK) == ["node-1"]
+    assert "cache: unreadable cache file" in capsys.readouterr().err
+    assert ItemStream.file_format(path) == "binary"
+
+
+def test_single_flight(test_home, capsys):
+    """Verify a query waits while another process fetches the same resource, then uses the
+    data the other process fetched rather than fetching it again."""
+    cache = DataCache(kugl_cache(), Age("1m"))
+    resource = KubernetesResource(name="nodes", namespaced=False)
+    nodes = ResourceRef(SimpleNamespace(name="kubernetes"), resource)
+    nodes.resource.handle_cli_options(SimpleNamespace(namespace=None, all=False))
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    result = []
+
+    def query():
+        args = SimpleNamespace(all=False, namespace=None)
+        rows, _ = Engine(args, ALWAYS_UPDATE, Settings()).query(Query("SELECT name FROM nodes"))
+        result.extend(rows)
+
+    async def other_process():
+        # Pretend another process fetches and caches the data while the query waits
+        async with cache.lock_async(nodes):
+            thread.start()
+            await asyncio.sleep(0.5)
+            other = ItemStream(iter([make_node("node-2")]), {})
+            cache.dump(nodes, other)
+
+    thread = Thread(target=query)
+    with features_debugged("cache"):
+        asyncio.run(other_process())
+        thread.join()
+    assert result == [["node-2"]]
+    assert "using kubernetes.nodes as just fetched by another process" in capsys.readouterr().err
+    assert [p.name for p in cache.cache_path(nodes).parent.glob("*.tmp")] == []
+
+
+def test_cache_policy(test_home, capsys):
+    """Verify per-resource cache timeouts from config files, and refreshing named resources."""
+    kugl_home().prep().joinpath("kubernetes.yaml").write_text("""
+        cache:
+          nodes: 1h
+    """)
+    kubectl_response("pods", {"items": [make_pod("pod-1")]})
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    sql = "SELECT (SELECT count(*) FROM pods), (SELECT count(*) FROM nodes)"
+
+    def refreshed(flag, cache_timeouts=None, update=None):
+        args = SimpleNamespace(all=False, namespace=None, update=update)
+        engine = Engine(args, flag, Settings(reckless=True), cache_timeouts)
+        with features_debugged("cache"):
+            engine.query(Query(sql))
+        err = capsys.readouterr().err
+        return re.search(r"cache: refreshable \[(.*)\]", err).group(1)
+
+    args = SimpleNamespace(all=False, namespace=None)
+    Engine(args, ALWAYS_UPDATE, Settings()).query(Query(sql))
+    for path in kugl_cache().glob("kubernetes/nocontext/*.json"):
+        KPath(path).set_age(Age("5m"))
+    # Pods use the default timeout of two minutes, nodes the schema's timeout of one hour.
+    assert refreshed(CHECK) == "kubernetes.pods"
+    # The user init file overrides the schema.
+    assert refreshed(CHECK, {"kubernetes.pods": Age("1h"), "kubernetes.nodes": Age("1m")}) == (
+        "kubernetes.nodes"
+    )
+    # As from -u nodes
+    assert refreshed(NEVER_UPDATE, update=["kubernetes.nodes"]) == "kubernetes.nodes"
+
+
+def test_stale_while_revalidate(test_home, capsys):
+    """Verify data that expired within the grace period is used, and refreshed by a background
+    process for the next query."""
+    kugl_home().prep().joinpath("init.yaml").write_text("""
+        settings:
+          cache_grace: 10m
+    """)
+    path = kugl_cache() / "kubernetes/nocontext/default.nodes.json"
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    main1(["-u", "select name from nodes"])
+    path.set_age(Age("5m"))
+    mtime = path.stat().st_mtime
+
+    kubectl_response("nodes", {"items": [make_node("node-2")]})
+    capsys.readouterr()
+    with features_debugged("cache"):
+        main1(["select name from nodes"])
+    out, err = capsys.readouterr()
+    assert "node-1" in out
+    assert "(Data may be up to 300 seconds old.)" in err
+    assert "cache: refreshing in the background kubernetes.nodes" in err
+
+    deadline = time.time() + 10
+    while path.stat().st_mtime == mtime:
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.05)
+    main1(["-c", "select name from nodes"])
+    assert "node-2" in capsys.readouterr().out
+
+
+def test_revalidate_fetches_only(test_home, capsys):
+    """Verify the background refresh fetches just the named resources, without running the
+    query."""
+    query = "select n.name, p.name from nodes n, pods p"
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    kubectl_response("pods", {"items": [make_pod("pod-1")]})
+    main1(["-u", query])
+    pods_path = kugl_cache() / "kubernetes/nocontext/default.pods.json"
+    pods_mtime = pods_path.stat().st_mtime
+
+    kubectl_response("nodes", {"items": [make_node("node-2")]})
+    kubectl_response("pods", {"items": [make_pod("pod-2")]})
+    capsys.readouterr()
+    main1([query, "--revalidate", "-u", "nodes"])
+    assert capsys.readouterr().out == ""
+    assert pods_path.stat().st_mtime == pods_mtime
+    main1(["-c", "-H", query])
+    assert capsys.readouterr().out.split() == ["node-2", "pod-1"]
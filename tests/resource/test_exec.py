@@ -3,6 +3,7 @@ Unit tests for the 'exec' resource type
 """
 
 import json
+import time
 
 import pytest
 
@@ -65,3 +66,14 @@ def test_exec_cacheable(hr, monkeypatch):
     # Verify the cache data was written
     cache_path = kugl_cache() / "hr/abc/xyz/people.exec.json"
     assert cache_path.read_text() == people_data
+
+
+def test_exec_timeout(hr):
+    """Verify an exec resource is stopped after its fetch timeout."""
+    config = hr.config()
+    config["resources"][0] = dict(name="people", exec="sleep 10", fetch_timeout="1s")
+    hr.save(config)
+    start = time.time()
+    with pytest.raises(KuglError, match="timed out fetching resource hr.people after 1s"):
+        assert_query(hr.PEOPLE_QUERY, None)
+    assert time.time() - start < 5
@@ -63,3 +63,52 @@ def test_data_dict_expansion(test_home):
         foo    bar
     """,
     )
+
+
+def test_nested_parents(test_home):
+    """Verify ^ references at several levels of a row_source, where sibling rows share
+    ancestors."""
+    kugl_home().prep().joinpath("kubernetes.yaml").write_text("""
+      resources:
+        - name: things
+          data:
+            groups:
+              - name: g1
+                metadata: {labels: {site: east}}
+                teams:
+                  - name: t1
+                    members: [{name: ann}, {name: bob}]
+                  - name: t2
+                    metadata: {labels: {site: west}}
+                    members: [{name: cal}]
+              - name: g2
+                teams:
+                  - name: t3
+                    members: [{name: dee}]
+      create:
+        - table: things
+          resource: things
+          row_source:
+            - groups
+            - teams
+            - members
+          columns:
+            - name: member
+              path: name
+            - name: team
+              path: ^name
+            - name: grp
+              path: ^^name
+            - name: site
+              label: [^site, ^site]
+    """)
+    assert_query(
+        "SELECT * FROM things ORDER BY member",
+        """
+        member    team    grp    site
+        ann       t1      g1     east
+        bob       t1      g1     east
+        cal       t2      g1     west
+        dee       t3      g2
+    """,
+    )
@@ -0,0 +1,133 @@
+"""
+Tests for reuse of built tables from the table store.
+"""
+
+import os
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from kugl.impl.config import Settings
+from kugl.impl.engine import Engine, CHECK, ALWAYS_UPDATE
+from kugl.util import Query, features_debugged, kugl_cache, kugl_home
+from ..k8s.k8s_mocks import kubectl_response, make_node
+
+
+def run_query(sql: str, flag=CHECK):
+    args = SimpleNamespace(all=False, namespace=None)
+    rows, _ = Engine(args, flag, Settings()).query(Query(sql))
+    return rows
+
+
+def corrupt_cache(path):
+    """Make a cache file unreadable without changing its modification time, so we can tell
+    whether the data was loaded."""
+    stat = path.stat()
+    path.write_text("not json")
+    os.utime(path, (stat.st_atime, stat.st_mtime))
+
+
+def test_reuse_stored_table(test_home, capsys):
+    """Verify a table built from unchanged cache data is reused without loading the data."""
+    kubectl_response("nodes", {"items": [make_node("node-1"), make_node("node-2")]})
+    assert run_query("SELECT name FROM nodes ORDER BY 1") == [["node-1"], ["node-2"]]
+    assert (kugl_cache() / "tables.db").exists()
+
+    # Different kubectl output won't be seen, and the cache file won't be read.
+    kubectl_response("nodes", {"items": [make_node("node-3")]})
+    corrupt_cache(kugl_cache() / "kubernetes/nocontext/default.nodes.json")
+    with features_debugged("cache"):
+        assert run_query("SELECT name FROM nodes ORDER BY 1") == [["node-1"], ["node-2"]]
+    _, err = capsys.readouterr()
+    assert "cache: reusing stored table for kubernetes.nodes" in err
+
+    # A forced update replaces the cache file, and so the stored table.
+    assert run_query("SELECT name FROM nodes", ALWAYS_UPDATE) == [["node-3"]]
+    assert run_query("SELECT name FROM nodes") == [["node-3"]]
+
+
+def test_rebuild_on_definition_change(test_home):
+    """Verify a stored table is rebuilt when the table definition changes."""
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    assert run_query("SELECT name FROM nodes") == [["node-1"]]
+    kugl_home().prep().joinpath("kubernetes.yaml").write_text("""
+      extend:
+        - table: nodes
+          columns:
+            - name: kind
+              path: kind
+    """)
+    assert run_query("SELECT name, kind FROM nodes") == [["node-1", "Node"]]
+
+
+def test_reuse_stored_table_multi_schema(test_home):
+    """Verify stored tables are also usable when the query names schemas explicitly."""
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    sql = "SELECT n.name, t.key FROM kubernetes.nodes n LEFT JOIN kubernetes.node_labels t"
+    sql += " ON t.node_uid = n.uid WHERE t.key LIKE 'beta.%' ORDER BY 2"
+    expected = [
+        ["node-1", "beta.kubernetes.io/arch"],
+        ["node-1", "beta.kubernetes.io/os"],
+    ]
+    assert run_query(sql) == expected
+    corrupt_cache(kugl_cache() / "kubernetes/nocontext/default.nodes.json")
+    assert run_query(sql) == expected
+
+
+def test_unused_columns_not_extracted(test_home):
+    """Verify columns a query doesn't use aren't extracted, by adding a column that would fail."""
+    kugl_home().prep().joinpath("kubernetes.yaml").write_text("""
+      extend:
+        - table: nodes
+          columns:
+            - name: bad
+              type: integer
+              path: metadata.name
+    """)
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    assert run_query("SELECT name FROM nodes") == [["node-1"]]
+    with pytest.raises(ValueError, match="invalid literal for int"):
+        run_query("SELECT name, bad FROM nodes")
+
+
+def test_stored_columns_accumulate(test_home, capsys):
+    """Verify a stored table missing a needed column is rebuilt with the union of columns."""
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    assert run_query("SELECT name FROM nodes") == [["node-1"]]
+    with features_debugged("cache"):
+        assert run_query("SELECT name, cpu_cap FROM nodes") == [["node-1", 96]]
+    _, err = capsys.readouterr()
+    assert "cache: no valid stored table for kubernetes.nodes" in err
+    corrupt_cache(kugl_cache() / "kubernetes/nocontext/default.nodes.json")
+    assert run_query("SELECT name FROM nodes") == [["node-1"]]
+    assert run_query("SELECT cpu_cap FROM nodes") == [[96]]
+
+
+def test_stored_indexes(test_home, capsys):
+    """Verify columns used in joins and filters are indexed in the store, once, with statistics
+    for SQLite's query planner, and the query uses the indexes."""
+    kubectl_response(
+        "nodes", {"items": [make_node("node-1", labels=dict(a="b")), make_node("node-2")]}
+    )
+    sql = """
+        SELECT n.name FROM nodes n JOIN node_labels l ON l.node_uid = n.uid
+        WHERE l.key = 'a'
+    """
+    assert run_query(sql) == [["node-1"]]
+    db = sqlite3.connect(kugl_cache() / "tables.db")
+    indexes = db.execute("SELECT name FROM sqlite_master WHERE name LIKE 't^_%' ESCAPE '^'")
+    assert sorted(name.split("__")[1] for (name,) in indexes if "__" in name) == [
+        "key",
+        "node_uid",
+        "uid",
+    ]
+    assert db.execute("SELECT count(*) FROM sqlite_stat1").fetchone()[0] > 0
+    names = dict(db.execute("SELECT table_name, store_name FROM tables"))
+    stored_sql = sql.replace("nodes", names["nodes"]).replace("node_labels", names["node_labels"])
+    plan = " ".join(row[-1] for row in db.execute(f"EXPLAIN QUERY PLAN {stored_sql}"))
+    assert "USING INDEX" in plan and "AUTOMATIC" not in plan
+    # The indexes are reused.
+    with features_debugged("sqlite"):
+        assert run_query(sql) == [["node-1"]]
+    assert "CREATE INDEX" not in capsys.readouterr().err
@@ -105,6 +105,25 @@ def test_parse_args(test_home, argv, expected_flag, age, reckless, error):
         assert settings.reckless == reckless
 
 
+@pytest.mark.parametrize(
+    "argv,expected_flag,update,sql",
+    [
+        (["-u", "select 1"], ALWAYS_UPDATE, [], "select 1"),
+        (["-u", "-r", "select 1"], ALWAYS_UPDATE, [], "select 1"),
+        (["-u", "pods", "select 1"], CHECK, ["kubernetes.pods"], "select 1"),
+        (["-u", "pods,my.things", "sql"], CHECK, ["kubernetes.pods", "my.things"], "sql"),
+        (["-c", "-u", "pods", "select 1"], NEVER_UPDATE, ["kubernetes.pods"], "select 1"),
+        (["select 1"], CHECK, [], "select 1"),
+    ],
+)
+def test_parse_update(test_home, argv, expected_flag, update, sql):
+    """Verify -u with and without a list of resources"""
+    args, actual_flag = parse_args(argv, ArgumentParser(), Settings())
+    assert actual_flag == expected_flag
+    assert args.update == update
+    assert args.sql == sql
+
+
 def test_init_command(test_home, capsys):
     """Verify 'kugl init' creates ~/.kugl/kubernetes.yaml with recommended config"""
     kubernetes_yaml = kugl_home() / "kubernetes.yaml"
@@ -76,3 +76,47 @@ def test_non_sql_types(test_home, capsys):
             extract: got 1640995199
         """,
         )
+
+
+def test_paged_fetch(test_home, capsys):
+    """Verify a resource with a known API version is fetched in pages, and its items are given
+    the kind and apiVersion fields that 'kubectl get -o json' would add."""
+    kugl_home().prep().joinpath("kubernetes.yaml").write_text("""
+      resources:
+        - name: things
+          namespaced: false
+          api: example.com/v1
+          chunk_size: 2
+      create:
+        - table: things
+          resource: things
+          columns:
+            - name: name
+              path: name
+            - name: kind
+              path: kind
+            - name: api_version
+              path: apiVersion
+    """)
+    kubectl_response("things", {"items": [{"name": f"thing-{i}"} for i in range(5)]})
+    with features_debugged("fetch"):
+        assert_query(
+            "SELECT name, kind, api_version FROM things ORDER BY 1",
+            """
+            name     kind    api_version
+            thing-0  Thing   v1
+            thing-1  Thing   v1
+            thing-2  Thing   v1
+            thing-3  Thing   v1
+            thing-4  Thing   v1
+        """,
+        )
+    out, err = capsys.readouterr()
+    assert_by_line(
+        err,
+        """
+        fetch: running kubectl get --raw /apis/example.com/v1/things?limit=2
+        fetch: running kubectl get --raw /apis/example.com/v1/things?limit=2&continue=2
+        fetch: running kubectl get --raw /apis/example.com/v1/things?limit=2&continue=4
+    """,
+    )
@@ -0,0 +1,101 @@
+"""
+Tests for the fetch scheduler.
+"""
+
+import asyncio
+from collections import Counter
+from functools import partial
+import os
+from pathlib import Path
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from kugl.impl.config import Settings
+from kugl.impl.engine import Engine, ALWAYS_UPDATE
+from kugl.impl.fetch import FetchScheduler
+from kugl.util import Age, KuglError, Query, kugl_home, run_async
+
+
+def test_fetch_limits():
+    """Verify the overall and per-context limits on concurrent fetches."""
+    running, peak = Counter(), Counter()
+
+    async def fetch(context, result):
+        for key in ["all", context]:
+            running[key] += 1
+            peak[key] = max(peak[key], running[key])
+        await asyncio.sleep(0.02)
+        for key in ["all", context]:
+            running[key] -= 1
+        return result
+
+    with FetchScheduler(3, 2) as scheduler:
+        futures = [
+            scheduler.submit(f"r{i}", partial(fetch, "ab"[i % 2], i), "ab"[i % 2])
+            for i in range(10)
+        ]
+        assert [scheduler.result(f) for f in futures] == list(range(10))
+    assert peak == {"all": 3, "a": 2, "b": 2}
+
+
+def test_fetch_failure():
+    """Verify a failed fetch cancels the others, and is reported for all of them."""
+
+    async def slow():
+        await run_async(["sleep", "10"])
+
+    async def broken():
+        raise KuglError("oops")
+
+    start = time.time()
+    with FetchScheduler(4, 4) as scheduler:
+        slow_future = scheduler.submit("slow", slow)
+        scheduler.submit("broken", broken)
+        with pytest.raises(KuglError, match="oops"):
+            scheduler.result(slow_future)
+    assert time.time() - start < 5
+
+
+def test_fetch_timeout():
+    with FetchScheduler(4, 4) as scheduler:
+        future = scheduler.submit("slow", partial(asyncio.sleep, 10), timeout=Age("1s"))
+        with pytest.raises(KuglError, match="timed out fetching resource slow after 1s"):
+            scheduler.result(future)
+
+
+@pytest.mark.parametrize("table", ["pods", "things"])
+def test_kubectl_killed_on_timeout(test_home, table):
+    """Verify kubectl, which runs in a worker thread, is killed when its fetch times out, whether
+    the list is fetched in pages (pods) or whole (things), rather than left to hold up Kugl's
+    exit."""
+    kugl_home().prep().joinpath("kubernetes.yaml").write_text("""
+      resources:
+        - name: things
+          namespaced: true
+      create:
+        - table: things
+          resource: things
+          columns:
+            - name: name
+              path: metadata.name
+    """)
+    hang = Path(os.getenv("KUGL_MOCKDIR")).joinpath("hang")
+    hang.parent.mkdir(parents=True, exist_ok=True)
+    hang.write_text("")
+    args = SimpleNamespace(all=True, namespace=None)
+    engine = Engine(args, ALWAYS_UPDATE, Settings(fetch_timeout="1s"))
+    start = time.time()
+    with pytest.raises(KuglError, match=f"timed out fetching resource kubernetes.{table} after 1s"):
+        engine.query(Query(f"SELECT name FROM {table}"))
+    while not (pid := hang.read_text()):
+        time.sleep(0.1)
+    # The process is gone, not just abandoned.
+    while time.time() - start < 5:
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return
+        time.sleep(0.1)
+    pytest.fail(f"kubectl process {pid} is still running")
@@ -11,7 +11,15 @@ from kugl.util.clock import RealClock, Clock
 
 from kugl.builtins.helpers import Limits, Containerized
 from kugl.main import main1
-from kugl.util import KuglError, kube_home, kugl_home, features_debugged, debugging, run
+from kugl.util import (
+    KuglError,
+    kube_home,
+    kugl_home,
+    features_debugged,
+    debugging,
+    run,
+    run_streaming,
+)
 
 
 def test_limits_misc(capsys):
@@ -27,6 +35,19 @@ def test_limits_misc(capsys):
     assert Limits(1, 2, 10) + Limits(2, 3, 100) == Limits(3, 5, 110)
 
 
+def test_limits_total():
+    """Verify batch totals match the sum of Limits extracted one at a time."""
+    objs = [
+        dict(cpu="500m", memory="1Gi"),
+        None,
+        {"cpu": 2, "nvidia.com/gpu": "1", "memory": "512Mi"},
+        dict(cpu="500m"),
+    ]
+    assert Limits.total(objs) == sum(Limits.extract(obj) for obj in objs)
+    assert Limits.total(objs) == Limits(3.0, 1.0, 2**30 + 2**29)
+    assert Limits.total([None, {}]) == Limits(None, None, None)
+
+
 def test_kube_home_missing(test_home):
     shutil.rmtree(str(kube_home()))
     with pytest.raises(KuglError, match="can't determine current context"):
@@ -92,6 +113,17 @@ def test_run_nonzero_returncode(capsys):
     assert (out, err) == ("", "failed to run [bash -c echo foo >&2; false]:\nfoo\n")
 
 
+def test_run_streaming(capsys):
+    with run_streaming(["bash", "-c", "echo hello; echo world"]) as out:
+        assert out.readline() == "hello\n"
+    with pytest.raises(SystemExit):
+        with run_streaming(["bash", "-c", "echo foo; echo bar >&2; false"]) as out:
+            # The failure is reported even if reading the output fails.
+            raise ValueError("bad output")
+    out, err = capsys.readouterr()
+    assert (out, err) == ("", "failed to run [bash -c echo foo; echo bar >&2; false]:\nbar\n")
+
+
 def test_real_clock():
     """For 100% coverage"""
     import time
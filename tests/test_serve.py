@@ -0,0 +1,110 @@
+"""
+Tests for 'kugl serve' and its client.
+"""
+
+import json
+import sys
+from threading import Thread
+
+import pytest
+
+from kugl.client import is_serving, send, socket_path
+from kugl.main import serve_query
+from kugl.serve import QueryServer
+from kugl.util import KuglError, kugl_home
+from .k8s.k8s_mocks import kubectl_response, make_node
+
+
+@pytest.fixture
+def server(test_home):
+    streams = sys.stdout, sys.stderr
+    server = QueryServer(socket_path(), serve_query)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    # The streams are replaced only while serving.
+    assert (sys.stdout, sys.stderr) == streams
+
+
+def test_serve_queries(server):
+    """Verify queries are answered, and configuration changes are seen by later queries."""
+    assert is_serving()
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    response = send(["-H", "select name from nodes"])
+    assert response == {"status": 0, "stdout": "node-1\n", "stderr": ""}
+
+    kugl_home().prep().joinpath("init.yaml").write_text("""
+        shortcuts:
+          - name: names
+            args:
+              - "select name from nodes"
+    """)
+    kubectl_response("nodes", {"items": [make_node("node-1"), make_node("node-2")]})
+    response = send(["-u", "names"])
+    assert response["stdout"].split() == ["name", "node-1", "node-2"]
+
+
+def test_serve_errors(server):
+    """Verify errors are reported as kugl would report them, and don't stop the server."""
+    response = send(["select * from foo"])
+    assert response == {"status": 1, "stdout": "", "stderr": "no such table: foo\n"}
+    response = send(["-c", "-u", "select 1"])
+    assert response["stderr"] == "Cannot use both -c/--cache and -u/--update\n"
+    response = send(["--badoption", "select 1"])
+    assert response["status"] == 2
+    assert "unrecognized arguments: --badoption" in response["stderr"]
+    assert send(["-H", "select 1"])["stdout"] == "1\n"
+
+
+def test_serve_debug_not_sticky(server):
+    """Verify debug options apply only to the query that used them."""
+    assert "sqlite:" in send(["--debug", "sqlite", "select 1"])["stderr"]
+    assert send(["select 1"])["stderr"] == ""
+
+
+def test_serve_concurrently(server, hr, test_home):
+    """Verify a query waiting on a slow resource doesn't hold up others, and that each query
+    gets only its own output and debug flags."""
+    config = hr.config()
+    go = test_home / "go"
+    data = json.dumps(config["resources"][0]["data"])
+    command = f"while [ ! -f {go} ]; do sleep 0.1; done; echo '{data}'"
+    config["resources"][0] = dict(name="people", exec=command)
+    hr.save(config)
+    responses = []
+    slow = Thread(
+        target=lambda: responses.append(send(["--debug", "sqlite", hr.PEOPLE_QUERY])),
+        daemon=True,
+    )
+    slow.start()
+    try:
+        assert send(["-H", "select 1"]) == {"status": 0, "stdout": "1\n", "stderr": ""}
+        assert slow.is_alive()
+    finally:
+        # Let the slow query finish, even if the test fails.
+        go.touch()
+    slow.join(timeout=10)
+    assert not slow.is_alive()
+    response = responses[0]
+    assert response["status"] == 0
+    assert response["stdout"].split() == ["name", "age", "Jim", "42", "Jill", "43"]
+    assert "sqlite:" in response["stderr"]
+
+
+def test_one_server_only(server, test_home):
+    """Verify a second server can't take over the socket, but a stale socket is replaced."""
+    with pytest.raises(KuglError, match="kugl is already serving"):
+        QueryServer(socket_path(), serve_query)
+    other_path = test_home / "other.sock"
+    other_path.touch()
+    streams = sys.stdout, sys.stderr
+    other = QueryServer(other_path, serve_query)
+    assert is_serving(other_path)
+    other.server_close()
+    # A server that never served leaves the streams alone.
+    assert (sys.stdout, sys.stderr) == streams
+    assert not other_path.exists()
+    assert send(["select 1"], other_path) is None
@@ -1,8 +1,13 @@
+import sqlite3
 from typing import Optional
 
 import pytest
 
+import kugl.builtins.schemas.kubernetes  # noqa: F401
+from kugl.impl.planner import QueryPlanner
+from kugl.impl.registry import Registry
 from kugl.util import KuglError, SqliteDb, Query
+from kugl.util.sqlparse import ColumnRef as C, Equality as Eq
 from tests.testing import assert_query
 
 
@@ -13,6 +18,7 @@ from tests.testing import assert_query
         ("""select 1""", [], None),
         ("""select xyz from pods""", ["pods"], None),
         ("""select xyz from pods left outer join nodes""", ["pods", "nodes"], None),
+        ("""select xyz from (select xyz from pods)""", ["pods"], None),
         (
             """select xyz from my.pods a join his.nodes b""",
             ["my.pods", "his.nodes"],
@@ -30,6 +36,61 @@ def test_schema_extraction(sql, refs: list[str], error: Optional[str]):
         assert set(refs) == set(str(nt) for nt in q.named_tables)
 
 
+@pytest.mark.parametrize(
+    "sql,aliases,equalities",
+    [
+        (
+            "select p.name from pods as p join pod_labels l on l.pod_uid = p.uid "
+            "where \"key\" = 'app' and l.value == 'it''s' and 'ml' = p.namespace order by 1",
+            {"p": "pods", "l": "pod_labels"},
+            [
+                Eq(C("l", "pod_uid"), C("p", "uid")),
+                Eq(C(None, "key"), "app"),
+                Eq(C("l", "value"), "it's"),
+                Eq(C("p", "namespace"), "ml"),
+            ],
+        ),
+        (
+            "select 1 from kubernetes.pods, nodes n left join node_labels nl "
+            "on nl.node_uid = n.uid and nl.key = 'x' where n.name = pods.node_name",
+            {"pods": "kubernetes.pods", "n": "nodes", "nl": "node_labels"},
+            [
+                Eq(C("nl", "node_uid"), C("n", "uid"), outer=True),
+                Eq(C("nl", "key"), "x", outer=True),
+                Eq(C("n", "name"), C("pods", "node_name")),
+            ],
+        ),
+        # Conditions that aren't simple equalities joined by AND are ignored.
+        (
+            "select 1 from pods where (name = 'a') and not phase = 'b' and namespace like 'c' "
+            "and name = 'd' collate nocase and count(*) = 'e' and 'f' = 'g' and x = y",
+            {"pods": "pods"},
+            [Eq(C(None, "x"), C(None, "y"))],
+        ),
+        ("select 1 from pods where phase = 'a' and name = 'b' or 1", {"pods": "pods"}, []),
+        ("select 1 from pods where 1 or phase = 'a' and name = 'b'", {"pods": "pods"}, []),
+        # These are too complex to analyze.
+        ("select 1 from pods p, pods p", None, None),
+        ("select 1 from (select * from pods)", None, None),
+        ("select 1 from pods, json_each(pods.x)", None, None),
+        ("select 1 from pods where name in (select name from pods)", None, None),
+        ("with p as (select * from pods) select 1 from p", None, None),
+        ("select 1 from pods where case when 1 then 1 and name = 'a' end", None, None),
+        ("select 1 from pods where x between 1 and name = 'a'", None, None),
+        ("select 1 from pods union select 2 from nodes", None, None),
+        ("select 1", None, None),
+    ],
+)
+def test_equalities(sql, aliases: Optional[dict], equalities: Optional[list]):
+    """Verify analysis of table aliases and conditions."""
+    q = Query(sql)
+    if aliases is None:
+        assert q.aliases is None and q.equalities is None
+    else:
+        assert {alias: str(nt) for alias, nt in q.aliases.items()} == aliases
+        assert q.equalities == equalities
+
+
 def test_multiple_sqlite_dbs():
     """Verify we can directly map Kugl schemas to SQLite databases.
     This is huge; it means no transforms on SQL queries are needed."""
@@ -57,6 +118,127 @@ def test_multiple_sqlite_dbs():
     )
 
 
+def test_reads():
+    """Verify detection of tables and columns read, including the cases SQLite's authorizer
+    doesn't report."""
+    db = SqliteDb()
+    db.execute("create table a (x int, name text, z int)")
+    db.execute("create table b (y int, name text)")
+    assert db.reads("select x from a where z > 1") == {("main", "a"): {"x", "z"}}
+    assert db.reads("select count(*) from a") == {("main", "a"): set()}
+    assert db.reads("select a.x from a join b using (name)") == {
+        ("main", "a"): {"x", "name"},
+        ("main", "b"): {"name"},
+    }
+    assert db.reads("with a as (select 1 as x) select x from a") == {}
+
+
+@pytest.mark.parametrize(
+    "sql,expected",
+    [
+        ("select name from pods", {"pods": {"name"}}),
+        ("select count(*) from pods", {"pods": set()}),
+        ("with pods as (select 1 as name) select name from pods", {}),
+        (
+            "select p.name from pods p, nodes n where p.node_name = n.name and n.cpu_cap > 8",
+            {"pods": {"name", "node_name"}, "nodes": {"name", "cpu_cap"}},
+        ),
+        (
+            "select key from (select pod_uid, key from pod_labels) where key like 'a%'",
+            {"pod_labels": {"pod_uid", "key"}},
+        ),
+    ],
+)
+def test_plan(test_home, sql, expected):
+    """Verify the planner finds exactly the tables and columns a query reads.  The comma join
+    isn't recognized by Query, so this also checks that missing tables are added on demand."""
+    schemas = {"kubernetes": Registry.get().get_schema("kubernetes").read_configs([])}
+    plan = QueryPlanner(SqliteDb(), schemas, False).plan(Query(sql))
+    assert {table.name: columns for table, columns in plan.items()} == expected
+
+
+@pytest.mark.parametrize(
+    "sql,expected",
+    [
+        (
+            "select name from pods where phase = 'Running'",
+            {"pods": [("pods", {"phase": "Running"})]},
+        ),
+        # Conditions on all tables from a resource apply if they're joined on item keys.
+        (
+            "select p.name from pods p join pod_labels l on l.pod_uid = p.uid "
+            "join pod_labels m on p.uid = m.pod_uid join nodes n on n.name = p.node_name "
+            "where l.key = 'app' and l.value = 'web' and m.key = 'tier' and p.name = 'x' "
+            "and n.name = 'node-1'",
+            {
+                "pods": [
+                    ("pods", {"name": "x"}),
+                    ("pod_labels", {"key": "app", "value": "web"}),
+                    ("pod_labels", {"key": "tier"}),
+                ],
+                "nodes": [("nodes", {"name": "node-1"})],
+            },
+        ),
+        (
+            "select 1 from pods p left join pod_labels l on l.pod_uid = p.uid and l.key = 'x' "
+            "where p.phase = 'y'",
+            {"pods": [("pods", {"phase": "y"})]},
+        ),
+        # Not joined on item keys, or not at all
+        (
+            "select p.name from pods p join pod_labels l on l.value = p.name where l.key = 'app'",
+            {},
+        ),
+        ("select 1 from pods, pod_labels where phase = 'Running'", {}),
+        ("select 1 from pods p, pods q where p.phase = 'Running'", {}),
+        # node_taints has no item key, so can't be joined on one
+        (
+            "select 1 from nodes n join node_taints t on t.node_uid = n.uid where n.name = 'x'",
+            {},
+        ),
+    ],
+)
+def test_plan_conditions(test_home, sql, expected):
+    """Verify the planner finds conditions that apply to every item used from a resource."""
+    schemas = {"kubernetes": Registry.get().get_schema("kubernetes").read_configs([])}
+    planner = QueryPlanner(SqliteDb(), schemas, False)
+    query = Query(sql)
+    planner.plan(query)
+    conditions = planner.conditions(query)
+    assert {
+        resource_name: [(table.name, values) for table, values in table_conditions]
+        for (_, resource_name), table_conditions in conditions.items()
+    } == expected
+
+
+def test_plan_indexes(test_home):
+    """Verify the planner finds joined columns, and those compared with constants."""
+    schemas = {"kubernetes": Registry.get().get_schema("kubernetes").read_configs([])}
+    planner = QueryPlanner(SqliteDb(), schemas, False)
+    query = Query(
+        "select p.name from pods p join pod_labels l on l.pod_uid = p.uid "
+        "join nodes n on n.name = p.node_name where l.key = 'app' and p.uid = 'x'"
+    )
+    planner.plan(query)
+    assert {table.name: columns for table, columns in planner.indexes(query).items()} == {
+        "pods": {"uid": True, "node_name": True},
+        "pod_labels": {"pod_uid": True, "key": False},
+        "nodes": {"name": True},
+    }
+
+
+def test_plan_missing_table(test_home):
+    schemas = {"kubernetes": Registry.get().get_schema("kubernetes").read_configs([])}
+    with pytest.raises(sqlite3.OperationalError, match="no such table: foo"):
+        QueryPlanner(SqliteDb(), schemas, False).plan(Query("select * from pods, foo"))
+
+
+def test_shadowed_table_not_fetched(test_home):
+    """A CTE with the same name as a table means the table isn't used, so there should be no
+    attempt to fetch its resource (which would fail in this test.)"""
+    assert_query("with pods as (select 'x' as name) select name from pods", [["x"]])
+
+
 @pytest.mark.parametrize(
     "query,error",
     [
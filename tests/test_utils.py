@@ -2,10 +2,32 @@
 More assorted tests, should these be combined with test_misc.py?
 """
 
+import io
+import json
+
+import arrow
 import jmespath
 import pytest
 
-from kugl.util import Age, parse_size, to_size, debugging, debug_features, parse_cpu
+from kugl.impl.config import UserColumn
+from kugl.impl.extract import ChainFinder, compile_extractors, compile_path
+from kugl.impl.tables import RowContext
+from kugl.util import (
+    Age,
+    parse_size,
+    parse_sizes,
+    to_size,
+    debugging,
+    debug_features,
+    parse_cpu,
+    parse_cpus,
+    parse_utc,
+    to_utc,
+    iter_items,
+    ItemStream,
+    KuglError,
+)
+from .k8s.k8s_mocks import make_pod
 
 
 @pytest.mark.parametrize(
@@ -64,14 +86,28 @@ def test_age(input_args, input_kwargs, expected):
     "size_str, expected_result",
     [
         ("", "Can't translate '' to bytes"),
-        ("1n", "Can't translate '1n' to bytes"),
+        ("1x", "Can't translate '1x' to bytes"),
+        ("1ki", "Unknown size suffix in '1ki'"),
         ("15", 15.0),
+        ("1.5", 1.5),
         ("15K", 15.0 * 10**3),
         ("15Ki", 15.0 * 2**10),
         ("15M", 15.0 * 10**6),
         ("15Mi", 15.0 * 2**20),
         ("15G", 15.0 * 10**9),
         ("15Gi", 15.0 * 2**30),
+        ("15k", 15 * 10**3),
+        ("1.1Gi", 1181116006),
+        ("2P", 2 * 10**15),
+        ("2Pi", 2 * 2**50),
+        ("3E", 3 * 10**18),
+        ("3Ei", 3 * 2**60),
+        ("128974848000m", 128974848),
+        ("129e6", 129 * 10**6),
+        ("1.5E3", 1500),
+        ("12e-1", 1),
+        (1024, 1024),
+        (None, None),
     ],
 )
 def test_parse_size(size_str, expected_result):
@@ -90,7 +126,11 @@ def test_parse_size(size_str, expected_result):
         (2.0, 2.0),
         ("1.5", 1.5),
         ("300m", 0.3),
+        ("1e3", 1000.0),
+        ("2k", 2000.0),
+        ("250000u", 0.25),
         ("50x", "could not convert string to float"),
+        ("50ki", "could not convert string to float"),
     ],
 )
 def test_parse_cpu(cpu_str, expected_result):
@@ -101,6 +141,16 @@ def test_parse_cpu(cpu_str, expected_result):
         assert parse_cpu(cpu_str) == expected_result
 
 
+def test_parse_many():
+    """Verify batch parsing matches parsing one value at a time."""
+    sizes = ["1Gi", None, "500Mi", 10, "1Gi", "1.5"]
+    assert parse_sizes(sizes) == [parse_size(x) for x in sizes]
+    cpus = ["100m", "2", None, 1.5, "100m"]
+    assert parse_cpus(cpus) == [parse_cpu(x) for x in cpus]
+    with pytest.raises(ValueError, match="Can't translate 'x' to bytes"):
+        parse_sizes(["1", "x"])
+
+
 @pytest.mark.parametrize(
     "args,result",
     [
@@ -128,6 +178,37 @@ def test_to_size(args: tuple, result: str):
     assert to_size(*args) == result
 
 
+@pytest.mark.parametrize(
+    "utc_str",
+    [
+        "2024-03-01T23:04:15Z",
+        "2024-03-01T23:04:15.999999Z",
+        "2024-03-01T23:04:15+05:30",
+        "2024-03-01T23:04:15-01:00",
+        "2024-03-01",
+        "1969-12-31T23:59:59.5Z",
+    ],
+)
+def test_parse_utc(utc_str):
+    """Verify timestamps parse as they do with Arrow, whether or not they're in the formats
+    Kubernetes uses."""
+    assert parse_utc(utc_str) == arrow.get(utc_str).int_timestamp
+    # Again, from the cache
+    assert parse_utc(utc_str) == arrow.get(utc_str).int_timestamp
+
+
+def test_parse_utc_errors():
+    assert parse_utc(None) is None
+    assert parse_utc("") is None
+    with pytest.raises(ValueError):
+        parse_utc("2024-02-30T00:00:00Z")
+
+
+@pytest.mark.parametrize("epoch", [0, 1709334255, 1709334255.75, -100])
+def test_to_utc(epoch):
+    assert to_utc(epoch) == arrow.get(epoch).to("utc").format("YYYY-MM-DDTHH:mm:ss") + "Z"
+
+
 def test_jmespath_performance():
     """
     JMESPath performance regression test.  We use JMESPath to filter and transform
@@ -152,6 +233,73 @@ def test_jmespath_performance():
     assert result == ["pod-1", "pod-2"]
 
 
+@pytest.mark.parametrize(
+    "path,is_chain",
+    [
+        ("metadata.name", True),
+        ("spec.containers[0].image", True),
+        ("spec.containers[-1].name", True),
+        ("spec.containers[5].name", True),
+        ("metadata.name.first", True),
+        ("metadata.name[0]", True),
+        ("spec.containers.name", True),
+        ("spec.containers[0][0]", True),
+        ("metadata.labels.missing", True),
+        ('metadata."kubernetes.io/x"', True),
+        ("spec.containers[*].name", False),
+        ("spec.containers[?name == 'main'].image", False),
+        ("length(spec.containers)", False),
+        ("metadata.*", False),
+    ],
+)
+def test_compile_path(path, is_chain):
+    """Verify chains of fields and indexes are found, and evaluated exactly as by JMESPath."""
+    pod = make_pod("pod-1")
+    finder = compile_path(path)
+    assert isinstance(finder, ChainFinder) == is_chain
+    assert finder.search(pod) == jmespath.search(path, pod)
+    if is_chain:
+        assert finder.search(None) is None
+
+
+def test_compile_extractors():
+    """Verify a generated row extractor gives the same values as the columns' extractors."""
+    columns = [
+        UserColumn(name="name", path="metadata.name"),
+        UserColumn(name="owner", path="^metadata.name"),
+        UserColumn(name="command", path="command[0]"),
+        UserColumn(
+            name="restarts", path="^status.containerStatuses[0].restartCount", type="integer"
+        ),
+        UserColumn(name="missing", path="metadata.nothing.here"),
+        UserColumn(name="app", label="app"),
+        UserColumn(name="team", label=["team", "^team"]),
+        UserColumn(name="unwanted", path="metadata.name"),
+    ]
+    pod = make_pod("pod-1", labels=dict(app="web", team="a"))
+    container = dict(pod["spec"]["containers"][0], metadata=dict(name="c", labels=dict(app="x")))
+    context = RowContext({}, columns={c.name for c in columns} - {"unwanted"})
+    context.ancestors = (pod,)
+    extract = compile_extractors(
+        tuple(c.extractor for c in columns), tuple(context.wants(c.name) for c in columns)
+    )
+    expected = tuple(
+        c.extract(container, context) if context.wants(c.name) else None for c in columns
+    )
+    assert extract(container, context) == expected
+    assert expected[:4] == ("c", "pod-1", "echo", 0)
+    assert expected[-3:] == ("x", "a", None)
+    # A missing parent fails as it does for a single column.
+    context.ancestors = ()
+    with pytest.raises(KuglError, match="Missing parent or too many . while evaluating .metadata"):
+        extract(pod, context)
+    # Columns parsed again, as for another query, reuse the generated function.
+    again = [UserColumn(**c.model_dump(include={"name", "path", "label", "type"})) for c in columns]
+    wanted = tuple(context.wants(c.name) for c in columns)
+    assert compile_extractors(tuple(c.extractor for c in again), wanted) is extract
+    assert compile_extractors(tuple(c.extractor for c in again[1:]), wanted[1:]) is not extract
+
+
 def test_debug(capsys):
     FEATURE = "afeature"
     assert debugging(FEATURE) is None
@@ -160,3 +308,117 @@ def test_debug(capsys):
     assert capsys.readouterr().err == "afeature: hello there\n"
     debug_features([FEATURE], False)
     assert debugging(FEATURE) is None
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1 << 16])
+def test_iter_items(chunk_size):
+    """Verify incremental decoding, with chunk boundaries falling everywhere, including inside
+    numbers that could be decoded wrongly if cut short."""
+    doc = {
+        "apiVersion": "v1",
+        "items": [{"a": 12345, "b": [1.5e10, None, True]}, {"c": 'x"y}'}, 678, [], {}],
+        "kind": "List",
+        "metadata": {"n": -90},
+    }
+    text = json.dumps(doc, indent=2)
+    fields = {}
+    assert list(iter_items(io.StringIO(text), fields, chunk_size=chunk_size)) == doc["items"]
+    assert fields == {"apiVersion": "v1", "kind": "List", "metadata": {"n": -90}}
+
+
+@pytest.mark.parametrize(
+    "text,items,fields",
+    [
+        ("{}", [], {}),
+        (' { "items" : [ ] } ', [], {}),
+        ('{"items": null, "x": 1}', [], {"items": None, "x": 1}),
+        ('{"other": [1, 2]}', [], {"other": [1, 2]}),
+    ],
+)
+def test_iter_items_edge_cases(text, items, fields):
+    found = {}
+    assert list(iter_items(io.StringIO(text), found, chunk_size=2)) == items
+    assert found == fields
+
+
+@pytest.mark.parametrize(
+    "text,error",
+    [
+        ("", "expected one of {"),
+        ("[1, 2]", "expected one of {"),
+        ('{"items": [1, 2}', "expected one of , ]"),
+        ('{"items": [1, 2]', "found end of input"),
+        ("{1: 2}", "expected a member name"),
+        ('{"items": [{"a": 1]}', "Expecting ','"),
+    ],
+)
+def test_iter_items_errors(text, error):
+    with pytest.raises(ValueError, match=error):
+        list(iter_items(io.StringIO(text), {}, chunk_size=3))
+
+
+def test_item_stream(tmp_path):
+    """Verify an ItemStream consumes its source once, and can be iterated repeatedly."""
+    consumed = []
+
+    def source(fields):
+        fields["kind"] = "List"
+        for i in range(3):
+            consumed.append(i)
+            yield {"i": i}
+        fields["metadata"] = {}
+
+    fields = {}
+    stream = ItemStream(source(fields), fields)
+    path = tmp_path / "data.json"
+    stream.spool(path)
+    assert consumed == [0, 1, 2]
+    assert path.read_text().startswith(ItemStream.PREFIX)
+    expected = {"items": [{"i": 0}, {"i": 1}, {"i": 2}], "kind": "List", "metadata": {}}
+    assert json.loads(path.read_text()) == expected
+    for _ in range(2):
+        assert list(stream["items"]) == expected["items"]
+    assert consumed == [0, 1, 2]
+    assert stream.to_dict() == expected
+    assert dict(stream)["kind"] == "List"
+
+    stream = ItemStream.from_file(path)
+    assert stream["metadata"] == {}
+    assert list(stream["items"]) == expected["items"]
+    assert len(stream) == 3
+
+
+def test_item_stream_temp_file():
+    """Verify a stream not spooled explicitly goes to a temporary file that's later removed."""
+    stream = ItemStream(iter([{"i": 0}]), {})
+    assert list(stream["items"]) == [{"i": 0}]
+    path = stream._path
+    assert path.exists()
+    del stream
+    assert not path.exists()
+
+
+def test_item_stream_binary(tmp_path):
+    """Verify the binary format holds the same data as JSON, and that files in other binary
+    formats are recognized as unreadable."""
+    doc = {"items": [{"a": [1, 2.5, None, True]}, {"b": "c"}], "kind": "List", "metadata": {}}
+    fields = {"kind": "List", "metadata": {}}
+    path = tmp_path / "data.bin"
+    stream = ItemStream(iter(doc["items"]), fields)
+    stream.spool(path, binary=True)
+    assert ItemStream.file_format(path) == "binary"
+    for _ in range(2):
+        assert list(stream["items"]) == doc["items"]
+    assert stream.to_dict() == doc
+
+    stream = ItemStream.from_file(path, binary=True)
+    assert stream["kind"] == "List"
+    assert stream.to_dict() == doc
+
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(ValueError, match="truncated"):
+        list(ItemStream.from_file(path, binary=True)["items"])
+    path.write_bytes(b'KUGL\x00{"format": 1, "marshal": -1}\n')
+    assert ItemStream.file_format(path) is None
+    path.write_text(json.dumps(doc, indent=2))
+    assert ItemStream.file_format(path) == "json"
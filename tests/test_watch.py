@@ -0,0 +1,125 @@
+"""
+Tests for keeping cached data current with watches.
+"""
+
+import json
+import os
+from pathlib import Path
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from kugl.impl import watch
+from kugl.impl.config import Settings
+from kugl.impl.engine import Engine, CHECK
+from kugl.impl.watch import Watcher, Watches
+from kugl.util import UNIT_TEST_TIMEBASE, Query, clock, kugl_cache
+from .k8s.k8s_mocks import kubectl_response, make_node, make_pod
+
+
+@pytest.fixture
+def watches(test_home, monkeypatch):
+    monkeypatch.setattr(Watcher, "PAUSE", 0.01)
+    monkeypatch.setattr(watch, "WATCHES", Watches())
+    yield watch.WATCHES
+    watch.WATCHES.stop()
+
+
+def run_query(sql: str, **kwargs):
+    args = SimpleNamespace(all=False, namespace=None)
+    rows, _ = Engine(args, CHECK, Settings(**kwargs)).query(Query(sql))
+    return rows
+
+
+def wait_for(condition):
+    deadline = time.time() + 10
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def node_event(kind: str, name: str, version: int, **kwargs) -> str:
+    node = make_node(name, **kwargs)
+    node["metadata"]["resourceVersion"] = str(version)
+    return json.dumps({"type": kind, "object": node})
+
+
+def test_watch_nodes(watches):
+    """Verify watch events are applied to the cache, and the data isn't listed again."""
+    path = kugl_cache() / "kubernetes/nocontext/default.nodes.json"
+    kubectl_response("nodes", {"items": [make_node("node-1"), make_node("node-2")]})
+    assert run_query("SELECT name FROM nodes ORDER BY 1") == [["node-1"], ["node-2"]]
+    (watcher,) = watches._watchers.values()
+    wait_for(lambda: watcher._ready)
+
+    # Once the watch is working, the cache file is rewritten just once.
+    assert run_query("SELECT name FROM nodes ORDER BY 1") == [["node-1"], ["node-2"]]
+    mtime = path.stat().st_mtime_ns
+    assert run_query("SELECT name FROM nodes ORDER BY 1") == [["node-1"], ["node-2"]]
+    assert path.stat().st_mtime_ns == mtime
+
+    # Changes to the list aren't seen, but events are.
+    kubectl_response("nodes", {"items": []})
+    events = [
+        node_event("ADDED", "node-3", 2),
+        node_event("BOOKMARK", "node-3", 3),
+        node_event("MODIFIED", "node-1", 4, labels={"a": "b"}),
+        node_event("DELETED", "node-2", 5),
+    ]
+    kubectl_response("nodes_events", "\n".join(events))
+    wait_for(lambda: "uid-node-2" not in watcher._items)
+    assert run_query("SELECT name FROM nodes ORDER BY 1") == [["node-1"], ["node-3"]]
+    assert run_query("SELECT key FROM node_labels WHERE node_uid = 'uid-node-1'") == [["a"]]
+
+
+def test_watch_error(watches):
+    """Verify the items are listed again if a watch reports an error."""
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    assert run_query("SELECT name FROM nodes") == [["node-1"]]
+    (watcher,) = watches._watchers.values()
+    wait_for(lambda: watcher._ready)
+    # The new list is more recent than the error, so it won't be seen again.
+    newer_list = {"items": [make_node("node-2")], "metadata": {"resourceVersion": "10"}}
+    kubectl_response("nodes", newer_list)
+    error = {"kind": "Status", "message": "too old", "metadata": {"resourceVersion": "9"}}
+    kubectl_response("nodes_events", json.dumps({"type": "ERROR", "object": error}))
+    wait_for(lambda: "uid-node-2" in watcher._items)
+    assert run_query("SELECT name FROM nodes") == [["node-2"]]
+
+
+def test_watch_pods(watches):
+    """Verify pods are watched, and their status follows the events."""
+    kubectl_response("pods", {"items": [make_pod("pod-1")]})
+    assert run_query("SELECT name, status FROM pods") == [["pod-1", "Running"]]
+    (watcher,) = watches._watchers.values()
+    wait_for(lambda: watcher._ready)
+    pod = make_pod("pod-1", deletion_ts=UNIT_TEST_TIMEBASE + 60)
+    pod["metadata"]["resourceVersion"] = "2"
+    kubectl_response("pods_events", json.dumps({"type": "MODIFIED", "object": pod}))
+    wait_for(lambda: "deletionTimestamp" in watcher._items["uid-pod-1"]["metadata"])
+    assert run_query("SELECT name, status FROM pods") == [["pod-1", "Terminating"]]
+
+
+def test_watch_hung(watches):
+    """Verify a watch that goes silent is timed out, and the cache isn't considered current."""
+    path = kugl_cache() / "kubernetes/nocontext/default.nodes.json"
+    kubectl_response("nodes", {"items": [make_node("node-1")]})
+    assert run_query("SELECT name FROM nodes") == [["node-1"]]
+    (watcher,) = watches._watchers.values()
+    wait_for(lambda: watcher._ready)
+    command = " ".join(watcher.resource.watch_command("5", Watcher.TIMEOUT))
+    assert "timeoutSeconds=300" in command and command.endswith("--request-timeout=330s")
+    assert watcher.sync(path)
+
+    # Hang the next watch.  Until the silence is too long, the cache is current.
+    hang = Path(os.getenv("KUGL_MOCKDIR")).joinpath("hang")
+    hang.write_text("")
+    wait_for(lambda: hang.read_text())
+    assert watcher.sync(path)
+    clock.CLOCK.sleep(Watcher.SILENCE + 1)
+    hang.unlink()
+    assert not watcher.sync(path)
+
+    # The hung watch is ended, and the items listed again.
+    wait_for(lambda: watcher.sync(path))